@@ -0,0 +1,7 @@
+"""
+Benchmarks for the analysis pipeline, run on deterministic synthetic data.  Run them with
+`python -m mousetracker.benchmarks`; see `suite.run`.
+"""
+from mousetracker.benchmarks.synthetic import SyntheticVideo, eye_area_trace, whisker_angle_trace
+from mousetracker.benchmarks.suite import run
+from mousetracker.benchmarks.imports import bench_imports, check_import_budgets
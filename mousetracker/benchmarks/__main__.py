@@ -0,0 +1,50 @@
+"""
+Run the benchmark suite and save the results as JSON.
+
+Usage:
+    python -m mousetracker.benchmarks [-o <output_file>] [--width <px>] [--height <px>] [--framerate <fps>]
+                                      [--frames <n>...] [--samples <n>...] [--repeat <n>]
+    python -m mousetracker.benchmarks --check-imports
+"""
+import argparse
+import sys
+
+from mousetracker.benchmarks.imports import check_import_budgets
+from mousetracker.benchmarks.suite import FRAME_SIZES, SIGNAL_SIZES, run
+from mousetracker.benchmarks.synthetic import SyntheticVideo
+
+
+def main(argv) -> int:
+    parser = argparse.ArgumentParser(prog='python -m mousetracker.benchmarks', description=__doc__.split('\n')[1])
+    parser.add_argument('-o', '--output', default='benchmark.json', help='the JSON file to write')
+    parser.add_argument('--width', type=int, default=320, help='synthetic frame width, in pixels')
+    parser.add_argument('--height', type=int, default=240, help='synthetic frame height, in pixels')
+    parser.add_argument('--framerate', type=int, default=240, help='synthetic frame rate')
+    parser.add_argument('--frames', type=int, nargs='+', default=FRAME_SIZES, help='frame counts to time')
+    parser.add_argument('--samples', type=int, nargs='+', default=SIGNAL_SIZES, help='signal lengths to time')
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs per case')
+    parser.add_argument('--check-imports', action='store_true',
+                        help='only check import times against their budgets; exit 1 if any is over')
+    args = parser.parse_args(argv)
+    if args.check_imports:
+        try:
+            results = check_import_budgets(repeat=args.repeat)
+        except AssertionError as e:
+            print(f'import budget exceeded: {e}')
+            return 1
+        for r in results:
+            print(f"{r['module']:<32} {r['seconds']:8.3f} s (budget {r['budget']} s)")
+        return 0
+    video = SyntheticVideo(width=args.width, height=args.height, framerate=args.framerate)
+    report = run(video, args.frames, args.samples, args.repeat, args.output)
+    for r in report['results']:
+        print(f"{r['benchmark']:<24} {r['size']:>9} {r['unit']:<8} {r['seconds']:10.4f} s "
+              f"{r['throughput']:14.1f} {r['unit']}/s {r['peak_bytes'] / 2 ** 20:9.1f} MiB")
+    for r in report['imports']:
+        print(f"{r['benchmark']:<24} {r['seconds']:10.4f} s (budget {r['budget']} s){'' if r['ok'] else ' FAILED'}")
+    print(f"results saved to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
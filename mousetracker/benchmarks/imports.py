@@ -0,0 +1,65 @@
+"""
+Import-time benchmarks.  Each entry point is imported in a fresh interpreter, so nothing is already cached, and is
+checked against a time budget and a list of heavy modules it must not pull in.
+"""
+import json
+import subprocess
+import sys
+from typing import Dict, List
+
+# entry point -> (module imported, budget in seconds, modules that must not be loaded)
+IMPORT_BUDGETS = {'config': ('mousetracker.core.yaml_config', 0.5, ('cv2', 'matplotlib', 'scipy', 'pandas')),
+                  'eyes': ('mousetracker.core.eyes', 1.5, ('matplotlib', 'scipy')),
+                  'package': ('mousetracker.core', 0.25, ('cv2', 'matplotlib', 'scipy', 'pandas', 'yaml'))}
+
+_PROBE = """
+import json, sys, time
+before = set(sys.modules)
+tic = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - tic
+print(json.dumps({{'seconds': seconds, 'loaded': sorted(set(sys.modules) - before)}}))
+"""
+
+
+def time_import(module: str) -> Dict:
+    """
+    Import a module in a fresh interpreter.
+    :param module: the module to import.
+    :return: a dict with seconds (the time the import took) and loaded (every module it loaded).
+    """
+    result = subprocess.run([sys.executable, '-c', _PROBE.format(module=module)], stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE, check=True)
+    return json.loads(result.stdout.decode().strip().splitlines()[-1])
+
+
+def bench_imports(budgets: Dict = None, repeat: int = 3) -> List[Dict]:
+    """
+    Time each entry point's import and check it against its budget.
+    :param budgets: see IMPORT_BUDGETS.
+    :param repeat: imports per entry point; the fastest is reported.
+    :return: one record per entry point, with benchmark, module, seconds, budget, forbidden (the forbidden modules
+    that were loaded) and ok.
+    """
+    results = []
+    for name, (module, budget, forbidden) in (budgets or IMPORT_BUDGETS).items():
+        runs = [time_import(module) for _ in range(repeat)]
+        seconds = min(r['seconds'] for r in runs)
+        loaded = {m.split('.')[0] for m in runs[0]['loaded']}
+        bad = sorted(loaded.intersection(forbidden))
+        results.append({'benchmark': f'import.{name}', 'module': module, 'seconds': seconds, 'budget': budget,
+                        'forbidden': bad, 'ok': seconds <= budget and not bad})
+    return results
+
+
+def check_import_budgets(budgets: Dict = None, repeat: int = 3) -> List[Dict]:
+    """
+    Like `bench_imports`, but fail if any entry point is over budget or loads a forbidden module.
+    :raises AssertionError: listing every entry point that failed.
+    """
+    results = bench_imports(budgets, repeat)
+    failed = [r for r in results if not r['ok']]
+    assert not failed, '; '.join(f"{r['module']} took {r['seconds']:.3f} s (budget {r['budget']} s)" +
+                                 (f" and loaded {', '.join(r['forbidden'])}" if r['forbidden'] else '')
+                                 for r in failed)
+    return results
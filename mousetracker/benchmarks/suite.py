@@ -0,0 +1,210 @@
+"""
+The benchmark suite.  Each benchmark runs a pipeline step on synthetic data of several sizes and records wall time,
+throughput and peak memory.  Peak memory is measured with tracemalloc, which sees allocations made by Python and
+NumPy but not those made inside OpenCV.
+"""
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from logging import info
+from types import SimpleNamespace
+from typing import Callable, Dict, List, Optional, Sequence
+
+import cv2
+import numpy as np
+import pandas as pd
+
+from mousetracker.benchmarks.imports import bench_imports
+from mousetracker.benchmarks.synthetic import SyntheticVideo, eye_area_trace, whisker_angle_trace
+from mousetracker.core import checkpoint, frameindex
+from mousetracker.core._version import __version__
+from mousetracker.core.eyes import _red_mask, compute_areas, find_blinks, make_windows, red_grey, red_lut
+from mousetracker.core.util.detect_peaks import detect_peaks
+from mousetracker.core.util.signal_processing import lowpass
+from mousetracker.core.whiskers import filter_raw
+
+FRAME_SIZES = (48, 240)
+SIGNAL_SIZES = (10_000, 100_000, 1_000_000)
+# (width, height): a small test frame, and one half of our camera's frame.
+RESOLUTIONS = ((320, 240), (540, 720))
+
+
+def measure(func: Callable, repeat: int = 3) -> Dict:
+    """
+    Time a function and measure its peak memory.
+    :param func: a function of no arguments.
+    :param repeat: the number of timed runs; the fastest is reported.
+    :return: a dict with seconds (best of `repeat`) and peak_bytes (from one extra, traced, run).
+    """
+    func()  # warm up caches and lazy imports.
+    best = float('inf')
+    for _ in range(repeat):
+        tic = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - tic)
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {'seconds': best, 'peak_bytes': peak}
+
+
+def _result(name: str, size: int, unit: str, stats: Dict) -> Dict:
+    return {'benchmark': name, 'size': size, 'unit': unit, 'seconds': stats['seconds'],
+            'throughput': size / stats['seconds'] if stats['seconds'] else float('inf'),
+            'peak_bytes': stats['peak_bytes']}
+
+
+def bench_compute_areas(video: SyntheticVideo, sizes: Sequence[int] = FRAME_SIZES, repeat: int = 3) -> List[Dict]:
+    """ `compute_areas` over pre-decoded frames; throughput is frames/s."""
+    results = []
+    for size in sizes:
+        frames = [video.frame(i) for i in range(size)]
+        stats = measure(lambda: [compute_areas(f) for f in frames], repeat)
+        results.append(_result('compute_areas', size, 'frames', stats))
+    return results
+
+
+def bench_red_mask(resolutions: Sequence = RESOLUTIONS, nframes: int = 8, repeat: int = 3) -> List[Dict]:
+    """
+    The red mask, by HSV conversion (`_red_mask`) and by lookup table (`red_grey`), on synthetic frames as drawn
+    (every pixel noisy) and smoothed (closer to what a camera delivers); throughput is pixels/s.  That the two agree
+    is tested in tests/test_eyes.py.
+    """
+    red_lut()  # built once per process, so not part of the per-frame cost.
+    results = []
+    for width, height in resolutions:
+        video = SyntheticVideo(width=width, height=height)
+        noisy = [video.frame(i) for i in range(nframes)]
+        for kind, frames in (('', noisy), ('.smooth', [cv2.GaussianBlur(f, (0, 0), 2) for f in noisy])):
+            by_hsv = lambda: [_red_mask(cv2.cvtColor(f, cv2.COLOR_BGR2HSV)) for f in frames]
+            by_lut = lambda: [red_grey(f) for f in frames]
+            size = width * height * nframes
+            results.append(_result('red_mask.hsv' + kind, size, 'pixels', measure(by_hsv, repeat)))
+            results.append(_result('red_mask.lut' + kind, size, 'pixels', measure(by_lut, repeat)))
+    return results
+
+
+def bench_seek(video: SyntheticVideo, codecs: Sequence[str] = ('MJPG', 'MPEG'), nseeks: int = 10,
+               repeat: int = 3) -> List[Dict]:
+    """
+    Random access into an encoded video: seeking with `cv2.CAP_PROP_POS_FRAMES` and through a `FrameIndex` (see
+    `frameindex`), each followed by reading the frame, and building the index; throughput is seeks/s, and frames/s
+    for building.  MJPG has only keyframes; MPEG, which analyze_bout writes, has a keyframe every few frames.
+    """
+    targets = [int(n) for n in np.random.RandomState(0).randint(0, video.nframes, nseeks)]
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for codec in codecs:
+            filename = video.write(os.path.join(tmp, f'benchmark-{codec}.avi'), codec)
+            index = frameindex.build(filename)
+            cap = cv2.VideoCapture(filename, cv2.CAP_FFMPEG)
+            try:
+                def by_decoder():
+                    for n in targets:
+                        cap.set(cv2.CAP_PROP_POS_FRAMES, n)
+                        cap.read()
+
+                def by_index():
+                    for n in targets:
+                        index.seek(cap, n)
+                        cap.read()
+
+                results.append(_result(f'seek.opencv.{codec}', nseeks, 'seeks', measure(by_decoder, repeat)))
+                results.append(_result(f'seek.index.{codec}', nseeks, 'seeks', measure(by_index, repeat)))
+            finally:
+                cap.release()
+            results.append(_result(f'frameindex.build.{codec}', index.nframes, 'frames',
+                                    measure(lambda: frameindex.build(filename), repeat)))
+    return results
+
+
+def bench_signals(sizes: Sequence[int] = SIGNAL_SIZES, framerate: int = 240, repeat: int = 3) -> List[Dict]:
+    """ the per-sample steps: blink detection, blink windows and filtering; throughput is samples/s."""
+    results = []
+    # filter_raw only needs the frame rate from the configuration.
+    params = SimpleNamespace(camera=SimpleNamespace(framerate=framerate))
+    for size in sizes:
+        area = pd.Series(eye_area_trace(size, framerate))
+        angle = whisker_angle_trace(size, framerate)
+        whiskdat = pd.DataFrame({'frameid': np.arange(size), 'mean_degrees': angle,
+                                 'num_whiskers': 5, 'stderr': 0.0})
+        cases = [('detect_peaks', lambda: detect_peaks(area.to_numpy(), mpd=120, valley=True)),
+                 ('find_blinks', lambda: find_blinks(area)),
+                 ('make_windows', lambda: make_windows(area, 500, fs=framerate)),
+                 ('lowpass', lambda: lowpass(angle, framerate)),
+                 ('filter_raw', lambda: filter_raw(whiskdat, params, 'benchmark'))]
+        results.extend(_result(name, size, 'samples', measure(func, repeat)) for name, func in cases)
+    return results
+
+
+def bench_checkpoints(sizes: Sequence[int] = SIGNAL_SIZES, formats: Optional[Sequence[str]] = None,
+                      repeat: int = 3) -> List[Dict]:
+    """ checkpoint save and load of a summary-shaped table, in each available format; throughput is rows/s."""
+    formats = formats or sorted({'csv', 'npy', checkpoint.default_format()})
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        name = os.path.join(tmp, 'benchmark-summary.csv')
+        for size in sizes:
+            table = pd.DataFrame({'frameid': np.arange(size), 'left_mean_degrees': whisker_angle_trace(size),
+                                  'left_fitted_area': eye_area_trace(size)})
+            for fmt in formats:
+                results.append(_result(f'checkpoint.save.{fmt}', size, 'rows',
+                                       measure(lambda: checkpoint.save(table, name, fmt), repeat)))
+                results.append(_result(f'checkpoint.load.{fmt}', size, 'rows',
+                                       measure(lambda: checkpoint.load(name, fmt=fmt), repeat)))
+    return results
+
+
+def _commit() -> Optional[str]:
+    """ the git commit of the source tree, if it is a git checkout."""
+    try:
+        result = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    except OSError:
+        return None
+    return result.stdout.decode().strip() or None
+
+
+def run(video: Optional[SyntheticVideo] = None, frame_sizes: Sequence[int] = FRAME_SIZES,
+        signal_sizes: Sequence[int] = SIGNAL_SIZES, repeat: int = 3, output: Optional[str] = None) -> Dict:
+    """
+    Run every benchmark.
+    :param video: the synthetic recording to draw frames from (default: `SyntheticVideo()`).
+    :param frame_sizes: the numbers of frames to time per-frame steps on.
+    :param signal_sizes: the signal lengths to time per-sample steps on.
+    :param repeat: timed runs per case; the fastest is reported.
+    :param output: a JSON file to write the results to.
+    :return: the results: run metadata, and a list of per-case records with benchmark, size, unit, seconds,
+    throughput (units/s) and peak_bytes; and import times, as from `imports.bench_imports`.
+    """
+    video = video or SyntheticVideo()
+    results = []
+    info('benchmarking compute_areas')
+    results.extend(bench_compute_areas(video, frame_sizes, repeat))
+    info('benchmarking the red mask')
+    results.extend(bench_red_mask(repeat=repeat))
+    info('benchmarking seeks')
+    results.extend(bench_seek(video, repeat=repeat))
+    info('benchmarking signal processing')
+    results.extend(bench_signals(signal_sizes, video.framerate, repeat))
+    info('benchmarking checkpoint i/o')
+    results.extend(bench_checkpoints(signal_sizes, repeat=repeat))
+    info('benchmarking imports')
+    imports = bench_imports(repeat=repeat)
+    report = {'version': __version__, 'commit': _commit(), 'timestamp': datetime.now().isoformat(),
+              'python': platform.python_version(), 'platform': platform.platform(), 'numpy': np.__version__,
+              'pandas': pd.__version__, 'video': {'width': video.width, 'height': video.height,
+                                                  'framerate': video.framerate},
+              'results': results, 'imports': imports}
+    if output:
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=1)
+    return report
@@ -0,0 +1,139 @@
+"""
+Deterministic synthetic recordings for benchmarks: a red elliptical eye that blinks on a fixed schedule, and a fan of
+whiskers that sweep back and forth.  The same parameters always produce the same pixels, so timings from different
+commits are comparable.
+"""
+import math
+from typing import Iterator
+
+import attr
+import cv2
+import numpy as np
+from attr.validators import instance_of
+
+
+@attr.s(frozen=True)
+class SyntheticVideo(object):
+    """
+    A scripted recording of one side of a face.
+    :param width: frame width, in pixels.
+    :param height: frame height, in pixels.
+    :param framerate: frames per second.
+    :param duration: length of the recording, in seconds.
+    :param blink_interval: seconds between the start of one blink and the next.
+    :param blink_duration: length of a blink, in milliseconds.
+    :param num_whiskers: the number of whiskers to draw.
+    :param whisk_frequency: whisking rate, in Hz.
+    :param whisker_color: 'white' or 'black'.
+    :param seed: seeds the background noise.
+    """
+    width = attr.ib(default=320, validator=instance_of(int))
+    height = attr.ib(default=240, validator=instance_of(int))
+    framerate = attr.ib(default=240, validator=instance_of(int))
+    duration = attr.ib(default=1.0, convert=float)
+    blink_interval = attr.ib(default=2.0, convert=float)
+    blink_duration = attr.ib(default=100.0, convert=float)
+    num_whiskers = attr.ib(default=5, validator=instance_of(int))
+    whisk_frequency = attr.ib(default=8.0, convert=float)
+    whisker_color = attr.ib(default='white')
+    seed = attr.ib(default=0, validator=instance_of(int))
+
+    @property
+    def nframes(self) -> int:
+        return int(round(self.duration * self.framerate))
+
+    def _blink_schedule(self):
+        """ the blink period, and the number of frames it takes the eye to shut (and to reopen)."""
+        period = int(round(self.blink_interval * self.framerate))
+        half = max(int(round(self.blink_duration * self.framerate / 2000)), 1)
+        return period, half
+
+    def openness(self, i: int) -> float:
+        """ how open the eye is in frame `i`, from 0 (shut) to 1.  Blinks close and reopen the eye linearly."""
+        period, half = self._blink_schedule()
+        # the first blink comes half an interval in, so short recordings still contain one.
+        phase = (i - period // 2) % period
+        return min(abs(phase - half) / half, 1.0)
+
+    def blink_frames(self) -> np.ndarray:
+        """ the frame at which the eye is shut in each blink."""
+        period, half = self._blink_schedule()
+        return np.arange(period // 2 + half, self.nframes, period, dtype=np.int64)
+
+    def whisker_angle(self, i: int) -> float:
+        """ the mean whisker angle in frame `i`, in degrees."""
+        return 20 * math.sin(2 * math.pi * self.whisk_frequency * i / self.framerate)
+
+    def frame(self, i: int) -> np.ndarray:
+        """
+        Draw one frame.
+        :param i: the frame number.
+        :return: a (height, width, 3) BGR image.
+        """
+        rng = np.random.default_rng((self.seed, i))
+        img = rng.integers(40, 90, (self.height, self.width, 3), dtype=np.uint8)
+        center = (self.width // 3, self.height // 3)
+        # a shut eye still shows a sliver, as a real one does.
+        axes = (max(self.width // 8, 2), max(int(round(self.height / 8 * self.openness(i))), 3))
+        cv2.ellipse(img, center, axes, 0, 0, 360, (30, 30, 210), -1)
+        # whiskers fan out from a pad below and to the side of the eye.
+        pad = (self.width // 2, 2 * self.height // 3)
+        color = (255, 255, 255) if self.whisker_color == 'white' else (0, 0, 0)
+        length = self.width // 2
+        for k in range(self.num_whiskers):
+            theta = math.radians(self.whisker_angle(i) + (k - self.num_whiskers / 2) * 8)
+            tip = (int(pad[0] + length * math.cos(theta)), int(pad[1] - length * math.sin(theta)))
+            cv2.line(img, (pad[0], pad[1] + 4 * k), tip, color, 1)
+        return img
+
+    def frames(self) -> Iterator[np.ndarray]:
+        """ every frame, in order."""
+        return (self.frame(i) for i in range(self.nframes))
+
+    def write(self, filename: str, fourcc: str = 'MJPG') -> str:
+        """
+        Encode the recording to a video file.
+        :param filename: the file to write.
+        :param fourcc: the codec.
+        :return: `filename`.
+        """
+        writer = cv2.VideoWriter(filename, cv2.VideoWriter_fourcc(*fourcc), self.framerate,
+                                 (self.width, self.height))
+        try:
+            for img in self.frames():
+                writer.write(img)
+        finally:
+            writer.release()
+        return filename
+
+
+def eye_area_trace(nsamples: int, framerate: int = 240, blink_interval: float = 2.0, seed: int = 0) -> np.ndarray:
+    """
+    A synthetic fitted-eye-area signal, with a blink dip every `blink_interval` seconds and measurement noise, for
+    benchmarking the signal-domain steps without decoding video.
+    :param nsamples: the signal length.
+    :param framerate: samples per second.
+    :param blink_interval: seconds between blinks.
+    :param seed: seeds the noise.
+    :return: the signal.
+    """
+    rng = np.random.default_rng(seed)
+    period = int(round(blink_interval * framerate))
+    phase = (np.arange(nsamples) - period // 2) % period
+    dip = np.clip(1 - np.abs(phase - 12) / 12, 0, None)
+    return 5000 * (1 - 0.9 * dip) + rng.normal(0, 50, nsamples)
+
+
+def whisker_angle_trace(nsamples: int, framerate: int = 240, whisk_frequency: float = 8.0,
+                        seed: int = 0) -> np.ndarray:
+    """
+    A synthetic mean-whisker-angle signal: whisking plus noise.
+    :param nsamples: the signal length.
+    :param framerate: samples per second.
+    :param whisk_frequency: whisking rate, in Hz.
+    :param seed: seeds the noise.
+    :return: the signal, in degrees.
+    """
+    rng = np.random.default_rng(seed)
+    t = np.arange(nsamples) / framerate
+    return 20 * np.sin(2 * np.pi * whisk_frequency * t) + rng.normal(0, 2, nsamples)
@@ -1,6 +1,37 @@
-from mousetracker.core.analysis import *
+"""
+The analysis pipeline.  Submodules, and the public names they define, are imported on first use (PEP 562), so that
+importing one part of the package (e.g. `yaml_config` for a CLI, or `eyes` in a worker process) does not pay for
+OpenCV, matplotlib and scipy.
+"""
+import importlib
+import importlib.util
+
 from mousetracker.core._version import *
-from mousetracker.core.base import *
-from mousetracker.core.eyes import *
-from mousetracker.core.whiskers import *
-from mousetracker.core.yaml_config import *
+
+# modules whose public names are available directly from `mousetracker.core`.  Where two define the same name, the
+# later one wins, as it did when these were star-imported in this order.
+_EXPORTING = ('analysis', 'base', 'eyes', 'whiskers', 'yaml_config')
+
+
+def __getattr__(name: str):
+    if name == '__all__':
+        # `from mousetracker.core import *` still gets everything, at the cost of importing everything.
+        names = {n for m in _EXPORTING for n in vars(importlib.import_module(f'{__name__}.{m}')) if n[0] != '_'}
+        return sorted(names)
+    if name.startswith('__'):
+        raise AttributeError(name)
+    if importlib.util.find_spec(f'{__name__}.{name}') is not None:
+        return importlib.import_module(f'{__name__}.{name}')
+    for module in reversed(_EXPORTING):
+        value = getattr(importlib.import_module(f'{__name__}.{module}'), name, _MISSING)
+        if value is not _MISSING and not name.startswith('_'):
+            globals()[name] = value
+            return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_EXPORTING))
+
+
+_MISSING = object()
@@ -1,35 +1,159 @@
 from mousetracker.core.base import *
-import matplotlib
-import matplotlib.pyplot as plt
+from mousetracker.core import checkpoint
+from mousetracker.core.eyes import blink_window_matrix, find_blinks, overlay_stats
+from mousetracker.core.util.spectral import band_power_per_second, whisking_summary
+import numpy as np
 import pandas as pd
-from matplotlib.backends.backend_pdf import PdfPages
 from datetime import datetime
 
+# summary pages are letter-sized; at 150 dpi the axes are about 1280 pixels across, and a min/max pair per pixel
+# column is all a line needs.
+PAGE_SIZE = (11, 8.5)
+RASTER_DPI = 150
+MAX_POINTS = 2560
 
-matplotlib.use('PDF')
 
+def minmax_decimate(x, y, max_points: int = MAX_POINTS):
+    """
+    Reduce a line to at most `max_points` points that draw the same at screen resolution.  The samples are split into
+    `(max_points - 2) // 2` consecutive bins, and the smallest and largest sample of each bin are kept, in their
+    original order, along with the first and last samples so that the line spans the same range.
+    :param x: sample positions.
+    :param y: sample values; NaN samples are dropped unless a whole bin is NaN.
+    :param max_points: the most points to return; at least 4.
+    :return: decimated x and y arrays.
+    """
+    if max_points < 4:
+        raise ValueError("max_points must be at least 4")
+    x, y = np.asarray(x), np.asarray(y, dtype=float)
+    if len(y) <= max_points:
+        return x, y
+    nbins = (max_points - 2) // 2
+    size = -(-len(y) // nbins)
+    padded = np.full(nbins * size, np.nan)
+    padded[:len(y)] = y
+    binned = padded.reshape(nbins, size)
+    missing = np.isnan(binned)
+    lo = np.argmin(np.where(missing, np.inf, binned), axis=1)
+    hi = np.argmax(np.where(missing, -np.inf, binned), axis=1)
+    idx = np.sort(np.stack((lo, hi), axis=1), axis=1) + (np.arange(nbins) * size)[:, None]
+    idx = idx.ravel()
+    idx = np.unique(np.concatenate(([0], idx[idx < len(y)], [len(y) - 1])))
+    return x[idx], y[idx]
+
+
+def _prepare_side(summaryfile: str, side: str, fs: int, max_points: int, blink_ms: float, fmt: str = None) -> dict:
+    """ load one side's summary and reduce it to what the summary pages draw."""
+    time, whisk = f'{side}_time', f'{side}_mean_degrees_filtered'
+    fitted, contour = f'{side}_fitted_area', f'{side}_contour_area'
+    try:
+        data = checkpoint.load(summaryfile, columns=[time, whisk, fitted, contour], fmt=fmt)
+    except (KeyError, ValueError):
+        data = checkpoint.load(summaryfile, columns=[time, whisk, contour], fmt=fmt)
+    # eyes measured without fitting an ellipse (see `eyes.MeasurementMode`) only have a contour area.
+    area = fitted if fitted in data and data[fitted].notna().any() else contour
+    areas = data[area].astype(float)
+    valid = areas.dropna()
+    blinks = valid.index[find_blinks(valid.reset_index(drop=True))] if len(valid) else []
+    overlay = overlay_stats(blink_window_matrix(areas, np.asarray(blinks, dtype=int), blink_ms, fs), fs)
+    trace = data[whisk].dropna().to_numpy()
+    return {'side': side,
+            'whisking': minmax_decimate(data[time], data[whisk], max_points),
+            'area': minmax_decimate(data[time], areas, max_points),
+            'nblinks': len(blinks),
+            'overlay': overlay,
+            'spectrum': whisking_summary(trace, fs),
+            'band_power': band_power_per_second(trace, fs)}
+
+
+def whisking_statistics(results: RecordingSessionData, fs: int, fmt: str = None) -> pd.DataFrame:
+    """
+    Spectral statistics of each side's filtered whisking trace (see `spectral.whisking_summary`).
+    :param results:
+    :param fs: the frame rate of the videos, in Hz (`Config.camera.framerate`).
+    :param fmt: the checkpoint format the summaries were saved in (`Config.storage.checkpoint_format`).
+    :return: one row per side, with columns side, peak_frequency, peak_amplitude, mean_band_power and
+    max_band_power.
+    """
+    rows = []
+    for video in sorted(results.videos, key=lambda v: v.side.value):
+        whisk = f'{video.side.name}_mean_degrees_filtered'
+        trace = checkpoint.load(video.summaryfile, columns=[whisk], fmt=fmt)[whisk].dropna().to_numpy()
+        rows.append({'side': video.side.name, **whisking_summary(trace, fs)})
+    return pd.DataFrame(rows, columns=['side', 'peak_frequency', 'peak_amplitude', 'mean_band_power',
+                                       'max_band_power'])
 
 
-def make_summary_plots(results: RecordingSessionData):
+def make_summary_plots(results: RecordingSessionData, fs: int, workers: int = 1, max_points: int = MAX_POINTS,
+                       blink_ms: float = 1000, fmt: str = None):
     """
-    Produce summary plots for a recorded bout.
+    Produce summary plots for a recorded bout: a page each of whisking, eye area, whisking band power and overlaid
+    blinks, left vs right.
+    Lines are decimated to screen resolution and drawn as raster images inside the vector PDF, so the file stays small
+    however long the recording is.
     :param results:
+    :param fs: the frame rate of the videos, in Hz (`Config.camera.framerate`).
+    :param workers: the number of processes to load and reduce the data in, one side per process.  Only worth it for
+    very long recordings, since starting the processes takes a few seconds.
+    :param max_points: the most points to draw per line.
+    :param blink_ms: the length of the window drawn around each blink, in milliseconds.
+    :param fmt: the checkpoint format the summaries were saved in (`Config.storage.checkpoint_format`).
     :return:
     """
-    left = next(pd.read_csv(v.summaryfile) for v in results.videos if v.side is SideOfFace.left)
-    right = next(pd.read_csv(v.summaryfile) for v in results.videos if v.side is SideOfFace.right)
+    # matplotlib is slow to import, and only needed here.  Figures are made without pyplot, so no global backend is
+    # selected.
+    from joblib import Parallel, delayed
+    from matplotlib.backends.backend_pdf import PdfPages
+    from matplotlib.figure import Figure
+
+    videos = sorted(results.videos, key=lambda v: v.side.value)
+    sides = Parallel(n_jobs=workers)(delayed(_prepare_side)(v.summaryfile, v.side.name, fs, max_points, blink_ms, fmt)
+                                     for v in videos)
 
     with PdfPages(filename=results.summaryfigure) as pdf:
         # plot left vs right
-        fig = plt.figure(1, figsize=(11, 8.5), dpi=400)
-        ax = fig.gca()
-        left.plot.line(ax=ax, x='left_time', y='left_mean_degrees_filtered')
-        right.plot.line(ax=ax, x='right_time', y='right_mean_degrees_filtered')
-        pdf.savefig(fig)
+        for key, ylabel in (('whisking', 'mean whisker angle (degrees)'), ('area', 'eye area (pixels^2)')):
+            fig = Figure(figsize=PAGE_SIZE)
+            ax = fig.subplots()
+            for side in sides:
+                ax.plot(*side[key], label=side['side'], linewidth=0.5, antialiased=False, rasterized=True)
+            ax.set_xlabel('time (s)')
+            ax.set_ylabel(ylabel)
+            ax.legend()
+            pdf.savefig(fig, dpi=RASTER_DPI)
+        _plot_band_power(pdf, sides)
+
+        fig = Figure(figsize=PAGE_SIZE)
+        ax = fig.subplots()
+        for side in sides:
+            overlay = side['overlay']
+            line, = ax.plot(overlay.index, overlay['mean'], label=f"{side['side']} (n={side['nblinks']})")
+            ax.fill_between(overlay.index, overlay['mean'] - overlay['sem'], overlay['mean'] + overlay['sem'],
+                            color=line.get_color(), alpha=0.3, rasterized=True)
+        ax.set_xlabel('time relative to blink (ms)')
+        ax.set_ylabel('eye area (pixels^2)')
+        ax.legend()
+        pdf.savefig(fig, dpi=RASTER_DPI)
 
         d = pdf.infodict()
         d['Title'] = 'Whisking and eyeblink summary'
         d['Author'] = "Graham Voysey <gvoysey@bu.edu>"
         d['Keywords'] = ''
         d['CreationDate'] = datetime.today()
-        d['ModDate'] = datetime.now()
\ No newline at end of file
+        d['ModDate'] = datetime.now()
+
+
+def _plot_band_power(pdf, sides: list) -> None:
+    """ add a page of whisking band power per second, left vs right, labelled with each side's peak frequency."""
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize=PAGE_SIZE)
+    ax = fig.subplots()
+    for side in sides:
+        power = side['band_power']
+        peak = side['spectrum']['peak_frequency']
+        ax.plot(np.arange(len(power)) + 0.5, power, label=f"{side['side']} (peak at {peak:.1f} Hz)")
+    ax.set_xlabel('time (s)')
+    ax.set_ylabel('whisking band power (degrees^2)')
+    ax.legend()
+    pdf.savefig(fig, dpi=RASTER_DPI)
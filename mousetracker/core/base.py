@@ -31,10 +31,16 @@ class VideoFileData(object):
         self.basename = name
         self.whiskname = name + ".whiskers"
         self.measname = name + ".measurements"
+        # the measure and classify stages' outputs; reclassify's is `measname`.
+        self.measured = name + "-measured.measurements"
+        self.classified = name + "-classified.measurements"
         self.eyecheck = name + "-eye-checkpoint.csv"
         self.whiskraw = name + "-whisk-raw.csv"
         self.whiskcheck = name + "-whisk-checkpoint.csv"
         self.summaryfile = name + "-summary.csv"
+        self.cachemanifest = name + "-cache.json"
+        self.timingfile = name + "-timing.json"
+        self.frameindex = name + "-frameindex.csv"
         self.labelname = path.splitext(path.basename(name))[0]
 
 
@@ -49,12 +55,18 @@ class RecordingSessionData(object):
         self.rootdir = path.split(self.videos[0].name)[0] if len(self.videos) > 0 else None
         self.summaryfigure = path.join(self.rootdir, "summary_plots.pdf") if self.rootdir else None
         self.summarystats = path.join(self.rootdir, "summary_data.csv") if self.rootdir else None
+        self.whiskingstats = path.join(self.rootdir, "whisking_summary.csv") if self.rootdir else None
 
 
 modulePath = path.dirname(path.abspath(__file__))
 
-# PyYAML has some warnings we'll suppress
-warnings.simplefilter(action="ignore", category=(FutureWarning, UserWarning))
 
-# By default, log INFO and up.
-basicConfig(format='%(levelname)s %(asctime)s- %(message)s', datefmt='%d %b %H:%M:%S', level=INFO)
+def configure_logging(level: int = INFO) -> None:
+    """
+    Set up logging and warnings for the command line tools.  Library code never calls this, so importing the package
+    has no side effects on the host application's logging.
+    :param level: the lowest level to log (default: INFO).
+    """
+    # PyYAML has some warnings we'll suppress
+    warnings.simplefilter(action="ignore", category=(FutureWarning, UserWarning))
+    basicConfig(format='%(levelname)s %(asctime)s- %(message)s', datefmt='%d %b %H:%M:%S', level=level)
@@ -0,0 +1,206 @@
+"""
+Content-addressed caching of pipeline stage outputs.
+
+Each video keeps a JSON manifest beside its other outputs.  A stage's cache key is a hash of its inputs, its
+arguments and the version of the tool that runs it; a stage's input is either a source file's fingerprint or the
+signature of the stage upstream of it, so a change anywhere in the chain invalidates everything downstream.  Output
+files are identified by their name relative to the manifest, so moving a whole output directory does not invalidate
+it.
+"""
+import hashlib
+import json
+import os
+import shutil
+import time
+from logging import info
+from os import path
+from typing import Dict, Iterable, List, Optional, Union
+
+import attr
+from attr.validators import instance_of
+
+from mousetracker.core._version import __version__
+from mousetracker.core.base import VideoFileData
+
+# intermediate outputs that may be evicted to save space; they can always be regenerated.
+INTERMEDIATE_SUFFIXES = ('.whiskers', '.measurements')
+
+
+def fingerprint(filename: str, content_hash: bool = False) -> str:
+    """
+    Identify the contents of a file.
+    :param filename: the file to fingerprint.
+    :param content_hash: if True, hash the file contents.  Otherwise (much faster) use its size and modification time.
+    :return: a fingerprint string, or '' if the file does not exist.
+    """
+    if not path.isfile(filename):
+        return ''
+    if content_hash:
+        digest = hashlib.sha256()
+        with open(filename, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        return 'sha256:' + digest.hexdigest()
+    stat = os.stat(filename)
+    return f'{stat.st_size}:{stat.st_mtime_ns}'
+
+
+def tool_version(executable: Optional[str]) -> str:
+    """
+    Identify the version of an external tool by the fingerprint of its executable.
+    :param executable: a program name or path.
+    :return: a version string.  Tools that can't be found are versioned by name alone.
+    """
+    if executable is None:
+        return ''
+    resolved = shutil.which(executable) or executable
+    return f'{path.basename(resolved)}@{fingerprint(resolved)}'
+
+
+@attr.s
+class StageCache(object):
+    """
+    A per-video record of which pipeline stages have up-to-date outputs.
+    :param manifest: the JSON file the record is kept in.
+    :param enabled: if False, every lookup misses (outputs are still recorded).
+    :param content_hash: fingerprint source files by content rather than size and modification time.
+    """
+    manifest = attr.ib(validator=instance_of(str))
+    enabled = attr.ib(default=True, validator=instance_of(bool))
+    content_hash = attr.ib(default=False, validator=instance_of(bool))
+    hits = attr.ib(default=0, init=False)
+    misses = attr.ib(default=0, init=False)
+
+    def __attrs_post_init__(self):
+        self._root = path.dirname(path.abspath(self.manifest))
+        self._data = {'files': {}, 'stages': {}}
+        if path.isfile(self.manifest):
+            try:
+                with open(self.manifest, 'r') as f:
+                    self._data = json.load(f)
+            except ValueError:
+                info(f'ignoring unreadable cache manifest {self.manifest}')
+
+    @classmethod
+    def for_video(cls, video: VideoFileData, **kwargs) -> 'StageCache':
+        """
+        Open the cache manifest that belongs to a video.
+        :param video: the video.
+        :param kwargs: passed to the constructor.
+        :return: the cache.
+        """
+        return cls(manifest=video.cachemanifest, **kwargs)
+
+    def fingerprint(self, filename: str) -> str:
+        """ fingerprint a source file, honoring `content_hash`."""
+        return fingerprint(filename, self.content_hash)
+
+    def signature(self, stage: str) -> str:
+        """
+        Identify the last recorded run of a stage, for use as a downstream stage's input.
+        :param stage: the stage name.
+        :return: a string that changes whenever the stage is re-run or its inputs change.
+        """
+        entry = self._data['stages'].get(stage)
+        if entry is None:
+            return ''
+        return entry['key'] + '|' + json.dumps(entry['outputs'], sort_keys=True)
+
+    @staticmethod
+    def key(stage: str, inputs: Iterable[str], args: Dict, tool: str = '') -> str:
+        """
+        Compute the cache key for one run of a stage.
+        :param stage: the stage name.
+        :param inputs: fingerprints of source files, or signatures of upstream stages.
+        :param args: the stage's parameters.
+        :param tool: the version of the tool that runs the stage.
+        :return: a hex digest.
+        """
+        blob = json.dumps([stage, list(inputs), args, tool, __version__], sort_keys=True, default=str)
+        return hashlib.sha256(blob.encode('utf-8')).hexdigest()
+
+    def lookup(self, stage: str, key: str, outputs: List[str]) -> bool:
+        """
+        Decide whether a stage can be skipped.  A stage is up to date if it last ran with the same key, and none of its
+        outputs have been removed or modified since the pipeline last wrote them.
+        :param stage: the stage name.
+        :param key: the key the stage would run with now, from `key`.
+        :param outputs: the files the stage writes.
+        :return: True on a cache hit.
+        """
+        entry = self._data['stages'].get(stage)
+        hit = (self.enabled and entry is not None and entry['key'] == key and
+               all(self._data['files'].get(self._relative(f)) == fingerprint(f) != '' for f in outputs))
+        if hit:
+            self.hits += 1
+            entry['used'] = time.time()
+            self.save()
+        else:
+            self.misses += 1
+        return hit
+
+    def record(self, stage: str, key: str, outputs: List[str]) -> None:
+        """
+        Note that a stage has just run successfully.
+        :param stage: the stage name.
+        :param key: the key it ran with.
+        :param outputs: the files it wrote.
+        """
+        fingerprints = {self._relative(f): fingerprint(f) for f in outputs}
+        self._data['files'].update(fingerprints)
+        self._data['stages'][stage] = {'key': key, 'outputs': fingerprints, 'used': time.time()}
+        self.save()
+
+    def save(self) -> None:
+        """ write the manifest to disk."""
+        tmp = self.manifest + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self._data, f, indent=1, sort_keys=True)
+        os.replace(tmp, self.manifest)
+
+    def report(self, label: str) -> None:
+        """ log this run's hit and miss counts."""
+        info(f'stage cache for {label}: {self.hits} hits, {self.misses} misses')
+
+    def _relative(self, filename: str) -> str:
+        return path.relpath(path.abspath(filename), self._root)
+
+
+def evict(root: Union[str, Iterable[str]], max_bytes: int, suffixes=INTERMEDIATE_SUFFIXES) -> int:
+    """
+    Delete the least recently used intermediate files under a directory until they take up at most `max_bytes`.
+    Evicted files are dropped from their manifests, so the stages that made them will re-run when next needed.
+    :param root: the directory to search for cache manifests, or several directories sharing the limit.
+    :param max_bytes: the space intermediate files may occupy.
+    :param suffixes: the file extensions that count as intermediate.
+    :return: the number of bytes freed.
+    """
+    roots = [root] if isinstance(root, str) else list(root)
+    manifests = set()
+    for dirpath, _, filenames in (w for r in roots for w in os.walk(r)):
+        manifests.update(path.abspath(path.join(dirpath, f)) for f in filenames if f.endswith('-cache.json'))
+    candidates = []
+    for manifest in sorted(manifests):
+        cache = StageCache(manifest=manifest)
+        for stage, entry in cache._data['stages'].items():
+            for rel in entry['outputs']:
+                filename = path.join(cache._root, rel)
+                if rel.endswith(suffixes) and path.isfile(filename):
+                    candidates.append((entry['used'], filename, rel, cache))
+    # a file written by several stages is as recent as the most recent of them.
+    latest = {}
+    for used, filename, rel, cache in candidates:
+        if filename not in latest or used > latest[filename][0]:
+            latest[filename] = (used, rel, cache)
+    total = sum(path.getsize(f) for f in latest)
+    freed = 0
+    for filename, (used, rel, cache) in sorted(latest.items(), key=lambda x: x[1][0]):
+        if total - freed <= max_bytes:
+            break
+        size = path.getsize(filename)
+        os.remove(filename)
+        cache._data['files'].pop(rel, None)
+        cache.save()
+        freed += size
+        info(f'evicted {filename} ({size} bytes)')
+    return freed
@@ -0,0 +1,147 @@
+"""
+Reading and writing of checkpoint files (eye data, raw and filtered whisker data, per-video summaries).
+
+Checkpoints are stored in a typed, binary columnar format: parquet or feather when pyarrow is installed, otherwise a
+NumPy structured `.npy` file.  CSV is still available as a format, and as an optional export alongside the binary
+file.  Callers name checkpoints by the `.csv` paths in `VideoFileData`; the real file has the same stem and the
+suffix of its format.  Existing CSV checkpoints are migrated to the binary format the first time they are read, unless
+CSV is the format asked for.
+
+Callers should pass the configured format (`Config.storage.checkpoint_format`) everywhere they save or load.  When a
+checkpoint exists in several formats, the file in the format asked for is read; with no format given, or none in that
+format, the most recently written file is.
+"""
+import os
+from logging import info
+from os import path
+from typing import List, Optional
+
+import numpy as np
+import pandas as pd
+
+from mousetracker.core.instrumentation import timed
+
+SUFFIXES = {'parquet': '.parquet', 'feather': '.feather', 'npy': '.npy', 'csv': '.csv'}
+FORMATS = ('parquet', 'feather', 'npy', 'csv')
+# formats that are written and read through pyarrow.
+ARROW_FORMATS = ('parquet', 'feather')
+
+
+def default_format() -> str:
+    """
+    :return: the preferred checkpoint format: parquet if pyarrow is available, otherwise npy.
+    """
+    return 'parquet' if _have_pyarrow() else 'npy'
+
+
+def _have_pyarrow() -> bool:
+    try:
+        import pyarrow
+        return True
+    except ImportError:
+        return False
+
+
+def _check_format(fmt: str) -> None:
+    """ raise if a format can't be used here."""
+    if fmt not in SUFFIXES:
+        raise ValueError(f"unknown checkpoint format {fmt}")
+    if fmt in ARROW_FORMATS and not _have_pyarrow():
+        raise ImportError(f"{fmt} checkpoints need pyarrow, which is not installed; use npy or csv instead")
+
+
+def checkpoint_path(name: str, fmt: Optional[str] = None) -> str:
+    """
+    The file a checkpoint is stored in.
+    :param name: the checkpoint's name, e.g. `VideoFileData.eyecheck`.
+    :param fmt: the storage format (default: `default_format()`).
+    :return: a file path.
+    """
+    return path.splitext(name)[0] + SUFFIXES[fmt or default_format()]
+
+
+def locate(name: str, fmt: Optional[str] = None) -> Optional[str]:
+    """
+    Find the file an existing checkpoint is stored in.
+    :param name: the checkpoint's name.
+    :param fmt: the format to look for first.  If there is no file in it (or no format is given), the most recently
+    modified file in any format is used.
+    :return: a file path, or None if the checkpoint does not exist in any format.
+    """
+    if fmt is not None and path.isfile(checkpoint_path(name, fmt)):
+        return checkpoint_path(name, fmt)
+    found = [f for f in (checkpoint_path(name, f) for f in FORMATS) if path.isfile(f)]
+    return max(found, key=lambda f: os.stat(f).st_mtime_ns) if found else None
+
+
+def exists(name: str, fmt: Optional[str] = None) -> bool:
+    """ True if a checkpoint exists in any format.  See `locate`."""
+    return locate(name, fmt) is not None
+
+
+@timed('checkpoint.save')
+def save(data: pd.DataFrame, name: str, fmt: Optional[str] = None, compression: Optional[str] = None,
+         export_csv: bool = False) -> str:
+    """
+    Write a checkpoint.  A named or non-default index is stored as ordinary columns, as `to_csv` would.  The npy
+    format only supports numeric and boolean columns.
+    :param data: the data to save.
+    :param name: the checkpoint's name.
+    :param fmt: the storage format (default: `default_format()`).
+    :param compression: a compression codec supported by the format (default: the format's own default).
+    :param export_csv: also write the data as CSV to `name`.
+    :return: the file written.
+    """
+    fmt = fmt or default_format()
+    _check_format(fmt)
+    target = checkpoint_path(name, fmt)
+    default_index = data.index.name is None and isinstance(data.index, pd.RangeIndex)
+    data = data.reset_index(drop=default_index)
+    data.columns = [str(c) for c in data.columns]
+    if fmt == 'parquet':
+        data.to_parquet(target, compression=compression or 'snappy', index=False)
+    elif fmt == 'feather':
+        data.to_feather(target, compression=compression)
+    elif fmt == 'npy':
+        np.save(target, data.to_records(index=False), allow_pickle=False)
+    else:
+        data.to_csv(target, index=False)
+    if export_csv and fmt != 'csv':
+        data.to_csv(checkpoint_path(name, 'csv'), index=False)
+    return target
+
+
+@timed('checkpoint.load')
+def load(name: str, columns: Optional[List[str]] = None, fmt: Optional[str] = None) -> pd.DataFrame:
+    """
+    Read a checkpoint (see `locate` for which file).  If that is a CSV file, it is converted to `fmt` on the way,
+    unless `fmt` is CSV.
+    :param name: the checkpoint's name.
+    :param columns: read only these columns (default: all).
+    :param fmt: the format to read, and to migrate CSV checkpoints to (default: `default_format()`).
+    :return: the data.
+    """
+    source = locate(name, fmt)
+    if source is None:
+        raise FileNotFoundError(f"no checkpoint found for {name}")
+    target = fmt or default_format()
+    if source.endswith(SUFFIXES['csv']) and target != 'csv':
+        info(f'migrating checkpoint {source} to {target}')
+        source = save(_read_csv(source), name, target)
+    if source.endswith(SUFFIXES['parquet']):
+        _check_format('parquet')
+        return pd.read_parquet(source, columns=columns)
+    if source.endswith(SUFFIXES['feather']):
+        _check_format('feather')
+        return pd.read_feather(source, columns=columns)
+    if source.endswith(SUFFIXES['npy']):
+        records = np.load(source, mmap_mode='r', allow_pickle=False)
+        names = list(columns or records.dtype.names)
+        return pd.DataFrame({n: np.array(records[n]) for n in names}, columns=names)
+    return pd.read_csv(source, usecols=columns)
+
+
+def _read_csv(filename: str) -> pd.DataFrame:
+    """ read a legacy CSV checkpoint, dropping the unnamed index column `to_csv` writes by default."""
+    data = pd.read_csv(filename)
+    return data.drop(columns=[c for c in data.columns if c.startswith('Unnamed: ')])
@@ -2,14 +2,23 @@
 Detection and Analysis of eyes in video frames.
 """
 import math
-from typing import List
+from enum import Enum
+from functools import lru_cache
+from typing import List, Optional, Tuple
 
 import attr
 import cv2
 import numpy as np
 import pandas as pd
+from attr.validators import instance_of, optional
+from attrs_utils import ensure_enum
+from numpy.lib.stride_tricks import sliding_window_view
 
+from mousetracker.core.base import VideoFileData
+from mousetracker.core import frameindex, instrumentation
+from mousetracker.core.instrumentation import count, timed, timer
 from mousetracker.core.util.detect_peaks import detect_peaks
+from mousetracker.core.video import FrameSource
 
 
 @attr.s(frozen=True)
@@ -31,6 +40,77 @@ class EyeStats:
     contour_area = attr.ib(default=None)
 
 
+EYE_FIELDS = tuple(a.name for a in attr.fields(EyeStats))
+
+# how the eye is measured in a segmented frame:
+#   ellipse: fit an ellipse to the largest contour (all fields).
+#   contour: the largest outer contour's area and centroid only, from a simplified contour.
+#   components: the largest connected blob's pixel count and centroid, from connected-component statistics.  The
+#       area counts every pixel of the blob, so it is larger than a contour area by about half the perimeter.
+MeasurementMode = Enum('MeasurementMode', 'ellipse, contour, components')
+
+
+@attr.s(cmp=False)
+class EyeStatsTable(object):
+    """
+    Columnar storage for per-frame eye statistics: a preallocated float64 array with one row per frame and one column
+    per `EyeStats` field, in `EYE_FIELDS` order.  Missing measurements are NaN.
+    :param values: an array of shape (nframes, len(EYE_FIELDS)).
+    """
+    values = attr.ib(validator=instance_of(np.ndarray))
+
+    @classmethod
+    def allocate(cls, nframes: int) -> 'EyeStatsTable':
+        """
+        Make an empty table.
+        :param nframes: the number of rows.
+        :return: a table with every value set to NaN.
+        """
+        return cls(values=np.full((nframes, len(EYE_FIELDS)), np.nan))
+
+    @classmethod
+    def for_video(cls, video: VideoFileData) -> 'EyeStatsTable':
+        """
+        Make an empty table with one row per frame of a video.
+        :param video: the video to be analyzed.
+        :return: a table with every value set to NaN.
+        """
+        return cls.allocate(video.nframes)
+
+    def __len__(self):
+        return self.values.shape[0]
+
+    def __getitem__(self, i: int) -> EyeStats:
+        return EyeStats(*(None if np.isnan(v) else float(v) for v in self.values[i]))
+
+    def __setitem__(self, i: int, stats: EyeStats) -> None:
+        self.values[i] = attr.astuple(stats)
+
+    def column(self, name: str) -> np.ndarray:
+        """
+        A view of one field for every frame.
+        :param name: an `EyeStats` field name.
+        :return: a 1D array that shares memory with the table.
+        """
+        return self.values[:, EYE_FIELDS.index(name)]
+
+    def to_dataframe(self, prefix: str = '') -> pd.DataFrame:
+        """
+        Wrap the table in a data frame without copying it.
+        :param prefix: prepended to every column name, e.g. 'left_'.
+        :return: a data frame with one column per `EyeStats` field, sharing memory with the table.
+        """
+        return pd.DataFrame(self.values, columns=[prefix + x for x in EYE_FIELDS], copy=False)
+
+
+# hue bands (OpenCV HSV, H in [0, 180]) that count as red.
+_LOWER_RED_0 = np.array([0, 50, 50])
+_UPPER_RED_0 = np.array([10, 255, 255])
+_LOWER_RED_1 = np.array([170, 50, 50])
+_UPPER_RED_1 = np.array([180, 255, 255])
+
+
+@timed('eyes.find_blinks')
 def find_blinks(series: pd.Series, min_dist: int = 120, std_num: float = 2.5) -> np.ndarray:
     """find blinks (rapid eye closing events)"""
     temp = series.copy()
@@ -40,7 +120,112 @@ def find_blinks(series: pd.Series, min_dist: int = 120, std_num: float = 2.5) ->
     return detect_peaks(temp, mpd=min_dist, valley=True)
 
 
-def __num_samples_for_duration(dur_msec: float, fs: int = 240):
+@attr.s
+class BlinkDetector(object):
+    """
+    An incremental `find_blinks` for recordings too long to hold in memory.  Samples are fed in chunks of any size;
+    the mean and standard deviation behind the blink threshold are kept as running (Welford) statistics, and a blink
+    is reported once `min_dist` samples past it have been seen.  Memory use is O(`warmup` + `min_dist`).
+
+    Nothing is reported until `warmup` samples have been seen, because the threshold is meaningless before then: blinks
+    in the first `warmup` samples are reported all at once when it is reached, up to `warmup` samples late.  After
+    that, each blink is reported `min_dist` samples after it happens.
+
+    On a finished recording the results match `find_blinks` except that:
+     - the threshold is computed from the samples seen so far rather than the whole recording, so events within a
+       small margin of the threshold may be added or dropped while the statistics settle;
+     - a valley is kept if it is the deepest within `min_dist` samples either side of it.  `find_blinks` also keeps
+       a valley whose deeper neighbor was itself suppressed by an even deeper one, so within runs of blinks spaced
+       less than 2 * `min_dist` apart, some shallower blinks reported by `find_blinks` may be missing here.
+    Isolated blinks well below threshold are reported at exactly the same sample index.
+    :param min_dist: the minimum number of samples between blinks.
+    :param std_num: blinks are valleys more than this many standard deviations below the mean.
+    :param warmup: the number of samples to accumulate statistics over before reporting anything (default: 10 *
+    `min_dist`).
+    """
+    min_dist = attr.ib(default=120, validator=instance_of(int))
+    std_num = attr.ib(default=2.5, validator=instance_of((int, float)))
+    warmup = attr.ib(default=None, validator=optional(instance_of(int)))
+
+    def __attrs_post_init__(self):
+        if self.warmup is None:
+            self.warmup = 10 * self.min_dist
+        self._count = 0
+        self._mean = 0.0
+        self._m2 = 0.0
+        # recent samples, beginning at global sample index `_offset`.
+        self._tail = np.empty(0)
+        self._offset = 0
+        # samples before `_next` have been decided.
+        self._next = 0
+
+    @property
+    def threshold(self) -> float:
+        """ the current blink threshold, or NaN if fewer than two samples have been seen."""
+        if self._count < 2:
+            return np.nan
+        return self._mean - self.std_num * math.sqrt(self._m2 / (self._count - 1))
+
+    def update(self, samples) -> np.ndarray:
+        """
+        Consume the next chunk of eye area samples.
+        :param samples: array-like; the samples following those previously passed in.
+        :return: the sample indices (counted from the first sample ever passed in) of newly confirmed blinks.
+        """
+        samples = np.asarray(samples, dtype=float).ravel()
+        self._accumulate(samples)
+        self._tail = np.concatenate((self._tail, samples))
+        if self._count < self.warmup:
+            return np.array([], dtype=int)
+        return self._decide(self._offset + self._tail.size - self.min_dist)
+
+    def finish(self) -> np.ndarray:
+        """
+        Flush the detector at the end of a recording.
+        :return: the sample indices of any blinks in the last `min_dist` samples.
+        """
+        return self._decide(self._offset + self._tail.size)
+
+    def _accumulate(self, samples: np.ndarray) -> None:
+        """ merge a chunk into the running mean and sum of squared deviations (Chan et al.'s pairwise update)."""
+        finite = samples[np.isfinite(samples)]
+        if finite.size == 0:
+            return
+        chunk_mean = finite.mean()
+        chunk_m2 = np.square(finite - chunk_mean).sum()
+        count = self._count + finite.size
+        delta = chunk_mean - self._mean
+        self._mean += delta * finite.size / count
+        self._m2 += chunk_m2 + delta ** 2 * self._count * finite.size / count
+        self._count = count
+
+    def _decide(self, stop: int) -> np.ndarray:
+        """ report the blinks among samples [_next, stop), then drop samples that are no longer needed."""
+        mpd = self.min_dist
+        start = self._next - self._offset
+        stop = stop - self._offset
+        blinks = np.array([], dtype=int)
+        if stop > start:
+            # same candidate rule as detect_peaks(valley=True, edge='rising') on the clipped series.
+            clipped = np.minimum(self._tail, self.threshold)
+            candidate = np.zeros(clipped.size, dtype=bool)
+            candidate[1:-1] = (clipped[1:-1] < clipped[:-2]) & (clipped[2:] >= clipped[1:-1])
+            depth = np.where(candidate, clipped, np.inf)
+            padded = np.concatenate((np.full(mpd, np.inf), depth, np.full(mpd, np.inf)))
+            window_min = sliding_window_view(padded, mpd).min(axis=1)
+            # depth[i - mpd:i] and depth[i + 1:i + mpd + 1], respectively.
+            left = window_min[:depth.size]
+            right = window_min[mpd + 1:mpd + 1 + depth.size]
+            deepest = candidate & (depth < left) & (depth <= right)
+            blinks = np.flatnonzero(deepest[start:stop]) + start + self._offset
+            self._next = stop + self._offset
+        keep_from = max(self._offset, self._next - mpd - 1)
+        self._tail = self._tail[keep_from - self._offset:].copy()
+        self._offset = keep_from
+        return blinks
+
+
+def __num_samples_for_duration(dur_msec: float, fs: int):
     """returns an always-even sample length that covers the given duration"""
     dur_sec = dur_msec / 1000.0
     n = math.floor(dur_sec * fs)
@@ -50,49 +235,109 @@ def __num_samples_for_duration(dur_msec: float, fs: int = 240):
         return n + 1
 
 
-def window(series: pd.Series, center_idx: int, timedur: float) -> pd.Series:
-    nsamples = __num_samples_for_duration(timedur)
-    start = center_idx - (nsamples // 2)
-    stop = center_idx + (nsamples // 2)
-    return series.iloc[start:stop]
-    # return np.arange(start, stop), series.iloc[start:stop].as_matrix()
+def window(series: pd.Series, center_idx: int, timedur: float, fs: int) -> pd.Series:
+    """
+    The samples around one blink.  See `blink_window_matrix`.
+    :param series: the eye area signal.
+    :param center_idx: the positional index of the blink.
+    :param timedur: the length of the window, in milliseconds.
+    :param fs: the sampling rate of `series`, in Hz (normally `Config.camera.framerate`).
+    :return: the window, indexed by sample position in `series`; samples outside the recording are NaN.
+    """
+    row = blink_window_matrix(series, [center_idx], timedur, fs)[0]
+    start = center_idx - len(row) // 2
+    return pd.Series(row, index=pd.RangeIndex(start, start + len(row)))
 
 
 def overlay_windows(windowdf: pd.DataFrame) -> pd.DataFrame:
     # df = pd.DataFrame()
-    # for colname, series in windowdf.iteritems():
+    # for colname, series in windowdf.items():
     #     df[colname] = series.copy().reset_index(drop=True)
     # print(df.head())
     # return df
-    return pd.DataFrame({n: v.reset_index(drop=True) for n, v in windowdf.iteritems()}).apply(
+    return pd.DataFrame({n: v.reset_index(drop=True) for n, v in windowdf.items()}).apply(
         lambda x: pd.Series(x.dropna().values))
 
 
-def make_windows(series: pd.Series, duration_ms: float, show=False) -> List[pd.DataFrame]:
+def make_windows(series: pd.Series, duration_ms: float, fs: int, show=False) -> pd.DataFrame:
+    """
+    The samples around every blink in a signal.
+    :param series: the eye area signal.
+    :param duration_ms: the length of each window, in milliseconds.
+    :param fs: the sampling rate of `series`, in Hz (normally `Config.camera.framerate`).
+    :param show: also plot the signal and its blinks.
+    :return: a data frame with one column per blink, blink_0, blink_1, ..., indexed by time relative to the blink in
+    milliseconds as in `overlay_stats`.  Samples outside the recording are NaN.
+    """
+    blinks = find_blinks(series)
     if show:
         import matplotlib.pyplot as plt
         plt.plot(series)
-        plt.plot(series[find_blinks(series)], 'r^')
+        plt.plot(series[blinks], 'r^')
         plt.xlabel('sample index')
         plt.ylabel('scaled eye area')
         plt.legend(('eye area', 'blink events'))
-    df = pd.DataFrame({f'blink_{i}': window(series, blink, duration_ms)
-                       for i, blink in enumerate(find_blinks(series))})
-    return df
-    # return [window(series, blink, duration_ms) for blink in find_blinks(series, percent_closed_threshold=blink_threshold)]
+    windows = blink_window_matrix(series, blinks, duration_ms, fs)
+    nsamples = windows.shape[1]
+    offset_ms = (np.arange(nsamples) - nsamples // 2) * 1000.0 / fs
+    return pd.DataFrame(windows.T, columns=[f'blink_{i}' for i in range(len(blinks))],
+                        index=pd.Index(offset_ms, name='time_ms'))
 
 
-def compute_areas(frame) -> EyeStats:
+def blink_window_matrix(series: pd.Series, blink_idx, duration_ms: float, fs: int) -> np.ndarray:
+    """
+    Extract a window of samples around every blink, all at once.  Row i covers the same samples as
+    `window(series, blink_idx[i], duration_ms, fs)`; samples that fall outside the recording are NaN.
+    :param series: the eye area signal.
+    :param blink_idx: the positional index of each blink, e.g. from `find_blinks`.
+    :param duration_ms: the length of each window, in milliseconds.
+    :param fs: the sampling rate of `series`, in Hz (normally `Config.camera.framerate`).
+    :return: an array of shape (len(blink_idx), nsamples), centered on each blink.
+    """
+    nsamples = __num_samples_for_duration(duration_ms, fs)
+    half = nsamples // 2
+    padded = np.concatenate((np.full(half, np.nan), np.asarray(series, dtype=float), np.full(half, np.nan)))
+    # row i of the (zero-copy) view is series[i - half:i + half]; indexing it copies only the rows we want.
+    return sliding_window_view(padded, nsamples)[np.asarray(blink_idx, dtype=int)]
+
+
+def overlay_stats(windows: np.ndarray, fs: int) -> pd.DataFrame:
+    """
+    Average blink windows together, ignoring samples that are missing.
+    :param windows: an array of blink windows, as from `blink_window_matrix`.
+    :param fs: the sampling rate of the windows, in Hz.
+    :return: a data frame with the mean, standard error of the mean and number of windows contributing at each
+    sample, indexed by time relative to the blink in milliseconds.
+    """
+    nsamples = windows.shape[1]
+    valid = np.isfinite(windows)
+    count = valid.sum(axis=0)
+    filled = np.where(valid, windows, 0.0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = filled.sum(axis=0) / count
+        sumsq = np.where(valid, np.square(windows - mean), 0.0).sum(axis=0)
+        sem = np.sqrt(sumsq / (count - 1)) / np.sqrt(count)
+    offset_ms = (np.arange(nsamples) - nsamples // 2) * 1000.0 / fs
+    return pd.DataFrame({'mean': mean, 'sem': sem, 'count': count}, index=pd.Index(offset_ms, name='time_ms'))
+
+
+def compute_areas(frame, mode: MeasurementMode = MeasurementMode.ellipse, fit_ellipse: bool = False) -> EyeStats:
     """
     Compute the contour and fitted ellipse areas for the largest contour in the frame, which we assume represents the eye.
     :param frame: an extracted video frame.
-    :return: A class containing measurement results.
+    :param mode: how to measure the eye.  See `MeasurementMode`.
+    :param fit_ellipse: also fit an ellipse in the cheaper modes.
+    :return: A class containing measurement results.  Modes other than ellipse leave the ellipse fields empty, unless
+    `fit_ellipse` is set.
     """
-    frame_hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
-    output_grey = _red_mask(frame_hsv=frame_hsv)
+    with timer('eyes.red_mask'):
+        output_grey = red_grey(frame)
     thresh1 = _threshold_frame(output_grey)
     closing = _morph_and_smooth(thresh1)
-    return _contour_to_ellipse(closing)
+    if mode is MeasurementMode.ellipse:
+        return _contour_to_ellipse(closing)
+    fit = _measure_largest(closing, mode, fit_ellipse)
+    return EyeStats() if fit is None else EyeStats(*(None if np.isnan(v) else float(v) for v in fit))
 
 
 def _contour_to_ellipse(opened):
@@ -101,23 +346,79 @@ def _contour_to_ellipse(opened):
     :param opened: an extracted and processed video frame.
     :return: A class containing measurement results.  If no contours are present in the frame, return an empty class.
     """
+    fit = _fit_largest_contour(opened)
+    return EyeStats() if fit is None else EyeStats(*fit)
+
+
+@timed('eyes.contour_to_ellipse')
+def _fit_largest_contour(opened) -> Optional[Tuple[float, ...]]:
+    """
+    Fit an ellipse to the largest contour in the frame.
+    :param opened: an extracted and processed video frame.
+    :return: the measurement values, in `EYE_FIELDS` order, or None if no contours are present in the frame.
+    """
+    count('eyes.frames')
     _, contours, _ = cv2.findContours(opened, cv2.RETR_TREE, cv2.CHAIN_APPROX_NONE)
     try:
         largest_contour = max(contours, key=cv2.contourArea)
         center, size, angle = cv2.fitEllipse(largest_contour)
         fitted_area = np.pi * (size[0] / 2) * (size[1] / 2)
-        return EyeStats(center_x=center[0],
-                        center_y=center[1],
-                        minor_axis=size[0],
-                        major_axis=size[1],
-                        angle=angle,
-                        fitted_area=fitted_area,
-                        contour_area=cv2.contourArea(largest_contour)
-                        )
+        return center[0], center[1], size[0], size[1], angle, fitted_area, cv2.contourArea(largest_contour)
     except ValueError:
-        return EyeStats()
+        count('eyes.contours_lost')
+        return None
+
+
+@timed('eyes.measure_largest')
+def _measure_largest(opened, mode: MeasurementMode, fit_ellipse: bool) -> Optional[Tuple[float, ...]]:
+    """
+    Measure the largest object in the frame.
+    :param opened: an extracted and processed video frame.
+    :param mode: how to measure it.  See `MeasurementMode`.
+    :param fit_ellipse: fit an ellipse to it, as well.  Always done in ellipse mode.
+    :return: the measurement values, in `EYE_FIELDS` order, with NaN for the ellipse fields if no ellipse was fitted;
+    or None if the frame is empty.
+    """
+    if mode is MeasurementMode.ellipse:
+        return _fit_largest_contour(opened)
+    count('eyes.frames')
+    if mode is MeasurementMode.contour:
+        # simplified contours have the same area, but an ellipse fitted to them is not the same.
+        approx = cv2.CHAIN_APPROX_NONE if fit_ellipse else cv2.CHAIN_APPROX_SIMPLE
+        _, contours, _ = cv2.findContours(opened, cv2.RETR_EXTERNAL, approx)
+        if not contours:
+            count('eyes.contours_lost')
+            return None
+        areas = [cv2.contourArea(c) for c in contours]
+        largest = contours[int(np.argmax(areas))]
+        area = max(areas)
+        moments = cv2.moments(largest)
+        if moments['m00']:
+            center = (moments['m10'] / moments['m00'], moments['m01'] / moments['m00'])
+        else:
+            # a degenerate (line or point) contour has no area to take the centroid of.
+            center = tuple(largest.reshape(-1, 2).mean(axis=0))
+    else:
+        n, labels, stats, centroids = cv2.connectedComponentsWithStats(opened, connectivity=8)
+        if n < 2:
+            count('eyes.contours_lost')
+            return None
+        blob = 1 + int(np.argmax(stats[1:, cv2.CC_STAT_AREA]))
+        area = float(stats[blob, cv2.CC_STAT_AREA])
+        center = tuple(centroids[blob])
+        largest = None
+        if fit_ellipse:
+            _, contours, _ = cv2.findContours((labels == blob).astype(np.uint8), cv2.RETR_EXTERNAL,
+                                              cv2.CHAIN_APPROX_NONE)
+            largest = max(contours, key=cv2.contourArea)
+    if not fit_ellipse:
+        return center[0], center[1], np.nan, np.nan, np.nan, np.nan, area
+    center, size, angle = cv2.fitEllipse(largest)
+    fitted_area = np.pi * (size[0] / 2) * (size[1] / 2)
+    return center[0], center[1], size[0], size[1], angle, fitted_area, area
 
 
+@timed('eyes.morph_and_smooth')
 def _morph_and_smooth(thresh1):
     """
     Smooth a thresholded frame's contours via erosion and dilation.  See http://docs.opencv.org/trunk/d9/d61/tutorial_py_morphological_ops.html
@@ -137,6 +438,7 @@ def _morph_and_smooth(thresh1):
     return closing
 
 
+@timed('eyes.threshold_frame')
 def _threshold_frame(output_grey):
     """
     Threshold the values of a frame according to their hue
@@ -151,16 +453,12 @@ def _threshold_frame(output_grey):
 
 def _red_mask(frame_hsv):
     """
-    Extract the red channel from a frame
+    Extract the red channel from a frame.  This is the rule `red_lut` compiles; frames are masked through the table.
     :param frame_hsv: A frame in HSV format
     :return: a greyscale frame containing non-null values only where red pixels were present in the original.
     """
-    lower_red = np.array([0, 50, 50])
-    upper_red = np.array([10, 255, 255])
-    mask0 = cv2.inRange(frame_hsv, lower_red, upper_red)
-    lower_red1 = np.array([170, 50, 50])
-    upper_red1 = np.array([180, 255, 255])
-    mask1 = cv2.inRange(frame_hsv, lower_red1, upper_red1)
+    mask0 = cv2.inRange(frame_hsv, _LOWER_RED_0, _UPPER_RED_0)
+    mask1 = cv2.inRange(frame_hsv, _LOWER_RED_1, _UPPER_RED_1)
     mask = mask0 + mask1
     output_img = frame_hsv.copy()
     output_img[np.where(mask == 0)] = 0
@@ -168,6 +466,402 @@ def _red_mask(frame_hsv):
     return cv2.cvtColor(output_img, cv2.COLOR_BGR2GRAY)
 
 
+@lru_cache(maxsize=None)
+@timed('eyes.red_lut')
+def red_lut() -> np.ndarray:
+    """
+    `_red_mask`, compiled into a lookup table over every BGR color.  Built once per process (in about half a second),
+    by running `_red_mask` itself on an image of every color, so lookups are exactly what it computes.
+    :return: a read-only 2^24-entry uint8 array; a pixel's value is at index B | G << 8 | R << 16.
+    """
+    lut = np.empty((256, 256, 256), dtype=np.uint8)
+    # one image per red level, with green down the rows and blue across the columns.
+    colors = np.empty((256, 256, 3), dtype=np.uint8)
+    colors[..., 0] = np.arange(256, dtype=np.uint8)[None, :]
+    colors[..., 1] = np.arange(256, dtype=np.uint8)[:, None]
+    for red in range(256):
+        colors[..., 2] = red
+        lut[red] = _red_mask(cv2.cvtColor(colors, cv2.COLOR_BGR2HSV))
+    lut = lut.reshape(-1)
+    lut.setflags(write=False)
+    return lut
+
+
+def red_grey(frame: np.ndarray, out: Optional[np.ndarray] = None, index: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    The red-masked greyscale image `_red_mask` makes from a frame's HSV conversion, looked up per pixel in `red_lut`
+    straight from the BGR frame.
+    :param frame: a BGR frame.
+    :param out: a C-contiguous (height, width) uint8 array to write the result into.
+    :param index: a uint32 scratch array of height * width - 1 elements.
+    :return: the greyscale frame (`out`, if given).
+    :raises ValueError: if `out` is not C-contiguous; flattening it would copy it, and the result would be lost.
+    """
+    height, width = frame.shape[:2]
+    n = height * width
+    if out is None:
+        out = np.empty((height, width), dtype=np.uint8)
+    elif not out.flags.c_contiguous:
+        raise ValueError("red_grey can only write into a C-contiguous array")
+    index = np.empty(n - 1, dtype=np.uint32) if index is None else index
+    frame = np.ascontiguousarray(frame)
+    lut = red_lut()
+    flat = out.reshape(-1)
+    # each pixel's three bytes and the first byte of the next, read as one little-endian word; dropping the top byte
+    # leaves the pixel's table index.  The last pixel has no next byte, so it is looked up on its own.
+    words = np.ndarray((n - 1,), dtype='<u4', buffer=frame, strides=(3,))
+    np.bitwise_and(words, 0xFFFFFF, out=index)
+    np.take(lut, index, out=flat[:-1], mode='clip')
+    blue, green, red = frame.reshape(-1, 3)[-1]
+    flat[-1] = lut[int(blue) | int(green) << 8 | int(red) << 16]
+    return out
+
+
+@attr.s
+class EyeSegmenter(object):
+    """
+    A reusable eye segmentation engine for frames of one resolution.  Every intermediate image used by `compute_areas`
+    is allocated once, up front, and written in place for each frame, so processing a frame allocates no full-size
+    buffers.  Results are numerically identical to `compute_areas`.
+    :param width: frame width, in pixels.
+    :param height: frame height, in pixels.
+    :param mode: how to measure the eye.  See `MeasurementMode`.
+    :param ellipse_every: in modes other than ellipse, still fit an ellipse to one frame in this many (0: never).
+    """
+    width = attr.ib(validator=instance_of(int))
+    height = attr.ib(validator=instance_of(int))
+    mode = attr.ib(default=MeasurementMode.ellipse, convert=ensure_enum(MeasurementMode))
+    ellipse_every = attr.ib(default=0, validator=instance_of(int))
+    _nframes = attr.ib(default=0, init=False)
+
+    def __attrs_post_init__(self):
+        self._allocate(self.height, self.width)
+
+    @classmethod
+    def from_config(cls, config) -> 'EyeSegmenter':
+        """
+        Build an engine sized for the camera described in a configuration.
+        :param config: a `Config` instance.
+        :return: a new engine.
+        """
+        return cls(width=config.camera.width, height=config.camera.height)
+
+    def _allocate(self, height: int, width: int) -> None:
+        """ (re)allocate scratch buffers for frames of the given size."""
+        self.height, self.width = height, width
+        self._frame = np.empty((height, width, 3), dtype=np.uint8)
+        self._index = np.empty(height * width - 1, dtype=np.uint32)
+        self._grey = np.empty((height, width), dtype=np.uint8)
+        self._thresh = np.empty((height, width), dtype=np.uint8)
+        self._morphed = np.empty((height, width), dtype=np.uint8)
+        self._kernel = np.ones((3, 3), np.uint8)
+
+    def segment(self, frame) -> np.ndarray:
+        """
+        Run the red mask, threshold, and morphology steps of `compute_areas` on a frame.
+        :param frame: an extracted BGR video frame.
+        :return: the smoothed binary frame.  This is an internal buffer, overwritten by the next call.
+        """
+        if frame.shape[:2] != (self.height, self.width):
+            self._allocate(*frame.shape[:2])
+        with timer('eyes.red_mask'):
+            if not frame.flags.c_contiguous:
+                # e.g. one half of a split frame.
+                np.copyto(self._frame, frame)
+                frame = self._frame
+            red_grey(frame, out=self._grey, index=self._index)
+        with timer('eyes.threshold_frame'):
+            cv2.threshold(self._grey, 150, 255, cv2.THRESH_OTSU, dst=self._thresh)
+        with timer('eyes.morph_and_smooth'):
+            cv2.erode(self._thresh, self._kernel, dst=self._morphed, iterations=2)
+            cv2.morphologyEx(self._morphed, cv2.MORPH_OPEN, self._kernel, dst=self._thresh)
+            cv2.morphologyEx(self._thresh, cv2.MORPH_CLOSE, self._kernel, dst=self._morphed)
+        return self._morphed
+
+    def process(self, frame) -> EyeStats:
+        """
+        Compute the contour and fitted ellipse areas for one frame.  See `compute_areas`.
+        :param frame: an extracted BGR video frame.
+        :return: A class containing measurement results.
+        """
+        fit = self._measure(self.segment(frame))
+        return EyeStats() if fit is None else EyeStats(*(None if np.isnan(v) else float(v) for v in fit))
+
+    def process_into(self, frame, table: EyeStatsTable, i: int) -> bool:
+        """
+        Compute eye statistics for one frame and write them straight into a table row.
+        :param frame: an extracted BGR video frame.
+        :param table: the table to fill in.
+        :param i: the row to write.
+        :return: True if an eye was found.  Otherwise the row is left as NaN.
+        """
+        fit = self._measure(self.segment(frame))
+        if fit is None:
+            return False
+        table.values[i] = fit
+        return True
+
+    def _measure(self, segmented) -> Optional[Tuple[float, ...]]:
+        """ measure a segmented frame in this engine's mode, fitting an ellipse if one is due."""
+        fit_ellipse = self.ellipse_every > 0 and self._nframes % self.ellipse_every == 0
+        self._nframes += 1
+        return _measure_largest(segmented, self.mode, fit_ellipse)
+
+    def process_batch(self, frames) -> EyeStatsTable:
+        """
+        Compute eye statistics for a sequence of frames.
+        :param frames: a sequence of BGR frames, or an array of shape (nframes, height, width, 3).
+        :return: a table with one row per frame.  Frames where no eye was found are NaN.
+        """
+        table = EyeStatsTable.allocate(len(frames))
+        for i, frame in enumerate(frames):
+            self.process_into(frame, table, i)
+        return table
+
+
+@attr.s
+class RoiEyeTracker(object):
+    """
+    Follow the eye through consecutive frames, segmenting only a padded window around where it was last seen.  Falls
+    back to a full-frame search whenever the eye is lost (e.g. during a blink) or runs off the edge of the window, and
+    every `refresh_interval` frames so that the tracker cannot stay locked onto a smaller red blob.  Because Otsu
+    thresholding is computed over the window, results can differ slightly from `compute_areas` on the whole frame.
+
+    Near the edge of the frame the window is shifted to stay inside it rather than cut short, and an eye touching the
+    frame's own edge is accepted.  Window sizes are rounded up to a multiple of `min_half_size`, so that the window's
+    `EyeSegmenter` is only reallocated when the eye's size changes appreciably.
+    :param padding: the window extends this many major axis lengths in each direction from the last eye center.
+    :param min_half_size: the smallest allowed window half-width, in pixels.
+    :param refresh_interval: search the whole frame at least this often, in frames.
+    """
+    padding = attr.ib(default=1.0, validator=instance_of((int, float)))
+    min_half_size = attr.ib(default=32, validator=instance_of(int))
+    refresh_interval = attr.ib(default=240, validator=instance_of(int))
+    previous = attr.ib(default=attr.Factory(EyeStats), init=False)
+    _since_refresh = attr.ib(default=0, init=False)
+    _frame_segmenter = attr.ib(default=None, init=False)
+    _window_segmenter = attr.ib(default=None, init=False)
+
+    def reset(self) -> None:
+        """ forget the last eye position, forcing a full-frame search on the next frame."""
+        self.previous = EyeStats()
+
+    def window(self, shape) -> Optional[Tuple[int, int, int, int]]:
+        """
+        The region to search in the next frame.
+        :param shape: the shape of the next frame.
+        :return: (x0, y0, x1, y1) in full-frame pixels, or None if the whole frame must be searched.
+        """
+        prev = self.previous
+        if prev.center_x is None or self._since_refresh >= self.refresh_interval:
+            return None
+        half = max(self.min_half_size, int(math.ceil(self.padding * max(prev.major_axis, prev.minor_axis))))
+        half = -(-half // self.min_half_size) * self.min_half_size
+        height, width = shape[:2]
+        x0, x1 = _clamp(int(prev.center_x) - half, 2 * half + 1, width)
+        y0, y1 = _clamp(int(prev.center_y) - half, 2 * half + 1, height)
+        return x0, y0, x1, y1
+
+    def process(self, frame) -> EyeStats:
+        """
+        Compute the contour and fitted ellipse areas for the next frame.  See `compute_areas`.
+        :param frame: an extracted BGR video frame.
+        :return: A class containing measurement results, in full-frame pixel coordinates.
+        """
+        height, width = frame.shape[:2]
+        if self._frame_segmenter is None:
+            self._frame_segmenter = EyeSegmenter(width=width, height=height)
+            self._window_segmenter = EyeSegmenter(width=width, height=height)
+        roi = self.window(frame.shape)
+        stats = EyeStats()
+        if roi is not None:
+            x0, y0, x1, y1 = roi
+            cropped = self._window_segmenter.process(frame[y0:y1, x0:x1])
+            if cropped.center_x is not None and _inside(cropped, roi, width, height):
+                stats = attr.evolve(cropped, center_x=cropped.center_x + x0, center_y=cropped.center_y + y0)
+        if stats.center_x is None:
+            stats = self._frame_segmenter.process(frame)
+            self._since_refresh = 0
+        else:
+            self._since_refresh += 1
+        self.previous = stats
+        return stats
+
+
+def _clamp(start: int, size: int, limit: int) -> Tuple[int, int]:
+    """ the range [start, start + size), shifted (and if need be shortened) to lie within [0, limit)."""
+    size = min(size, limit)
+    start = min(max(0, start), limit - size)
+    return start, start + size
+
+
+def _inside(stats: EyeStats, roi: Tuple[int, int, int, int], width: int, height: int) -> bool:
+    """
+    True if the ellipse fitted in a window was not clipped by the window.  Sides of the window that lie on the edge of
+    the (width, height) frame don't count: the eye would be clipped there in the whole frame too.
+    """
+    x0, y0, x1, y1 = roi
+    radius = max(stats.major_axis, stats.minor_axis) / 2
+    left = x0 == 0 or stats.center_x >= radius
+    right = x1 == width or stats.center_x <= x1 - x0 - 1 - radius
+    top = y0 == 0 or stats.center_y >= radius
+    bottom = y1 == height or stats.center_y <= y1 - y0 - 1 - radius
+    return left and right and top and bottom
+
+
+@attr.s
+class AdaptiveEyeSampler(object):
+    """
+    Measure the eye in a stream of frames, segmenting only every `stride`-th frame while the eye is steady.  When the
+    contour area changes by more than `tolerance` between segmented frames, or the eye is lost, a blink may be
+    starting: the skipped frames since the last segmented one are segmented after all (they are kept in a small
+    buffer), and every frame is segmented until the eye has been steady for `settle` frames.  The remaining skipped
+    frames are filled in by linear interpolation between their segmented neighbours, and flagged.
+    :param stride: while the eye is steady, segment one frame in this many.
+    :param tolerance: the relative change in contour area between segmented frames that counts as an event.
+    :param settle: after an event, segment every frame until this many in a row are steady (default: `stride`).
+    """
+    stride = attr.ib(default=4, validator=instance_of(int))
+    tolerance = attr.ib(default=0.05, validator=instance_of(float))
+    settle = attr.ib(default=None, validator=optional(instance_of(int)))
+
+    def run(self, frames, nframes: int, start: int = 0) -> Tuple[EyeStatsTable, np.ndarray]:
+        """
+        Measure the eye in every frame.
+        :param frames: (frameid, frame) pairs, as yielded by `FrameSource`.  Frames may be reused buffers.
+        :param nframes: the number of frames.
+        :param start: the frameid of the first frame.
+        :return: a table with one row per frame, and a boolean array that is True for rows that were interpolated.
+        """
+        table = EyeStatsTable.allocate(nframes)
+        interpolated = np.zeros(nframes, dtype=bool)
+        area = table.column('contour_area')
+        settle = self.stride if self.settle is None else self.settle
+        segmenter = None
+        skipped = []  # (row, frame) for frames skipped since the last segmented one.
+        last = None
+        steady = 0
+        for frameid, frame in frames:
+            row = frameid - start
+            if segmenter is None:
+                segmenter = EyeSegmenter(width=frame.shape[1], height=frame.shape[0])
+            if last is not None and steady >= settle and row - last < self.stride:
+                skipped.append((row, frame.copy()))
+                continue
+            found = segmenter.process_into(frame, table, row)
+            if not found or last is None or not abs(area[row] - area[last]) <= self.tolerance * abs(area[last]):
+                # the change began somewhere among the skipped frames, so measure them after all.
+                for r, f in skipped:
+                    segmenter.process_into(f, table, r)
+                steady = 0
+            else:
+                interpolated[[r for r, _ in skipped]] = True
+                count('eyes.frames_skipped', len(skipped))
+                steady += 1
+            skipped = []
+            last = row
+        # trailing frames have nothing to interpolate towards.
+        for r, f in skipped:
+            segmenter.process_into(f, table, r)
+        known, missing = np.flatnonzero(~interpolated), np.flatnonzero(interpolated)
+        for column in table.values.T:
+            column[missing] = np.interp(missing, known, column[known])
+        return table, interpolated
+
+
+def track_eyes(video: VideoFileData, workers: int = 1, chunk_size: int = 2400, roi: bool = False,
+               stride: int = 1, mode: MeasurementMode = MeasurementMode.ellipse,
+               ellipse_every: int = 0, index: bool = False, fmt: Optional[str] = None) -> VideoFileData:
+    """
+    Measure the eye in every frame of a video.  The video is split into fixed-size frame ranges, each of which is
+    decoded and segmented independently by a worker process; results are merged back in frame order.  Chunk
+    boundaries do not depend on `workers`, so the output is identical for any number of workers.
+    :param video: the video to analyze.  Its `eye` attribute is replaced with the results.
+    :param workers: the number of worker processes to run.
+    :param chunk_size: the number of frames handled by one unit of work.
+    :param roi: if True, only segment a window around the eye's last position.  See `RoiEyeTracker`.
+    :param stride: if more than 1, segment only one frame in `stride` while the eye is steady, and interpolate the
+    rest.  See `AdaptiveEyeSampler`.  `eye` then has an extra boolean column, <side>_interpolated.
+    :param mode: how to measure the eye in each frame.  See `MeasurementMode`; ignored with `roi` or `stride`.
+    :param ellipse_every: in modes other than ellipse, still fit an ellipse to one frame in this many (0: never).
+    :param index: seek to each chunk through the video's frame index (see `frameindex`), building it if needed, and
+    correct `video.nframes` from it.  Off by default: OpenCV's own seek also starts decoding at the previous keyframe,
+    and is as fast or faster (see `benchmarks.suite.bench_seek`).
+    :param fmt: the frame index's checkpoint format (see `checkpoint`); normally `config.storage.checkpoint_format`.
+    :return: the same video, with one row per frame in `eye`.
+    """
+    if roi and stride > 1:
+        raise ValueError("roi tracking and adaptive frame skipping can't be combined")
+    from joblib import Parallel, delayed
+
+    frames = None
+    if index:
+        frames = frameindex.for_video(video, fmt=fmt)
+        frameindex.validate_nframes(video, frames)
+    chunks = _frame_chunks(video.nframes, chunk_size)
+    timing = instrumentation.is_enabled()
+    results = Parallel(n_jobs=workers)(delayed(_track_chunk)(video.name, start, stop, roi, timing, stride,
+                                                             mode, ellipse_every, frames)
+                                       for start, stop in chunks)
+    table = EyeStatsTable.for_video(video)
+    interpolated = np.zeros(len(table), dtype=bool)
+    for (start, stop), (result, skipped, recorded) in zip(chunks, results):
+        table.values[start:stop] = result.values
+        interpolated[start:stop] = skipped
+        if recorded is not None:
+            instrumentation.recorder(video.labelname).merge(recorded)
+    eye = table.to_dataframe(prefix=video.side.name + "_")
+    eye.insert(0, 'frameid', np.arange(len(table)))
+    if stride > 1:
+        eye[video.side.name + '_interpolated'] = interpolated
+    video.eye = eye
+    return video
+
+
+def _frame_chunks(nframes: int, chunk_size: int) -> List[Tuple[int, int]]:
+    """ split the frame range [0, nframes) into contiguous half-open ranges of at most `chunk_size` frames."""
+    starts = range(0, nframes, chunk_size)
+    return [(start, min(start + chunk_size, nframes)) for start in starts]
+
+
+def _track_chunk(filename: str, start: int, stop: int, roi: bool = False, timing: bool = False, stride: int = 1,
+                 mode: MeasurementMode = MeasurementMode.ellipse, ellipse_every: int = 0,
+                 index: Optional[frameindex.FrameIndex] = None
+                 ) -> Tuple[EyeStatsTable, np.ndarray, Optional[instrumentation.Recorder]]:
+    """
+    Decode frames [start, stop) of a video and measure the eye in each one.
+    :param filename: the video to read.
+    :param start: the first frame to read.
+    :param stop: one past the last frame to read.
+    :param roi: track the eye region with a `RoiEyeTracker` rather than segmenting whole frames.
+    :param timing: collect instrumentation (which may be off in a worker process even if it is on in the parent).
+    :param stride: segment only one frame in this many while the eye is steady.  See `AdaptiveEyeSampler`.
+    :param mode: how to measure the eye.  See `MeasurementMode`.
+    :param ellipse_every: see `EyeSegmenter`.
+    :param index: the video's frame index, to seek to `start` with.
+    :return: a table with one row per frame (frames that could not be read or had no eye are NaN), a boolean array
+    marking interpolated rows, and the chunk's timings if `timing` is set.
+    """
+    instrumentation.enable(timing)
+    table = EyeStatsTable.allocate(stop - start)
+    tracker = RoiEyeTracker()
+    recorded = instrumentation.Recorder(label=filename)
+    interpolated = np.zeros(stop - start, dtype=bool)
+    source = FrameSource(filename, start=start, stop=stop, index=index)
+    with instrumentation.recording(recorded), source as frames:
+        if stride > 1:
+            table, interpolated = AdaptiveEyeSampler(stride=stride).run(frames, stop - start, start)
+        else:
+            segmenter = EyeSegmenter(width=frames.width, height=frames.height, mode=mode,
+                                     ellipse_every=ellipse_every)
+            for frameid, frame in frames:
+                if roi:
+                    table[frameid - start] = tracker.process(frame)
+                else:
+                    segmenter.process_into(frame, table, frameid - start)
+    return table, interpolated, (recorded if timing else None)
+
+
 if __name__ == "__main__":
     this_frame = cv2.imread('first.png')
     compute_areas(this_frame)
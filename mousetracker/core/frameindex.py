@@ -0,0 +1,205 @@
+"""
+Frame index sidecars, for fast and exact random access into videos.
+
+Seeking a `cv2.VideoCapture` by frame number makes the decoder guess where the frame is from its timestamp, which
+sometimes lands on the wrong frame, and containers often report an approximate frame count.  A `FrameIndex` records, for every frame in display
+order, its timestamp and whether it is a keyframe.  It is built once per video by scanning the container's packets,
+which needs no decoding (ffprobe if it is installed, otherwise OpenCV's raw packet mode), and is kept next to the
+video as a checkpoint at `VideoFileData.frameindex`.
+
+To reach frame n, a reader seeks to the last keyframe at or before n, where decoding can start cleanly, and decodes
+forward; if it is already positioned within reach of n, it just decodes forward.  An index without keyframes (OpenCV
+could not read the packets raw) leaves the seek to the decoder.  Either way, the landing position is checked against
+the recorded timestamps, so an inexact seek is caught and corrected rather than returning the wrong frame.  The
+check assumes the decoder reports timestamps as the scan recorded them; where it doesn't (MPEG-1 reports each frame's
+successor), every seek looks inexact and falls back to decoding from the start, so indexed seeking is opt-in.
+"""
+import shutil
+import subprocess
+from logging import info, warning
+from typing import Optional
+
+import attr
+import cv2
+import numpy as np
+import pandas as pd
+from attr.validators import instance_of
+
+from mousetracker.core import checkpoint, instrumentation
+from mousetracker.core.base import VideoFileData
+from mousetracker.core.cache import StageCache, tool_version
+
+
+@attr.s(cmp=False)
+class FrameIndex(object):
+    """
+    The timestamps and keyframes of a video's frames, in display order.
+    :param timestamps: the time of each frame, in seconds from the first frame.
+    :param keyframes: True for each frame that decoding can start at; all False if that isn't known.
+    """
+    timestamps = attr.ib(validator=instance_of(np.ndarray))
+    keyframes = attr.ib(validator=instance_of(np.ndarray))
+
+    def __attrs_post_init__(self):
+        if len(self.timestamps) != len(self.keyframes):
+            raise ValueError("timestamps and keyframes must have one entry per frame")
+        # the keyframe at or before each frame.  The first frame is always decodable.
+        marks = np.where(self.keyframes, np.arange(len(self.keyframes)), 0)
+        self._previous_key = np.maximum.accumulate(marks) if len(marks) else marks
+        # half the smallest gap between frames: how far a decoder's timestamp may be off and still be the same frame.
+        gaps = np.diff(self.timestamps)
+        self._tolerance = gaps[gaps > 0].min() / 2 if np.any(gaps > 0) else np.inf
+
+    @property
+    def nframes(self) -> int:
+        return len(self.timestamps)
+
+    @property
+    def has_keyframes(self) -> bool:
+        return bool(self.keyframes.any())
+
+    def keyframe_before(self, frameid: int) -> int:
+        """ the last keyframe at or before a frame."""
+        return int(self._previous_key[frameid])
+
+    def seek(self, cap: cv2.VideoCapture, frameid: int, position: Optional[int] = None) -> None:
+        """
+        Position a capture so that its next `read` returns a given frame.
+        :param cap: an open capture of the indexed video.
+        :param frameid: the frame to go to.
+        :param position: the frame the capture would read next, if known.  If the target is ahead of it and no further
+        than the target's keyframe is, the capture just decodes forward.
+        :raises IOError: if the video ends before `frameid`.
+        """
+        if not 0 <= frameid < self.nframes:
+            raise IOError(f"frame {frameid} is outside the video's {self.nframes} frames")
+        key = self.keyframe_before(frameid)
+        if position is not None and key <= position <= frameid and (self.has_keyframes or position == frameid):
+            start = position
+        elif self.has_keyframes:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, key)
+            start = key
+        else:
+            # with no keyframe to start from, decoding forward could mean decoding the whole video.
+            cap.set(cv2.CAP_PROP_POS_FRAMES, frameid)
+            start = frameid
+        with instrumentation.timer('frameindex.decode_forward'):
+            self._grab(cap, frameid - start)
+        instrumentation.count('frameindex.frames_skipped', int(frameid - start))
+        if frameid > 0 and not self._landed(cap, frameid):
+            # the seek missed.  Decoding from the first frame is slow, but always exact.
+            warning(f'inexact seek to frame {frameid}; decoding from the start instead')
+            instrumentation.count('frameindex.inexact_seeks')
+            cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            self._grab(cap, frameid)
+
+    def _landed(self, cap: cv2.VideoCapture, frameid: int) -> bool:
+        """ check that the last frame the capture decoded is the one before `frameid`."""
+        reported = cap.get(cv2.CAP_PROP_POS_MSEC) / 1000
+        return abs(reported - self.timestamps[frameid - 1]) <= self._tolerance
+
+    @staticmethod
+    def _grab(cap: cv2.VideoCapture, n: int) -> None:
+        for _ in range(n):
+            if not cap.grab():
+                raise IOError("the video ended before the frame sought")
+
+    def to_dataframe(self) -> pd.DataFrame:
+        return pd.DataFrame({'frameid': np.arange(self.nframes), 'timestamp': self.timestamps,
+                             'keyframe': self.keyframes})
+
+    @classmethod
+    def from_dataframe(cls, data: pd.DataFrame) -> 'FrameIndex':
+        return cls(timestamps=data['timestamp'].to_numpy(dtype=np.float64),
+                   keyframes=data['keyframe'].to_numpy(dtype=bool))
+
+
+@instrumentation.timed('frameindex.build')
+def build(filename: str) -> FrameIndex:
+    """
+    Scan a video's packets to index its frames.  Uses ffprobe if it is installed, otherwise OpenCV.
+    :param filename: the video.
+    :return: the index.
+    """
+    ffprobe = shutil.which('ffprobe')
+    index = _scan_ffprobe(ffprobe, filename) if ffprobe else None
+    return index if index is not None else _scan_opencv(filename)
+
+
+def _scan_ffprobe(ffprobe: str, filename: str) -> Optional[FrameIndex]:
+    """ index a video from ffprobe's packet list, or return None if ffprobe can't read it."""
+    command = [ffprobe, '-v', 'error', '-select_streams', 'v:0', '-show_entries', 'packet=pts_time,dts_time,flags',
+               '-of', 'csv=p=0', filename]
+    result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        return None
+    rows = [line.split(',') for line in result.stdout.decode().splitlines() if line.strip()]
+    if not rows:
+        return None
+    packets = pd.DataFrame(rows, columns=['pts', 'dts', 'flags'])
+    # containers without presentation times (e.g. some AVIs) have no reordering, so decode order is display order.
+    times = pd.to_numeric(packets['pts'], errors='coerce').fillna(pd.to_numeric(packets['dts'], errors='coerce'))
+    if times.isna().any():
+        return None
+    order = np.argsort(times.to_numpy(), kind='stable')
+    timestamps = times.to_numpy()[order]
+    return FrameIndex(timestamps=timestamps - timestamps[0],
+                      keyframes=packets['flags'].str.contains('K').to_numpy()[order])
+
+
+def _scan_opencv(filename: str) -> FrameIndex:
+    """
+    Index a video by reading its packets undecoded.  Packets are taken to be in display order, which holds for codecs
+    without B-frames; most of ours.
+    """
+    cap = cv2.VideoCapture(filename, cv2.CAP_FFMPEG)
+    if not cap.isOpened():
+        raise IOError(f"could not open {filename}")
+    try:
+        raw = cap.set(cv2.CAP_PROP_FORMAT, -1)
+        timestamps, keyframes = [], []
+        while cap.grab():
+            timestamps.append(cap.get(cv2.CAP_PROP_POS_MSEC) / 1000)
+            # without raw packets there is no keyframe information; seeks are then left to the decoder.
+            keyframes.append(raw and bool(cap.get(cv2.CAP_PROP_LRF_HAS_KEY_FRAME)))
+    finally:
+        cap.release()
+    timestamps = np.asarray(timestamps, dtype=np.float64)
+    return FrameIndex(timestamps=timestamps - (timestamps[0] if len(timestamps) else 0),
+                      keyframes=np.asarray(keyframes, dtype=bool))
+
+
+def for_video(video: VideoFileData, cache: StageCache = None, fmt: Optional[str] = None) -> FrameIndex:
+    """
+    Load a video's frame index, building it first if there is none or the video has changed since.
+    :param video:
+    :param cache: the video's stage cache (opened if not given).
+    :param fmt: the checkpoint format (see `checkpoint`).
+    :return: the index.
+    """
+    cache = cache or StageCache.for_video(video)
+    target = checkpoint.checkpoint_path(video.frameindex, fmt)
+    tool = tool_version(shutil.which('ffprobe')) or f'opencv@{cv2.__version__}'
+    key = cache.key('frameindex', [cache.fingerprint(video.name)], {'format': fmt}, tool)
+    if cache.lookup('frameindex', key, [target]):
+        return FrameIndex.from_dataframe(checkpoint.load(video.frameindex, fmt=fmt))
+    info(f'indexing frames of {video.labelname}')
+    index = build(video.name)
+    checkpoint.save(index.to_dataframe(), video.frameindex, fmt)
+    cache.record('frameindex', key, [target])
+    return index
+
+
+def validate_nframes(video: VideoFileData, index: FrameIndex) -> bool:
+    """
+    Check a video's frame count against its index, correcting it if they differ.  Containers often report an
+    approximate count.
+    :param video: the video.  Its `nframes` is set to the indexed count.
+    :param index: the video's index.
+    :return: True if the count was right.
+    """
+    if video.nframes == index.nframes:
+        return True
+    warning(f'{video.labelname} reports {video.nframes} frames but has {index.nframes}; using {index.nframes}')
+    video.nframes = index.nframes
+    return False
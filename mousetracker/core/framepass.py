@@ -0,0 +1,327 @@
+"""
+A single decoding pass over a video that feeds several per-frame analyses at once.
+
+Each frame is decoded once, straight into a ring of frame buffers in shared memory, and handed to every analyzer.
+With `parallel` set, each analyzer runs in its own worker process, reading frames from the ring without copying them
+and writing results straight into a shared results array; a buffer is reused once every worker is done with it.
+The results are collected into one frame-indexed table, with the same layout as `VideoFileData.eye`, so they join
+into the summary file like eye data does.
+
+An analyzer is any object with:
+ - `columns`: the names of the values it measures per frame;
+ - `start(width, height, out)`: prepare for frames of the given size, writing results into `out`, an array with one
+   row per frame and one column per name in `columns`, initially NaN;
+ - `process(frameid, frame)`: measure one BGR frame.  Frames arrive in order.
+"""
+import multiprocessing
+from collections import deque
+from logging import info
+from multiprocessing import shared_memory
+from queue import Empty
+from typing import List, Optional, Sequence, Tuple
+
+import attr
+import cv2
+import numpy as np
+import pandas as pd
+from attr.validators import instance_of
+from attrs_utils import ensure_enum
+
+from mousetracker.core import instrumentation
+from mousetracker.core.base import VideoFileData
+from mousetracker.core.eyes import EYE_FIELDS, EyeSegmenter, EyeStatsTable, MeasurementMode
+
+# how long the decoder waits for a worker before checking that it is still alive, in seconds.
+_POLL_INTERVAL = 0.1
+
+
+@attr.s
+class EyeAnalyzer(object):
+    """
+    Eye segmentation and measurement, as `eyes.track_eyes` does it.
+    :param mode: how to measure the eye.  See `MeasurementMode`.
+    :param ellipse_every: see `EyeSegmenter`.
+    """
+    mode = attr.ib(default=MeasurementMode.ellipse, convert=ensure_enum(MeasurementMode))
+    ellipse_every = attr.ib(default=0, validator=instance_of(int))
+    columns = EYE_FIELDS
+
+    def start(self, width: int, height: int, out: np.ndarray) -> None:
+        self._segmenter = EyeSegmenter(width=width, height=height, mode=self.mode, ellipse_every=self.ellipse_every)
+        self._table = EyeStatsTable(values=out)
+
+    def process(self, frameid: int, frame: np.ndarray) -> None:
+        self._segmenter.process_into(frame, self._table, frameid)
+
+
+@attr.s
+class MotionEnergy(object):
+    """
+    The mean absolute change in grey level from the previous frame, within a region such as the whisker pad.  A cheap
+    measure of how much is moving; NaN for the first frame.
+    :param roi: the region, as a rectangle (x, y, width, height), or None for the whole frame.
+    """
+    roi = attr.ib(default=None, convert=lambda r: None if r is None else tuple(int(x) for x in r))
+    columns = ('motion_energy',)
+
+    def start(self, width: int, height: int, out: np.ndarray) -> None:
+        x, y, w, h = self.roi if self.roi is not None else (0, 0, width, height)
+        self._crop = (slice(y, y + h), slice(x, x + w))
+        self._out = out
+        self._grey = None
+        self._previous = None
+        self._previous_id = None
+
+    def process(self, frameid: int, frame: np.ndarray) -> None:
+        crop = frame[self._crop]
+        if self._grey is None:
+            self._grey = np.empty(crop.shape[:2], dtype=np.uint8)
+            self._previous = np.empty_like(self._grey)
+            self._diff = np.empty_like(self._grey)
+        else:
+            self._grey, self._previous = self._previous, self._grey
+        cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY, dst=self._grey)
+        if self._previous_id == frameid - 1:
+            cv2.absdiff(self._grey, self._previous, dst=self._diff)
+            self._out[frameid, 0] = cv2.mean(self._diff)[0]
+        self._previous_id = frameid
+
+
+@attr.s
+class Brightness(object):
+    """
+    Frame exposure, for quality control: the mean and standard deviation of grey levels, and the fraction of pixels
+    that are clipped (0 or 255).
+    :param inverted: the frames are inverted, like the greyscale side videos written for whisk; brightness is reported
+    for the original frames.  Contrast and clipping are the same either way.
+    """
+    inverted = attr.ib(default=False, validator=instance_of(bool))
+    columns = ('brightness', 'contrast', 'clipped')
+
+    def start(self, width: int, height: int, out: np.ndarray) -> None:
+        self._grey = np.empty((height, width), dtype=np.uint8)
+        self._out = out
+
+    def process(self, frameid: int, frame: np.ndarray) -> None:
+        cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=self._grey)
+        mean, std = cv2.meanStdDev(self._grey)
+        # the histogram's end bins count the clipped pixels.
+        hist = cv2.calcHist([self._grey], [0], None, [256], [0, 256]).ravel()
+        mean = 255 - mean.item() if self.inverted else mean.item()
+        self._out[frameid] = (mean, std.item(), (hist[0] + hist[255]) / self._grey.size)
+
+
+def default_analyzers(video: VideoFileData, config=None, inverted: bool = False) -> List:
+    """
+    The standard analyses: the eye, whisker-pad motion energy and brightness.
+    :param video: the video to analyze.
+    :param config: a `Config`; its whisker_pad section, if any, places the motion energy region.
+    :param inverted: the video is inverted (see `Brightness`).
+    :return: the analyzers.
+    """
+    roi = getattr(config.whisker_pad, video.side.name) if config is not None else None
+    return [EyeAnalyzer(), MotionEnergy(roi=roi), Brightness(inverted=inverted)]
+
+
+def run_frame_pass(video: VideoFileData, analyzers: Optional[Sequence] = None, parallel: bool = True,
+                   capacity: int = 16) -> pd.DataFrame:
+    """
+    Decode a video once and run several per-frame analyses on it.
+    :param video: the video to analyze.
+    :param analyzers: the analyses to run (default: `default_analyzers(video)`).  Column names must not collide.
+    :param parallel: run each analyzer in its own worker process.  Otherwise they run one after another on each
+    frame, in this process.
+    :param capacity: the number of frames that may be decoded ahead of the slowest analyzer.
+    :return: a data frame with a frameid column, then each analyzer's columns prefixed with the side of the face (as
+    in `VideoFileData.eye`), with one row per frame of `video.nframes`.  Frames that could not be decoded are NaN.
+    """
+    analyzers = list(analyzers) if analyzers is not None else default_analyzers(video)
+    names = [video.side.name + '_' + column for a in analyzers for column in a.columns]
+    if len(set(names)) != len(names):
+        raise ValueError(f"analyzers measure overlapping columns: {names}")
+    info(f'analyzing {len(analyzers)} measures per frame of {video.labelname}')
+    cap = cv2.VideoCapture(video.name)
+    if not cap.isOpened():
+        raise IOError(f"could not open {video.name}")
+    shape = (int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)), int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), 3)
+    widths = [len(a.columns) for a in analyzers]
+    segments, ring, outputs = [], None, []
+    try:
+        with instrumentation.recording(instrumentation.recorder(video.labelname)):
+            if parallel:
+                ring = _shared((capacity, *shape), np.uint8, segments)
+                outputs = [_shared((video.nframes, n), np.float64, segments) for n in widths]
+                decoded = _run_workers(cap, analyzers, ring, outputs, video)
+            else:
+                ring = (np.empty((1, *shape), dtype=np.uint8), None)
+                outputs = [(np.full((video.nframes, n), np.nan), None) for n in widths]
+                decoded = _run_inline(cap, analyzers, ring[0][0], [out for out, _ in outputs], video.nframes)
+            instrumentation.count('framepass.frames', decoded)
+        table = pd.DataFrame(np.hstack([out for out, _ in outputs]) if outputs else np.empty((video.nframes, 0)),
+                             columns=names)
+    finally:
+        cap.release()
+        # arrays over shared memory must go before it can be released.
+        ring = outputs = None
+        for segment in segments:
+            segment.close()
+            segment.unlink()
+    table.insert(0, 'frameid', np.arange(video.nframes))
+    return table
+
+
+def analyze_video(video: VideoFileData, config=None, parallel: bool = True, eye: bool = True,
+                  inverted: bool = False) -> VideoFileData:
+    """
+    `run_frame_pass` with the default analyzers, storing the results as the video's eye data, like
+    `eyes.track_eyes` does; the motion energy and brightness columns are carried along into the summary file.
+    :param video: the video to analyze.  Its `eye` attribute is replaced with the results.
+    :param config: see `default_analyzers`.
+    :param parallel: see `run_frame_pass`.
+    :param eye: include the eye analysis.  Without it, the other columns are added to the video's existing eye data
+    instead (replacing any from an earlier pass), for videos whose eyes were measured elsewhere.
+    :param inverted: see `default_analyzers`.
+    :return: the same video.
+    """
+    analyzers = [a for a in default_analyzers(video, config, inverted) if eye or not isinstance(a, EyeAnalyzer)]
+    results = run_frame_pass(video, analyzers, parallel=parallel)
+    if eye:
+        video.eye = results
+        return video
+    # eye data is indexed by frameid once it has been aligned, and has it as a column before then.
+    existing = video.eye.drop(columns=[c for c in results.columns if c != 'frameid'], errors='ignore')
+    if 'frameid' in existing.columns:
+        video.eye = existing.merge(results, on='frameid', how='left')
+    else:
+        video.eye = existing.join(results.set_index('frameid'))
+    return video
+
+
+def _shared(shape: Tuple[int, ...], dtype, segments: list) -> Tuple[np.ndarray, str]:
+    """ allocate an array in a new shared memory segment, initially NaN for float arrays; returns it and its name."""
+    nbytes = max(int(np.prod(shape)) * np.dtype(dtype).itemsize, 1)
+    segment = shared_memory.SharedMemory(create=True, size=nbytes)
+    segments.append(segment)
+    array = np.ndarray(shape, dtype=dtype, buffer=segment.buf)
+    if np.issubdtype(dtype, np.floating):
+        array.fill(np.nan)
+    return array, segment.name
+
+
+def _run_inline(cap, analyzers: Sequence, frame: np.ndarray, outputs: List[np.ndarray], nframes: int) -> int:
+    """ decode every frame into one buffer and run each analyzer on it in turn.  Returns the number decoded."""
+    height, width = frame.shape[:2]
+    for analyzer, out in zip(analyzers, outputs):
+        analyzer.start(width, height, out)
+    for frameid in range(nframes):
+        with instrumentation.timer('framepass.decode'):
+            ok, _ = cap.read(frame)
+        if not ok:
+            return frameid
+        for analyzer in analyzers:
+            with instrumentation.timer(f'framepass.{type(analyzer).__name__}'):
+                analyzer.process(frameid, frame)
+    return nframes
+
+
+def _run_workers(cap, analyzers: Sequence, ring: Tuple[np.ndarray, str], outputs: List[Tuple[np.ndarray, str]],
+                 video: VideoFileData) -> int:
+    """
+    Decode every frame into the shared ring, and hand each one to a worker process per analyzer.  Returns the number
+    of frames decoded.
+    """
+    frames, ring_name = ring
+    capacity, height, width = frames.shape[:3]
+    timing = instrumentation.is_enabled()
+    done = multiprocessing.Queue()
+    inboxes = [multiprocessing.Queue() for _ in analyzers]
+    workers = [multiprocessing.Process(target=_worker, name=f'{type(a).__name__} {video.labelname}',
+                                       args=(a, i, ring_name, frames.shape, name, out.shape, inbox, done, timing),
+                                       daemon=True)
+               for i, (a, (out, name), inbox) in enumerate(zip(analyzers, outputs, inboxes))]
+    for worker in workers:
+        worker.start()
+    # the number of workers yet to finish with each buffer.
+    readers = np.zeros(capacity, dtype=int)
+    free = deque(range(capacity))
+    running = len(workers)
+
+    def receive() -> None:
+        nonlocal running
+        try:
+            kind, index, payload = done.get(timeout=_POLL_INTERVAL)
+        except Empty:
+            dead = [w.name for w in workers if not w.is_alive() and w.exitcode]
+            if dead:
+                raise RuntimeError(f"frame analysis worker(s) died: {', '.join(dead)}")
+            return
+        if kind == 'done':
+            readers[payload] -= 1
+            if readers[payload] == 0:
+                free.append(payload)
+        elif kind == 'finished':
+            running -= 1
+            if payload is not None:
+                instrumentation.recorder(video.labelname).merge(payload)
+        else:
+            raise RuntimeError(f"{workers[index].name} failed: {payload}")
+
+    decoded = 0
+    try:
+        for frameid in range(video.nframes):
+            while not free:
+                receive()
+            slot = free.popleft()
+            with instrumentation.timer('framepass.decode'):
+                ok, _ = cap.read(frames[slot])
+            if not ok:
+                free.append(slot)
+                break
+            readers[slot] = len(workers)
+            for inbox in inboxes:
+                inbox.put((frameid, slot))
+            decoded += 1
+        for inbox in inboxes:
+            inbox.put(None)
+        while running:
+            receive()
+    finally:
+        for worker in workers:
+            worker.join(timeout=_POLL_INTERVAL)
+            if worker.is_alive():
+                worker.terminate()
+                worker.join()
+    return decoded
+
+
+def _worker(analyzer, index: int, ring_name: str, ring_shape: Tuple[int, ...], out_name: str,
+            out_shape: Tuple[int, ...], inbox, done, timing: bool) -> None:
+    """
+    Worker process body: run one analyzer on each frame named in `inbox`, until it receives None.
+    Reports ('done', index, slot) after each frame, then ('finished', index, recorder or None); or
+    ('failed', index, message) on an error.
+    """
+    instrumentation.enable(timing)
+    recorded = instrumentation.Recorder(label=type(analyzer).__name__)
+    ring = shared_memory.SharedMemory(name=ring_name)
+    out = shared_memory.SharedMemory(name=out_name)
+    try:
+        frames = np.ndarray(ring_shape, dtype=np.uint8, buffer=ring.buf)
+        results = np.ndarray(out_shape, dtype=np.float64, buffer=out.buf)
+        analyzer.start(ring_shape[2], ring_shape[1], results)
+        name = f'framepass.{type(analyzer).__name__}'
+        with instrumentation.recording(recorded):
+            for frameid, slot in iter(inbox.get, None):
+                with instrumentation.timer(name):
+                    analyzer.process(frameid, frames[slot])
+                done.put(('done', index, slot))
+        done.put(('finished', index, recorded if timing else None))
+    except Exception as e:
+        done.put(('failed', index, repr(e)))
+    finally:
+        # views into the segments must go before the segments can close.
+        frames = results = None
+        analyzer = None
+        ring.close()
+        out.close()
+
@@ -0,0 +1,190 @@
+"""
+Lightweight timers and counters for the pipeline's hot paths.
+
+Instrumentation is off unless `enable()` is called or the MOUSETRACKER_TIMING environment variable is set to a
+non-empty value.  While it is off, every timer and counter returns after a single flag check.
+
+Measurements go to the active `Recorder`: the one selected with `recording(...)` in the current thread, or a
+process-wide default.  Recorders are kept per label (normally `VideoFileData.labelname`), so timings for a video
+accumulate across pipeline steps and are written together by `save_report`.
+"""
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict
+
+import attr
+
+from mousetracker.core.base import VideoFileData
+
+_enabled = bool(os.environ.get('MOUSETRACKER_TIMING'))
+_local = threading.local()
+_recorders = {}
+_lock = threading.Lock()
+# guards the contents of every recorder.  Recorders don't hold their own lock, so they can be pickled and sent back
+# from worker processes.
+_record_lock = threading.Lock()
+
+
+def enable(flag: bool = True) -> None:
+    """ switch instrumentation on or off."""
+    global _enabled
+    _enabled = flag
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+@attr.s
+class Recorder(object):
+    """
+    Accumulated timings and counts for one video.
+    :param label: the name of what is being measured.
+    """
+    label = attr.ib(default='')
+    timings = attr.ib(default=attr.Factory(dict), init=False)
+    counters = attr.ib(default=attr.Factory(dict), init=False)
+
+    def add_time(self, name: str, seconds: float) -> None:
+        """ record one timed call."""
+        with _record_lock:
+            entry = self.timings.get(name)
+            if entry is None:
+                self.timings[name] = [1, seconds, seconds, seconds]
+            else:
+                entry[0] += 1
+                entry[1] += seconds
+                entry[2] = min(entry[2], seconds)
+                entry[3] = max(entry[3], seconds)
+
+    def count(self, name: str, n: int = 1) -> None:
+        """ add to a counter."""
+        with _record_lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def merge(self, other: 'Recorder') -> None:
+        """ add another recorder's measurements (e.g. from a worker process) to this one."""
+        with _record_lock:
+            for name, (n, total, low, high) in other.timings.items():
+                entry = self.timings.setdefault(name, [0, 0.0, low, high])
+                entry[0] += n
+                entry[1] += total
+                entry[2] = min(entry[2], low)
+                entry[3] = max(entry[3], high)
+            for name, n in other.counters.items():
+                self.counters[name] = self.counters.get(name, 0) + n
+
+    @contextmanager
+    def timer(self, name: str):
+        """ time the body of a `with` block, regardless of which recorder is active."""
+        if not _enabled:
+            yield
+            return
+        tic = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - tic)
+
+    def to_dict(self) -> Dict:
+        """
+        :return: the report: the label, then per-timer call counts and total, mean, min and max seconds, then counters.
+        """
+        with _record_lock:
+            timers = {name: {'calls': n, 'total_s': total, 'mean_s': total / n, 'min_s': low, 'max_s': high}
+                      for name, (n, total, low, high) in sorted(self.timings.items())}
+            return {'label': self.label, 'timers': timers, 'counters': dict(sorted(self.counters.items()))}
+
+
+def recorder(label: str = '') -> Recorder:
+    """
+    :param label: a video's label.
+    :return: the recorder for `label`, created if it does not exist yet.
+    """
+    with _lock:
+        if label not in _recorders:
+            _recorders[label] = Recorder(label=label)
+        return _recorders[label]
+
+
+def active() -> Recorder:
+    """ the recorder that timers and counters in this thread report to."""
+    current = getattr(_local, 'recorder', None)
+    return current if current is not None else recorder()
+
+
+@contextmanager
+def recording(target: Recorder):
+    """ make `target` the active recorder in this thread for the body of a `with` block."""
+    previous = getattr(_local, 'recorder', None)
+    _local.recorder = target
+    try:
+        yield target
+    finally:
+        _local.recorder = previous
+
+
+class _NullTimer(object):
+    """ a reusable do-nothing context manager, returned by `timer` when instrumentation is off."""
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+def timer(name: str):
+    """
+    Time the body of a `with` block, on the active recorder.
+    :param name: the timer's name, e.g. 'eyes.red_mask'.
+    :return: a context manager.
+    """
+    return active().timer(name) if _enabled else _NULL_TIMER
+
+
+def timed(name: str):
+    """
+    Decorator that times every call to a function, on the active recorder.
+    :param name: the timer's name.
+    """
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            tic = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                active().add_time(name, time.perf_counter() - tic)
+        return wrapper
+    return decorate
+
+
+def count(name: str, n: int = 1) -> None:
+    """ add to a counter on the active recorder."""
+    if _enabled:
+        active().count(name, n)
+
+
+def save_report(video: VideoFileData) -> None:
+    """
+    Write the timing report for a video to `video.timingfile`, as JSON, and start its counts afresh.  Nothing is
+    written while instrumentation is off.
+    :param video: the video.
+    """
+    if not _enabled:
+        return
+    with _lock:
+        target = _recorders.pop(video.labelname, None)
+    if target is None:
+        return
+    with open(video.timingfile, 'w') as f:
+        json.dump(target.to_dict(), f, indent=1)
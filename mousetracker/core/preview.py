@@ -0,0 +1,117 @@
+"""
+A fast whisking estimate computed straight from video, for screening recordings before running the whisk toolchain.
+
+Within a whisker-pad region, the pixels that change from one frame to the next are mostly whiskers, at their old and
+new positions.  The dominant orientation of the image edges at those pixels (from the motion-weighted structure
+tensor) is perpendicular to the whiskers, which gives a per-frame angle that follows the whisk toolchain's
+`mean_degrees` closely enough to see whisking bouts, their frequency and their amplitude.  Angles are in degrees
+counter-clockwise from the image's x axis, as whisk reports them.
+"""
+from logging import info
+from typing import Optional, Tuple
+
+import cv2
+import numpy as np
+import pandas as pd
+
+from mousetracker.core import instrumentation
+from mousetracker.core.video import FrameSource
+
+# frames processed together; the working set is a few float32 copies of a block of the region.
+DEFAULT_BLOCK = 64
+# frames whose mean absolute change in the region is below this (in grey levels per pixel) have no measurable
+# whisker movement, and are filled from their neighbours.
+MIN_MOTION = 0.05
+# whiskers are a pixel or two wide, too thin for finite differences to measure their edges reliably; a little blur
+# widens them first.
+SMOOTHING = 1.0
+
+
+def pad_orientation(block: np.ndarray, previous: np.ndarray,
+                    sigma: float = SMOOTHING) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    The dominant orientation of the moving edges in each frame of a block.
+    :param block: (frames, height, width) greyscale frames.
+    :param previous: the (height, width) frame before the block, to difference the first frame against.
+    :param sigma: the standard deviation of the gaussian blur applied first, in pixels; 0 for none.
+    :return: per-frame whisker angles, in degrees within [-90, 90); and the mean absolute change per pixel, which
+    weights each angle.
+    """
+    frames = np.concatenate((previous[None], block)).astype(np.float32)
+    if sigma > 0:
+        for frame in frames:
+            cv2.GaussianBlur(frame, (0, 0), sigma, dst=frame)
+    frames, before = frames[1:], frames[:-1]
+    weight = np.abs(frames - before)
+    gy, gx = np.gradient(frames, axis=(1, 2))
+    wgx, wgy = weight * gx, weight * gy
+    jxx = np.einsum('fij,fij->f', wgx, gx)
+    jyy = np.einsum('fij,fij->f', wgy, gy)
+    jxy = np.einsum('fij,fij->f', wgx, gy)
+    # the gradients point across the whiskers.  Turning them a quarter turn to lie along the whiskers, flipping the
+    # image's y axis and wrapping into [-90, 90) leaves -gradient % 180 - 90.
+    gradient = 0.5 * np.degrees(np.arctan2(2 * jxy, jxx - jyy))
+    angle = -gradient % 180 - 90
+    return angle, weight.mean(axis=(1, 2))
+
+
+@instrumentation.timed('preview.whisking')
+def estimate_whisking(filename: str, roi: Optional[Tuple[int, int, int, int]] = None, block: int = DEFAULT_BLOCK,
+                      min_motion: float = MIN_MOTION, sigma: float = SMOOTHING) -> pd.DataFrame:
+    """
+    Estimate the mean whisker angle in every frame of a video, without tracing whiskers.
+    :param filename: the video.
+    :param roi: the whisker pad, as a rectangle (x, y, width, height); None uses the whole frame, which works but is
+    noisier and slower.
+    :param block: the number of frames to process at once.
+    :param min_motion: see MIN_MOTION.
+    :param sigma: see SMOOTHING.
+    :return: a data frame in the `whiskers.timedata` schema.  `num_whiskers` is 0 and `stderr` is NaN, since no
+    whiskers are traced individually.
+    """
+    info(f'estimating whisking from {filename}')
+    frameids, angles, motion = [], [], []
+    with FrameSource(filename, grayscale=True, roi=roi, capacity=block + 1) as source:
+        previous, pending, ids = None, [], []
+        for frameid, frame in source:
+            pending.append(frame.copy())
+            ids.append(frameid)
+            if len(pending) == block:
+                previous = _flush(pending, ids, previous, sigma, frameids, angles, motion)
+        if pending:
+            _flush(pending, ids, previous, sigma, frameids, angles, motion)
+    angle = np.concatenate(angles) if angles else np.empty(0)
+    moving = np.concatenate(motion) >= min_motion if motion else np.empty(0, dtype=bool)
+    instrumentation.count('preview.frames', len(angle))
+    instrumentation.count('preview.still_frames', int(np.count_nonzero(~moving)))
+    return pd.DataFrame({'frameid': np.concatenate(frameids) if frameids else np.empty(0, dtype=np.int64),
+                         'mean_degrees': _fill_still(angle, moving),
+                         'num_whiskers': 0, 'stderr': np.nan})
+
+
+def _flush(pending: list, ids: list, previous: Optional[np.ndarray], sigma: float, frameids: list, angles: list,
+           motion: list) -> np.ndarray:
+    """ measure a block of frames, append the results, and empty the block.  Returns the block's last frame."""
+    block = np.stack(pending)
+    angle, change = pad_orientation(block, block[0] if previous is None else previous, sigma)
+    if previous is None:
+        change[0] = 0  # nothing to compare the very first frame to.
+    frameids.append(np.array(ids, dtype=np.int64))
+    angles.append(angle)
+    motion.append(change)
+    pending.clear()
+    ids.clear()
+    return block[-1]
+
+
+def _fill_still(angle: np.ndarray, moving: np.ndarray) -> np.ndarray:
+    """
+    Make an angle trace continuous: unwrap it (orientations repeat every 180 degrees), and hold the last measured
+    angle through frames without movement, so that it can be low-pass filtered.
+    """
+    out = np.full(len(angle), np.nan)
+    if not moving.any():
+        return np.zeros(len(angle))
+    # unwrapping doubled angles in radians works on numpy releases without `unwrap(period=)`.
+    out[moving] = np.degrees(np.unwrap(np.radians(angle[moving] * 2))) / 2
+    return pd.Series(out).ffill().bfill().to_numpy()
@@ -0,0 +1,162 @@
+"""
+Concurrent scheduling of the whisk toolchain across many videos.
+"""
+import asyncio
+import subprocess
+import sys
+import time
+from logging import info, error
+from multiprocessing import cpu_count
+from os import path
+from typing import Dict, List, Optional
+
+import pandas as pd
+
+from mousetracker.core import instrumentation
+from mousetracker.core.base import VideoFileData
+from mousetracker.core.cache import StageCache, evict
+from mousetracker.core.framepass import analyze_video
+from mousetracker.core.whiskers import (estimate_whisking_from_raw_whiskers, estimate_whisking_from_video,
+                                        whisk_stage_key, whisk_stages)
+
+# trace is CPU-bound; the python 2.7 extraction step is mostly I/O.
+DEFAULT_STAGE_LIMITS = {'trace': cpu_count(),
+                        'measure': cpu_count(),
+                        'classify': cpu_count(),
+                        'reclassify': cpu_count(),
+                        'extract': 2,
+                        'preview': cpu_count(),
+                        'framepass': cpu_count()}
+
+
+def run_batch(videos: List[VideoFileData], config, keep_files: bool = True, workers: Optional[int] = None,
+              stage_limits: Optional[Dict[str, int]] = None, preview: bool = False,
+              frame_pass: bool = False) -> pd.DataFrame:
+    """
+    Run the whisk toolchain (trace, measure, classify, reclassify, then whisker extraction) on many videos at once.
+    Each video's stages run in order, but stages of different videos run concurrently.  A failure stops only the
+    video it happened in.
+    :param videos: the videos to process.
+    :param config:
+    :param keep_files: if False, re-run every stage even if its outputs are up to date.
+    :param workers: the most stages to run at once, across all videos (default: the number of CPUs).
+    :param stage_limits: the most instances of each stage to run at once; see DEFAULT_STAGE_LIMITS.
+    :param preview: skip the toolchain, and estimate whisking straight from each video instead (see
+    `whiskers.estimate_whisking_from_video`).  Much faster, for screening recordings.
+    :param frame_pass: before anything else, measure whisker-pad motion energy and brightness in each video and add
+    them to its eye data, so that they are carried into the summary file (see `framepass.analyze_video`).  Each video
+    is analyzed in-process, since the batch already runs videos concurrently.
+    :return: a per-video status report, with columns video, side, status, stage, error, elapsed, cache_hits and
+    cache_misses.  `stage` is the stage that failed, or the last stage run.
+
+    Afterwards, if `config.storage.intermediate_limit_gb` is set, the least recently used intermediate files in the
+    videos' directories are deleted until they fit within it (see `cache.evict`).
+    """
+    limits = dict(DEFAULT_STAGE_LIMITS, **(stage_limits or {}))
+    # subprocesses need the proactor loop on windows, which older pythons don't use by default.
+    loop = asyncio.ProactorEventLoop() if sys.platform == 'win32' else asyncio.new_event_loop()
+    try:
+        rows = loop.run_until_complete(_run_all(videos, config, keep_files, workers or cpu_count(), limits, preview,
+                                                frame_pass))
+    finally:
+        loop.close()
+    report = pd.DataFrame(rows, columns=['video', 'side', 'status', 'stage', 'error', 'elapsed', 'cache_hits',
+                                         'cache_misses'])
+    failed = report[report['status'] != 'ok']
+    info(f'whisk batch finished: {len(report) - len(failed)} of {len(report)} videos succeeded')
+    for _, row in failed.iterrows():
+        error(f"{row['video']} failed at {row['stage']}: {row['error']}")
+    limit = config.storage.intermediate_limit_gb
+    if limit is not None:
+        directories = sorted({path.dirname(path.abspath(v.name)) for v in videos})
+        freed = evict(directories, int(limit * 2 ** 30))
+        info(f'evicted {freed} bytes of intermediate whisk output')
+    return report
+
+
+async def _run_all(videos: List[VideoFileData], config, keep_files: bool, workers: int,
+                   limits: Dict[str, int], preview: bool = False, frame_pass: bool = False) -> List[Dict]:
+    slots = asyncio.Semaphore(workers)
+    stage_slots = {name: asyncio.Semaphore(limit) for name, limit in limits.items()}
+    run = _preview_video if preview else _run_video
+    return await asyncio.gather(*(run(v, config, keep_files, slots, stage_slots, frame_pass) for v in videos))
+
+
+async def _frame_pass(video: VideoFileData, config, recorder: instrumentation.Recorder, slots: asyncio.Semaphore,
+                      stage_slots: Dict[str, asyncio.Semaphore]) -> None:
+    """ add the frame pass's measures to a video's eye data.  Side videos are written inverted, for whisk."""
+    async with stage_slots['framepass'], slots:
+        await asyncio.get_running_loop().run_in_executor(None, _recorded, recorder, analyze_video, video, config,
+                                                         False, False, True)
+
+
+async def _preview_video(video: VideoFileData, config, keep_files: bool, slots: asyncio.Semaphore,
+                         stage_slots: Dict[str, asyncio.Semaphore], frame_pass: bool = False) -> Dict:
+    """ estimate whisking in one video without the toolchain, returning its status report row."""
+    tic = time.perf_counter()
+    cache = StageCache.for_video(video, enabled=keep_files)
+    recorder = instrumentation.recorder(video.labelname)
+    status = {'video': video.labelname, 'side': video.side.name, 'status': 'ok', 'stage': 'preview', 'error': None}
+    try:
+        if frame_pass:
+            status['stage'] = 'framepass'
+            await _frame_pass(video, config, recorder, slots, stage_slots)
+            status['stage'] = 'preview'
+        async with stage_slots['preview'], slots:
+            await asyncio.get_running_loop().run_in_executor(None, _recorded, recorder, estimate_whisking_from_video,
+                                                             video, config, keep_files, cache)
+    except Exception as e:
+        status.update(status='failed', error=str(e))
+    status.update(elapsed=time.perf_counter() - tic, cache_hits=cache.hits, cache_misses=cache.misses)
+    cache.report(video.labelname)
+    instrumentation.save_report(video)
+    return status
+
+
+async def _run_video(video: VideoFileData, config, keep_files: bool, slots: asyncio.Semaphore,
+                     stage_slots: Dict[str, asyncio.Semaphore], frame_pass: bool = False) -> Dict:
+    """ run every stage for one video, returning its status report row."""
+    tic = time.perf_counter()
+    cache = StageCache.for_video(video, enabled=keep_files)
+    recorder = instrumentation.recorder(video.labelname)
+    status = {'video': video.labelname, 'side': video.side.name, 'status': 'ok', 'stage': None, 'error': None}
+    try:
+        if frame_pass:
+            status['stage'] = 'framepass'
+            await _frame_pass(video, config, recorder, slots, stage_slots)
+        stages = whisk_stages(video, config)
+        for i, stage in enumerate(stages):
+            status['stage'] = stage.name
+            key = whisk_stage_key(cache, video, stages, i)
+            if cache.lookup(stage.name, key, stage.outputs):
+                info(f'found up-to-date {stage.name} output for {video.labelname}')
+                continue
+            # take the stage slot first, so that waiting for a busy stage doesn't hold up a worker.
+            async with stage_slots[stage.name], slots:
+                info(f'running {stage.name} for {video.labelname}')
+                with recorder.timer(f'whisk.{stage.name}'):
+                    proc = await asyncio.create_subprocess_exec(*stage.argv, stdout=subprocess.PIPE,
+                                                                stderr=subprocess.PIPE)
+                    _, stderr = await proc.communicate()
+            if proc.returncode != 0:
+                raise IOError(f"{stage.name} failed on {video.labelname}: {repr(stderr)}")
+            cache.record(stage.name, key, stage.outputs)
+        if not path.isfile(video.whiskname) or not path.isfile(video.measname):
+            raise IOError(f"whisker or measurement file was not saved for {video.name}")
+        status['stage'] = 'extract'
+        async with stage_slots['extract'], slots:
+            await asyncio.get_running_loop().run_in_executor(None, _recorded, recorder,
+                                                             estimate_whisking_from_raw_whiskers, video, config,
+                                                             keep_files, cache)
+    except Exception as e:
+        status.update(status='failed', error=str(e))
+    status.update(elapsed=time.perf_counter() - tic, cache_hits=cache.hits, cache_misses=cache.misses)
+    cache.report(video.labelname)
+    instrumentation.save_report(video)
+    return status
+
+
+def _recorded(recorder: instrumentation.Recorder, func, *args):
+    """ call a function with `recorder` active, for use in executor threads."""
+    with instrumentation.recording(recorder):
+        return func(*args)
@@ -1 +1,8 @@
-from . import signal_processing
+import importlib
+
+
+def __getattr__(name: str):
+    # submodules are imported on first use; signal_processing and spectral need scipy.
+    if name in ('detect_peaks', 'signal_processing', 'spectral', 'whisk_io'):
+        return importlib.import_module(f'{__name__}.{name}')
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
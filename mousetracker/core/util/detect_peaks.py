@@ -1,6 +1,7 @@
 """Detect peaks in data based on their amplitude and other features."""
 
 from __future__ import division, print_function
+from bisect import bisect_left, insort
 import numpy as np
 
 __author__ = "Marcos Duarte, https://github.com/demotu/BMC"
@@ -108,7 +109,7 @@ def detect_peaks(x, mph=None, mpd=1, threshold=0, edge='rising',
     # handle NaN's
     if ind.size and indnan.size:
         # NaN's and values close to NaN's cannot be peaks
-        ind = ind[np.in1d(ind, np.unique(np.hstack((indnan, indnan - 1, indnan + 1))), invert=True)]
+        ind = ind[np.isin(ind, np.unique(np.hstack((indnan, indnan - 1, indnan + 1))), invert=True)]
     # first and last values of x cannot be peaks
     if ind.size and ind[0] == 0:
         ind = ind[1:]
@@ -123,16 +124,7 @@ def detect_peaks(x, mph=None, mpd=1, threshold=0, edge='rising',
         ind = np.delete(ind, np.where(dx < threshold)[0])
     # detect small peaks closer than minimum peak distance
     if ind.size and mpd > 1:
-        ind = ind[np.argsort(x[ind])][::-1]  # sort ind by peak height
-        idel = np.zeros(ind.size, dtype=bool)
-        for i in range(ind.size):
-            if not idel[i]:
-                # keep peaks with the same height if kpsh is True
-                idel = idel | (ind >= ind[i] - mpd) & (ind <= ind[i] + mpd) \
-                              & (x[ind[i]] > x[ind] if kpsh else True)
-                idel[i] = 0  # Keep current peak
-        # remove the small peaks and sort back the indexes by their occurrence
-        ind = np.sort(ind[~idel])
+        ind = _suppress_close_peaks(x, ind, mpd, kpsh)
 
     if show:
         if indnan.size:
@@ -144,6 +136,38 @@ def detect_peaks(x, mph=None, mpd=1, threshold=0, edge='rising',
     return ind
 
 
+def _suppress_close_peaks(x, ind, mpd, kpsh):
+    """Remove peaks closer than `mpd` to a higher peak; see detect_peaks.
+
+    Peaks are visited from highest to lowest and a peak survives unless an
+    already-kept peak lies within `mpd` of it.  Kept positions are held in a
+    sorted list, so each visit is a binary search rather than a pass over
+    every candidate: O(k log k) instead of O(k**2) for k candidates.
+    """
+    order = ind[np.argsort(x[ind])][::-1]  # sort ind by peak height
+    heights = x[order].tolist()
+    keep = np.zeros(order.size, dtype=bool)
+    kept = []
+    # with kpsh, a peak only suppresses strictly lower ones, so peaks of equal
+    # height are held back and only start suppressing once the height drops.
+    pending = []
+    for i, pos in enumerate(order.tolist()):
+        if pending and heights[i] != heights[i - 1]:
+            for p in pending:
+                insort(kept, p)
+            pending = []
+        j = bisect_left(kept, pos - mpd)
+        if j < len(kept) and kept[j] <= pos + mpd:
+            continue
+        keep[i] = True
+        if kpsh:
+            pending.append(pos)
+        else:
+            insort(kept, pos)
+    # remove the small peaks and sort back the indexes by their occurrence
+    return np.sort(order[keep])
+
+
 def _plot(x, mph, mpd, threshold, edge, valley, ax, ind):
     """Plot results of the detect_peaks function, see its help."""
     try:
@@ -1,20 +1,229 @@
-from scipy.signal import butter, filtfilt, welch
-from scipy.fftpack import fft
+from functools import lru_cache
+
+from scipy.signal import butter, get_window, sosfilt, sosfilt_zi, sosfiltfilt, welch
+from scipy.fft import next_fast_len, rfft, rfftfreq
 import numpy as np
-import matplotlib.pyplot as plt
+
+# the default number of samples to filter at once in chunked mode.
+DEFAULT_CHUNK_SIZE = 1 << 20
+# about the most samples `lowpass_ragged` filters in one call.
+RAGGED_BLOCK = 1 << 16
+
+
+@lru_cache(maxsize=32)
+def butter_lowpass_sos(order: int, cutoff: float, fs: float) -> np.ndarray:
+    """
+    Design a lowpass butterworth filter as second-order sections.  Designs are cached, so repeated calls with the same
+    parameters are free.
+    :param order: filter order.
+    :param cutoff: the highest frequency to preserve, in hz.
+    :param fs: data sampling frequency, in hz.
+    :return: an (n_sections, 6) array of section coefficients.  It is shared between callers; don't modify it.
+    """
+    return butter(order, cutoff / (fs / 2), 'low', output='sos')
+
+
+@lru_cache(maxsize=32)
+def settling_length(order: int, cutoff: float, fs: float, tol: float = 1e-10) -> int:
+    """
+    The number of samples after which the impulse response of `butter_lowpass_sos(order, cutoff, fs)` has decayed to
+    `tol` of its peak.  Chunks filtered with at least this much overlap on each side match the unchunked result.
+    :param order:
+    :param cutoff:
+    :param fs:
+    :param tol: relative amplitude below which the response counts as settled.
+    :return: a length in samples.
+    """
+    sos = butter_lowpass_sos(order, cutoff, fs)
+    n = 256
+    while True:
+        impulse = np.zeros(n)
+        impulse[0] = 1
+        response = np.abs(sosfilt(sos, impulse))
+        above = np.flatnonzero(response > tol * response.max())
+        # settled if the response stays below tolerance for the whole second half.
+        if above[-1] < n // 2:
+            return int(above[-1]) + 1
+        n *= 2
 
 
-def lowpass(data, fs, cutoff=25, order=5):
+def lowpass(data, fs, cutoff=25, order=5, chunk_size=None, out=None):
     """
     A lowpass, zero-phase butterworth filter
     :param data: array-like; the data to be filtered.
     :param fs:  data sampling frequency, in hz
     :param cutoff: the highest frequency to preserve, in hz (default: 25)
     :param order: butterworth filter order (default: 5)
-    :return: 
+    :param chunk_size: if given, filter in chunks of this many samples (see `lowpass_chunked`).
+    :param out: an array (e.g. a writable memmap) to put the result in; only used in chunked mode.
+    :return: the filtered data.
+    """
+    if chunk_size is not None and len(data) > chunk_size:
+        return lowpass_chunked(data, fs, cutoff, order, chunk_size, out)
+    return sosfiltfilt(butter_lowpass_sos(order, cutoff, fs), data)
+
+
+def lowpass_chunked(data, fs, cutoff=25, order=5, chunk_size=DEFAULT_CHUNK_SIZE, out=None):
+    """
+    Zero-phase lowpass filtering of an arbitrarily long 1-D signal, such as a memmap, with bounded memory.  The signal
+    is processed in blocks of `chunk_size` samples; each block is filtered together with `settling_length` samples of
+    its neighbours on either side, and only the block itself is kept (overlap-save).  Because the filter's response
+    has decayed below 1e-10 of its peak over that overlap, the result agrees with `lowpass` to within about 1e-9 of
+    the signal's peak amplitude.
+    :param data: a 1-D array-like that supports slicing.  Only one block (plus overlap) is read into memory at a time.
+    :param fs: data sampling frequency, in hz
+    :param cutoff: the highest frequency to preserve, in hz (default: 25)
+    :param order: butterworth filter order (default: 5)
+    :param chunk_size: the number of output samples to compute per block.
+    :param out: an array (e.g. a writable memmap) to put the result in.  A new in-memory array is made if not given.
+    :return: `out`.
+    """
+    sos = butter_lowpass_sos(order, cutoff, fs)
+    overlap = settling_length(order, cutoff, fs)
+    n = len(data)
+    if out is None:
+        out = np.empty(n, dtype=np.float64)
+    for start in range(0, n, chunk_size):
+        stop = min(start + chunk_size, n)
+        lo, hi = max(start - overlap, 0), min(stop + overlap, n)
+        block = sosfiltfilt(sos, np.asarray(data[lo:hi], dtype=np.float64))
+        out[start:stop] = block[start - lo:stop - lo]
+    return out
+
+
+def pad_ragged(traces) -> tuple:
+    """
+    Stack 1-D traces of different lengths into one array.
+    :param traces: a sequence of 1-D array-likes.
+    :return: a (len(traces), longest) float64 array with each trace left-aligned and padded with NaN, and an int array
+    of the traces' lengths.
+    """
+    lengths = np.array([len(t) for t in traces], dtype=np.int64)
+    padded = np.full((len(traces), lengths.max(initial=0)), np.nan)
+    for row, trace in zip(padded, traces):
+        row[:len(trace)] = trace
+    return padded, lengths
+
+
+def _padlen(sos: np.ndarray) -> int:
+    """ the number of samples `sosfiltfilt` extends each end of a signal by, by default."""
+    ntaps = 2 * sos.shape[0] + 1 - min((sos[:, 2] == 0).sum(), (sos[:, 5] == 0).sum())
+    return 3 * int(ntaps)
+
+
+def _sosfiltfilt_rows(sos: np.ndarray, padded: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+    """
+    `sosfiltfilt` of each row's first `lengths` samples, for all rows at once.  Each row is odd-extended at its own
+    ends, so both passes can run over the common length: the filter is causal, so what follows a row's extension
+    never reaches it, and the backward pass runs over each row's filtered samples copied in reverse.
+    """
+    edge = _padlen(sos)
+    width = padded.shape[1] + 2 * edge
+    extended = np.empty((len(lengths), width))
+    for row, trace, length in zip(extended, padded, lengths):
+        first, last = trace[0], trace[length - 1]
+        row[:edge] = 2 * first - trace[edge:0:-1]
+        row[edge:edge + length] = trace[:length]
+        row[edge + length:length + 2 * edge] = 2 * last - trace[length - 2 - np.arange(edge)]
+        # hold the last value after the row's end.  (Zeros would work too, but the filter state decaying towards
+        # them becomes subnormal, which is very slow to compute with.)
+        row[length + 2 * edge:] = row[length + 2 * edge - 1]
+    zi = sosfilt_zi(sos)[:, None, :]
+    forward, _ = sosfilt(sos, extended, axis=1, zi=zi * extended[None, :, :1])
+    # reuse `extended` for the reversed rows.
+    for row, filtered, length in zip(extended, forward, lengths + 2 * edge):
+        row[:length] = filtered[length - 1::-1]
+        row[length:] = row[length - 1]
+    backward, _ = sosfilt(sos, extended, axis=1, zi=zi * extended[None, :, :1])
+    out = np.full(padded.shape, np.nan)
+    for row, filtered, length in zip(out, backward, lengths):
+        row[:length] = filtered[length + edge - 1:edge - 1:-1]
+    return out
+
+
+def lowpass_ragged(padded: np.ndarray, lengths: np.ndarray, fs, cutoff=25, order=5, chunk_size=None) -> np.ndarray:
+    """
+    Apply `lowpass` to every row of a ragged array (see `pad_ragged`), giving each row the result `lowpass` would give
+    it on its own, to rounding.  Short rows are filtered together, whatever their lengths: rows of similar length are
+    grouped into blocks of about RAGGED_BLOCK samples (which keeps the padding small and the working set in cache),
+    and each block is filtered in one call.  Rows longer than half a block gain nothing from that, and are filtered one
+    at a time.
+    :param padded: the NaN-padded traces.
+    :param lengths: the length of each row.
+    :param fs: data sampling frequency, in hz
+    :param cutoff: the highest frequency to preserve, in hz (default: 25)
+    :param order: butterworth filter order (default: 5)
+    :param chunk_size: rows longer than this are filtered in chunks, exactly as `lowpass` does.
+    :return: the filtered traces, padded with NaN like the input.
+    """
+    sos = butter_lowpass_sos(order, cutoff, fs)
+    lengths = np.asarray(lengths, dtype=np.int64)
+    out = np.full_like(padded, np.nan, dtype=np.float64)
+    edge = _padlen(sos)
+    # rows too short to filter go through `lowpass` too, which raises for them.
+    alone = (lengths <= edge) | (lengths > RAGGED_BLOCK // 2)
+    if chunk_size is not None:
+        alone |= lengths > chunk_size
+    for row in np.flatnonzero(alone & (lengths > 0)):
+        out[row, :lengths[row]] = lowpass(padded[row, :lengths[row]], fs, cutoff, order, chunk_size)
+    rows = np.flatnonzero(~alone)
+    rows = rows[np.argsort(lengths[rows], kind='stable')]
+    start = 0
+    while start < len(rows):
+        # the block's rows are padded to its longest, which is its last.
+        stop = start + 1
+        while stop < len(rows) and (stop - start + 1) * (lengths[rows[stop]] + 2 * edge) <= RAGGED_BLOCK:
+            stop += 1
+        block = rows[start:stop]
+        width = lengths[block[-1]]
+        out[block, :width] = _sosfiltfilt_rows(sos, padded[block, :width], lengths[block])
+        start = stop
+    return out
+
+
+def _welch_rows(padded: np.ndarray, lengths: np.ndarray, fs, nperseg: int) -> tuple:
+    """
+    `welch(row[:length], fs, nperseg=nperseg)` for rows at least `nperseg` long, for all rows at once.  Every row's
+    segments are transformed together, then averaged per row.
+    """
+    step = nperseg - nperseg // 2
+    nsegments = (lengths - nperseg) // step + 1
+    starts = np.concatenate([np.arange(n) * step for n in nsegments])
+    owners = np.repeat(np.arange(len(lengths)), nsegments)
+    segments = padded[owners[:, None], starts[:, None] + np.arange(nperseg)[None, :]]
+    segments -= segments.mean(axis=1, keepdims=True)
+    win = get_window('hann', nperseg)
+    pxx = np.abs(rfft(segments * win, axis=1)) ** 2 / (fs * (win * win).sum())
+    pxx[:, 1:-1 if nperseg % 2 == 0 else None] *= 2
+    pxx = np.add.reduceat(pxx, np.concatenate(([0], np.cumsum(nsegments)[:-1])), axis=0) / nsegments[:, None]
+    return rfftfreq(nperseg, 1 / fs), pxx
+
+
+def whisking_features(padded: np.ndarray, lengths: np.ndarray, fs, band=(1, 30), nperseg=1024) -> dict:
+    """
+    Summarize whisking in each row of a ragged array of (filtered) whisker angles.
+    :param padded: the NaN-padded traces (see `pad_ragged`).
+    :param lengths: the length of each row.
+    :param fs: data sampling frequency, in hz
+    :param band: the frequency range, in hz, to look for the dominant whisking frequency in.
+    :param nperseg: welch segment length (shortened for traces shorter than this).
+    :return: a dict of arrays with one element per row: set_point (the mean angle), amplitude (the spread between the
+    5th and 95th percentile angles) and dominant_frequency (the peak of the welch PSD within `band`; NaN if no
+    frequency resolved by the trace falls in the band).
     """
-    b, a = butter(order, cutoff / (fs / 2), 'low')
-    return filtfilt(b, a, data)
+    lengths = np.asarray(lengths, dtype=np.int64)
+    low, high = np.nanpercentile(padded, [5, 95], axis=1) if padded.size else (np.array([]), np.array([]))
+    dominant = np.full(len(lengths), np.nan)
+    # rows at least `nperseg` long share a segment length, so they are done together; shorter ones each use their own.
+    full = np.flatnonzero(lengths >= nperseg)
+    groups = [(full, nperseg)] if full.size else []
+    groups += [(np.flatnonzero(lengths == n), int(n)) for n in np.unique(lengths[(lengths >= 2) & (lengths < nperseg)])]
+    for rows, segment in groups:
+        f, pxx = _welch_rows(padded[rows], lengths[rows], fs, segment)
+        inband = (f >= band[0]) & (f <= band[1])
+        if inband.any():
+            dominant[rows] = f[inband][np.argmax(pxx[:, inband], axis=1)]
+    return {'set_point': np.nanmean(padded, axis=1), 'amplitude': high - low, 'dominant_frequency': dominant}
 
 
 def nearest_idx(arr, val):
@@ -24,18 +233,19 @@ def nearest_idx(arr, val):
 
 def fftspectrum(y, Fs):
     """
-    Plots a Single-Sided Amplitude Spectrum of y(t)
+    Compute the single-sided spectrum of y(t), for `plot_fft_around`.  The transform is a real FFT padded to a fast
+    length; see `spectral.amplitude_spectrum` for just the amplitudes in a band.
     """
     n = len(y)
-    T = 1.00 / Fs
-    x = np.linspace(0.0, n * T, n)
-    yf = fft(y)
-    xf = np.linspace(0.0, 1.0 / (2.0 * T), n // 2)
+    nfft = next_fast_len(n, real=True)
+    yf = rfft(y, nfft)
+    xf = rfftfreq(nfft, 1.0 / Fs)
     return xf, yf, n
 
 
 def plot_fft_around(xf, yf, n, start_freq=1, stop_freq=30):
     """ plot the single-sided amplitude spectrum of a fft around bounds"""
+    import matplotlib.pyplot as plt
     start = nearest_idx(xf, start_freq)
     stop = nearest_idx(xf, stop_freq)
     plt.plot(xf[start:stop], 2.0 / n * np.abs(yf[start:stop]))  # n//2]))
@@ -45,6 +255,7 @@ def plot_fft_around(xf, yf, n, start_freq=1, stop_freq=30):
 
 
 def plot_psd(y, fs, start_freq=0, stop_freq=30):
+    import matplotlib.pyplot as plt
     f, Pxx_den = welch(y, fs, nperseg=1024)
     plt.semilogy(f, Pxx_den)
     plt.xlim([start_freq, stop_freq])
@@ -0,0 +1,131 @@
+"""
+Spectral analysis of whisker traces: amplitude spectra, spectrograms and whisking band power.
+
+Everything here returns arrays rather than figures, so summary statistics can be computed without plotting.  Transforms
+are real FFTs padded to a fast length (see `scipy.fft.next_fast_len`), so traces with awkward (e.g. prime) lengths
+cost no more than their neighbours, and window functions are computed once per length and reused.
+"""
+from functools import lru_cache
+from typing import Sequence, Tuple
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy import signal
+from scipy.fft import next_fast_len, rfft, rfftfreq
+
+# the frequency range whisking is expected in, in hz.
+WHISKING_BAND = (1, 30)
+
+
+@lru_cache(maxsize=64)
+def get_window(name: str, n: int) -> np.ndarray:
+    """
+    A window function, computed once per (name, length).
+    :param name: any window name `scipy.signal.get_window` accepts.
+    :param n: the window length.
+    :return: the window.  It is shared between callers; don't modify it.
+    """
+    return signal.get_window(name, n)
+
+
+def _band_slice(freqs: np.ndarray, band: Tuple[float, float]) -> slice:
+    """ the slice of a sorted frequency axis that falls within a band."""
+    return slice(np.searchsorted(freqs, band[0], 'left'), np.searchsorted(freqs, band[1], 'right'))
+
+
+def amplitude_spectrum(y, fs, band: Tuple[float, float] = WHISKING_BAND) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    The single-sided amplitude spectrum of a signal, restricted to a frequency band.
+    :param y: the signal.
+    :param fs: sampling frequency, in hz.
+    :param band: the frequencies to return, in hz.
+    :return: frequencies and amplitudes within `band`.
+    """
+    y = np.asarray(y, dtype=np.float64)
+    nfft = next_fast_len(len(y), real=True)
+    freqs = rfftfreq(nfft, 1 / fs)
+    keep = _band_slice(freqs, band)
+    return freqs[keep], 2.0 / len(y) * np.abs(rfft(y, nfft)[keep])
+
+
+def spectrogram(y, fs, nperseg: int = 256, noverlap: int = None, window: str = 'hann',
+                band: Tuple[float, float] = WHISKING_BAND) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    The power spectral density of a signal over sliding windows.
+    :param y: the signal.
+    :param fs: sampling frequency, in hz.
+    :param nperseg: the window length, in samples.
+    :param noverlap: the overlap between windows, in samples (default: half a window).
+    :param window: the window function.
+    :param band: the frequencies to return, in hz.
+    :return: frequencies within `band`; the time of the centre of each window, in seconds; and a float32
+    (frequencies, times) array of PSD values, scaled as `scipy.signal.spectrogram` scales them.
+    """
+    y = np.asarray(y, dtype=np.float64)
+    noverlap = nperseg // 2 if noverlap is None else noverlap
+    step = nperseg - noverlap
+    segments = sliding_window_view(y, nperseg)[::step]
+    win = get_window(window, nperseg)
+    nfft = next_fast_len(nperseg, real=True)
+    freqs = rfftfreq(nfft, 1 / fs)
+    keep = _band_slice(freqs, band)
+    spectra = rfft((segments - segments.mean(axis=1, keepdims=True)) * win, nfft, axis=1)[:, keep]
+    psd = np.square(np.abs(spectra)) / (fs * np.sum(win ** 2))
+    # one-sided: double everything but DC and (for even nfft) nyquist.
+    psd[:, (freqs[keep] > 0) & (freqs[keep] < fs / 2)] *= 2
+    times = (np.arange(len(segments)) * step + nperseg / 2) / fs
+    return freqs[keep], times, psd.T.astype(np.float32)
+
+
+def band_power_per_second(y, fs, band: Tuple[float, float] = WHISKING_BAND, window: str = 'hann') -> np.ndarray:
+    """
+    The power of a signal within a band, in consecutive one-second windows.
+    :param y: the signal.
+    :param fs: sampling frequency, in hz.
+    :param band: the band, in hz.
+    :param window: the window function.
+    :return: one value per whole second of signal (a trailing partial second is dropped).
+    """
+    y = np.asarray(y, dtype=np.float64)
+    n = int(round(fs))
+    seconds = y[:len(y) // n * n].reshape(-1, n)
+    win = get_window(window, n)
+    nfft = next_fast_len(n, real=True)
+    freqs = rfftfreq(nfft, 1 / fs)
+    keep = _band_slice(freqs, band)
+    spectra = rfft((seconds - seconds.mean(axis=1, keepdims=True)) * win, nfft, axis=1)[:, keep]
+    psd = 2 * np.square(np.abs(spectra)) / (fs * np.sum(win ** 2))
+    return psd.sum(axis=1) * (fs / nfft)
+
+
+def band_power(traces: Sequence, fs, band: Tuple[float, float] = WHISKING_BAND, workers: int = 1) -> list:
+    """
+    `band_power_per_second` for many traces.
+    :param traces: the signals.
+    :param fs: sampling frequency, in hz.
+    :param band: the band, in hz.
+    :param workers: the number of processes to use.
+    :return: one array per trace.
+    """
+    if workers == 1:
+        return [band_power_per_second(y, fs, band) for y in traces]
+    from joblib import Parallel, delayed
+    return Parallel(n_jobs=workers)(delayed(band_power_per_second)(y, fs, band) for y in traces)
+
+
+def whisking_summary(y, fs, band: Tuple[float, float] = WHISKING_BAND) -> dict:
+    """
+    Scalar spectral statistics of a whisker trace, for summary tables.
+    :param y: the signal.
+    :param fs: sampling frequency, in hz.
+    :param band: the whisking band, in hz.
+    :return: a dict with peak_frequency and peak_amplitude (of the amplitude spectrum within `band`), and
+    mean_band_power and max_band_power (over `band_power_per_second`).
+    """
+    freqs, amplitude = amplitude_spectrum(y, fs, band)
+    power = band_power_per_second(y, fs, band)
+    peak = np.argmax(amplitude) if amplitude.size else None
+    return {'peak_frequency': freqs[peak] if peak is not None else np.nan,
+            'peak_amplitude': amplitude[peak] if peak is not None else np.nan,
+            'mean_band_power': power.mean() if power.size else np.nan,
+            'max_band_power': power.max() if power.size else np.nan}
@@ -0,0 +1,176 @@
+"""
+Native readers for the binary files written by the whisk toolchain, and per-frame whisker angle statistics computed
+from them.  These replace the python 2.7 `load_whiskers.py`/`load_measurements.py` round trip.
+
+Files are memory-mapped and decoded into NumPy structured arrays; all per-whisker and per-frame computations are
+vectorized.  Both formats are little-endian with 32-bit ints.
+
+`.whiskers` (whisk "whiskbin1"): a header string, then one variable-length record per traced segment:
+    int32 id, int32 time, int32 len, float32 x[len], float32 y[len], float32 thick[len], float32 scores[len]
+
+`.measurements` (whisk measurements v3): a header string, an int32 row count, then one record per segment:
+    int32 row, fid, wid, state, face_x, face_y, col_follicle_x, col_follicle_y, valid_velocity, n;
+    char face_axis (padded to 4 bytes); float64 data[n]; float64 velocity[n]
+`data` holds the features computed by `measure`, in MEASUREMENT_FEATURES order.
+
+These layouts follow whisk's sources, and tests/test_whisk_io.py round-trips files written to them.  The pipeline reads
+whisk output with these readers by default; `native=False` in `whiskers` goes through the python 2.7 loaders instead.
+"""
+import numpy as np
+import pandas as pd
+
+WHISKERS_HEADER = b"bwhiskbin1\0"
+MEASUREMENTS_HEADER = b"measV\0"
+MEASUREMENT_FEATURES = ('length', 'score', 'angle', 'curvature', 'follicle_x', 'follicle_y', 'tip_x', 'tip_y')
+
+WHISKER_DTYPE = np.dtype([('fid', np.int32), ('wid', np.int32), ('npoints', np.int32),
+                          ('x0', np.float32), ('y0', np.float32), ('x1', np.float32), ('y1', np.float32)])
+
+_MEASUREMENT_ROW_FIELDS = [(name, '<i4') for name in ('row', 'fid', 'wid', 'state', 'face_x', 'face_y',
+                                                      'col_follicle_x', 'col_follicle_y', 'valid_velocity', 'n')]
+
+
+def _map(filename: str, header: bytes) -> np.ndarray:
+    """ memory-map a file as bytes, checking its header."""
+    raw = np.memmap(filename, dtype=np.uint8, mode='r')
+    if bytes(raw[:len(header)]) != header:
+        raise IOError(f"{filename} is not a whisk file of the expected format")
+    return raw
+
+
+def read_whiskers(filename: str) -> np.ndarray:
+    """
+    Read the traced segments in a `.whiskers` file.
+    :param filename: the file to read.
+    :return: a structured array (see WHISKER_DTYPE) with one element per segment, holding its frame, id, number of
+    points and first and last points (NaN for segments without points).
+    :raises IOError: if the records don't fill the file exactly.
+    """
+    raw = _map(filename, WHISKERS_HEADER)
+    start = len(WHISKERS_HEADER)
+    if (raw.size - start) % 4:
+        raise IOError(f"{filename} does not hold whole whisker records")
+    # every field is 32 bits wide, so the records can be read as one array of words.
+    words = np.frombuffer(raw, dtype='<i4', offset=start)
+    heads = _record_starts(words, filename)
+    npoints = words[heads + 2].astype(np.int64)
+    floats = words.view('<f4')
+    first = np.where(npoints > 0, heads + 3, 0)
+    last = first + np.maximum(npoints - 1, 0)
+    out = np.empty(len(heads), dtype=WHISKER_DTYPE)
+    out['wid'], out['fid'], out['npoints'] = words[heads], words[heads + 1], npoints
+    out['x0'], out['x1'] = floats[first], floats[last]
+    out['y0'], out['y1'] = floats[first + npoints], floats[last + npoints]
+    for name in ('x0', 'y0', 'x1', 'y1'):
+        out[name][npoints == 0] = np.nan
+    return out
+
+
+def _record_starts(words: np.ndarray, filename: str) -> np.ndarray:
+    """
+    Find where each variable-length record of a `.whiskers` file starts, without walking the records one by one.
+
+    A record's length field says where the next record starts.  Every word that could head a record (its length field
+    fits in the rest of the file) is linked to the word its length points at, and the chain of links from the first
+    record is followed by pointer doubling: after k rounds, every record within 2^k links of the first is marked.  The
+    records are that chain; words inside a record that happen to look like heads are never reached from it.
+    :param words: the file's records, as 32-bit words.
+    :param filename: for error messages.
+    :return: the word offset of each record, in file order.
+    """
+    if words.size == 0:
+        return np.empty(0, dtype=np.int64)
+    if words.size < 3:
+        raise IOError(f"{filename} has a truncated or corrupt whisker record")
+    # a cheap first pass: a length field can't exceed the file.  Float fields rarely pass, since as integers their
+    # bit patterns are huge or negative; the few that do are dropped when their links are checked below.
+    candidates = np.flatnonzero(words.view('<u4')[2:] <= (words.size - 3) // 4)
+    following = candidates + 3 + 4 * words[candidates + 2].astype(np.int64)
+    fits = following <= words.size
+    candidates, following = candidates[fits], following[fits]
+    if not len(candidates) or candidates[0] != 0:
+        raise IOError(f"{filename} does not start with a whisker record")
+    # two extra nodes that link to themselves: the end of the file, and a dead end for links that lead nowhere.
+    end, dead = len(candidates), len(candidates) + 1
+    found = np.minimum(np.searchsorted(candidates, following), len(candidates) - 1)
+    links = np.where(following == words.size, end, np.where(candidates[found] == following, found, dead))
+    links = np.append(links, [end, dead])
+    reached = np.zeros(len(links), dtype=bool)
+    reached[0] = True
+    for _ in range(int(np.ceil(np.log2(len(links)))) + 1):
+        reached[links[reached]] = True
+        links = links[links]
+    if reached[dead] or not reached[end]:
+        raise IOError(f"{filename} has a truncated or corrupt whisker record")
+    return candidates[reached[:end]]
+
+
+def read_measurements(filename: str) -> np.ndarray:
+    """
+    Read a `.measurements` file.
+    :param filename: the file to read.
+    :return: a structured array with one element per segment: the integer row fields of the file (fid, wid, state,
+    ...) and one float64 field per MEASUREMENT_FEATURES entry.
+    """
+    raw = _map(filename, MEASUREMENTS_HEADER)
+    start = len(MEASUREMENTS_HEADER)
+    nrows = int(raw[start:start + 4].view('<i4')[0])
+    if nrows == 0:
+        return np.empty(0, dtype=_measurement_dtype(len(MEASUREMENT_FEATURES)))
+    nfeatures = int(raw[start + 4 + 36:start + 4 + 40].view('<i4')[0])
+    dtype = _measurement_dtype(nfeatures)
+    # every row has the same number of features, so the records can be decoded in one go.
+    return np.frombuffer(raw, dtype=dtype, count=nrows, offset=start + 4)
+
+
+def _measurement_dtype(nfeatures: int) -> np.dtype:
+    names = list(MEASUREMENT_FEATURES[:nfeatures]) + [f'feature_{i}' for i in range(len(MEASUREMENT_FEATURES),
+                                                                                        nfeatures)]
+    return np.dtype(_MEASUREMENT_ROW_FIELDS + [('face_axis', 'S1'), ('_pad', 'V3')] +
+                    [(name, '<f8') for name in names] + [(f'{name}_velocity', '<f8') for name in names])
+
+
+def frame_statistics(fid: np.ndarray, degrees: np.ndarray) -> pd.DataFrame:
+    """
+    Summarize whisker angles per frame.
+    :param fid: the frame each angle belongs to.
+    :param degrees: whisker angles, in degrees.
+    :return: a data frame with the `timedata` columns: frameid, mean_degrees, num_whiskers and stderr (the standard
+    error of the mean angle; NaN for frames with fewer than two whiskers).  Frames without whiskers are omitted.
+    """
+    frames, inverse = np.unique(fid, return_inverse=True)
+    count = np.bincount(inverse, minlength=frames.size)
+    total = np.bincount(inverse, weights=degrees, minlength=frames.size)
+    mean = total / count
+    sumsq = np.bincount(inverse, weights=np.square(degrees - mean[inverse]), minlength=frames.size)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        stderr = np.sqrt(sumsq / (count - 1)) / np.sqrt(count)
+    return pd.DataFrame({'frameid': frames, 'mean_degrees': mean, 'num_whiskers': count, 'stderr': stderr})
+
+
+def whiskers_timedata(filename: str) -> pd.DataFrame:
+    """
+    Per-frame whisker angles from a `.whiskers` file.  Each segment's angle is the orientation, in degrees from the
+    image x axis, of the line through its end points.
+    :param filename: the file to read.
+    :return: see `frame_statistics`.
+    """
+    segments = read_whiskers(filename)
+    segments = segments[segments['npoints'] > 1]
+    dx = segments['x1'].astype(float) - segments['x0']
+    dy = segments['y1'].astype(float) - segments['y0']
+    # image y runs downward; orientation is only defined modulo 180 degrees.
+    degrees = np.degrees(np.arctan(-dy / np.where(dx == 0, np.finfo(float).tiny, dx)))
+    return frame_statistics(segments['fid'], degrees)
+
+
+def measurements_timedata(filename: str) -> pd.DataFrame:
+    """
+    Per-frame whisker angles from a classified `.measurements` file.  Only segments identified as whiskers (wid >= 0)
+    are included.
+    :param filename: the file to read.
+    :return: see `frame_statistics`.
+    """
+    rows = read_measurements(filename)
+    rows = rows[rows['wid'] >= 0]
+    return frame_statistics(rows['fid'], rows['angle'])
@@ -0,0 +1,170 @@
+"""
+Streaming access to the frames of a video file.
+"""
+import sys
+import threading
+from queue import Queue, Empty, Full
+from typing import Iterator, Optional, Tuple
+
+import attr
+import cv2
+import numpy as np
+from attr.validators import instance_of, optional
+
+# how long blocked queue operations wait before re-checking for shutdown, in seconds.
+_POLL_INTERVAL = 0.1
+
+
+@attr.s
+class FrameSource(object):
+    """
+    Decode a video on a background thread into a bounded ring of reusable frame buffers, so that decoding overlaps
+    with whatever the consumer does with each frame.  The decoder blocks once `capacity` frames are waiting, so memory
+    use does not depend on the length of the video.
+
+    Iterating yields (frameid, frame) pairs.  Each frame is a view into the ring, and is only valid until the next
+    iteration; copy it if it must be kept longer.
+    :param filename: the video to read.
+    :param start: the first frame to read.
+    :param stop: one past the last frame to read, or None to read to the end of the video.
+    :param stride: deliver every `stride`-th frame.  Skipped frames are grabbed but not decoded.
+    :param capacity: the number of frame buffers in the ring.
+    :param grayscale: convert frames to single-channel greyscale as they are decoded.
+    :param roi: a rectangle (x, y, width, height) to crop frames to as they are decoded.  Any part of it outside the
+    frame is cut off; a rectangle entirely outside the frame is an error.
+    :param index: the video's `frameindex.FrameIndex`, to seek to `start` through.  Without one, the decoder seeks by
+    frame number, which is slower and may be inexact for some codecs.
+    """
+    filename = attr.ib(validator=instance_of(str))
+    start = attr.ib(default=0, validator=instance_of(int))
+    stop = attr.ib(default=None, validator=optional(instance_of(int)))
+    stride = attr.ib(default=1, validator=instance_of(int))
+    capacity = attr.ib(default=8, validator=instance_of(int))
+    grayscale = attr.ib(default=False, validator=instance_of(bool))
+    roi = attr.ib(default=None, convert=lambda r: None if r is None else tuple(int(x) for x in r))
+    index = attr.ib(default=None)
+
+    def __attrs_post_init__(self):
+        if self.stride < 1 or self.capacity < 1:
+            raise ValueError("stride and capacity must be positive")
+        self._cap = None
+        self._thread = None
+        self._closing = threading.Event()
+
+    def __enter__(self) -> 'FrameSource':
+        self.open()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def __iter__(self) -> Iterator[Tuple[int, np.ndarray]]:
+        if self._thread is None:
+            self.open()
+        try:
+            while True:
+                item = self._get(self._ready)
+                if item is None:
+                    return
+                if isinstance(item, BaseException):
+                    raise item
+                frameid, slot = item
+                yield frameid, self._buffers[slot]
+                self._free.put(slot)
+        finally:
+            self.close()
+
+    def open(self) -> None:
+        """ open the video and start decoding."""
+        self._cap = cv2.VideoCapture(self.filename)
+        if not self._cap.isOpened():
+            raise IOError(f"could not open {self.filename}")
+        nframes = int(self._cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        if nframes > 0:
+            self.stop = nframes if self.stop is None else min(self.stop, nframes)
+        elif self.stop is None:
+            # the container doesn't report a length; read until decoding fails.
+            self.stop = sys.maxsize
+        width = int(self._cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(self._cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        self._frame = np.empty((height, width, 3), dtype=np.uint8)
+        if self.roi is not None:
+            x, y, w, h = self.roi
+            x0, y0, x1, y1 = max(x, 0), max(y, 0), min(x + w, width), min(y + h, height)
+            if x1 <= x0 or y1 <= y0:
+                self.close()
+                raise ValueError(f"roi {self.roi} is outside the {width}x{height} frames of {self.filename}")
+            self._crop = (slice(y0, y1), slice(x0, x1))
+            width, height = x1 - x0, y1 - y0
+        self.width, self.height = width, height
+        shape = (height, width) if self.grayscale else (height, width, 3)
+        self._buffers = [np.empty(shape, dtype=np.uint8) for _ in range(self.capacity)]
+        self._free = Queue(maxsize=self.capacity)
+        for slot in range(self.capacity):
+            self._free.put(slot)
+        self._ready = Queue(maxsize=self.capacity + 1)
+        self._closing.clear()
+        self._thread = threading.Thread(target=self._decode, name=f"decode {self.filename}", daemon=True)
+        self._thread.start()
+
+    def close(self) -> None:
+        """ stop decoding and release the video."""
+        self._closing.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._cap is not None:
+            self._cap.release()
+            self._cap = None
+
+    def _decode(self) -> None:
+        """ decoder thread body: fill free buffers with frames until the range is exhausted or the source closes."""
+        try:
+            if self.start > 0 and self.index is not None:
+                self.index.seek(self._cap, self.start, position=0)
+            elif self.start > 0:
+                self._cap.set(cv2.CAP_PROP_POS_FRAMES, self.start)
+            for frameid in range(self.start, self.stop, self.stride):
+                if frameid > self.start and not all(self._cap.grab() for _ in range(self.stride - 1)):
+                    break
+                slot = self._get(self._free)
+                if slot is None or not self._read_into(self._buffers[slot]):
+                    break
+                if not self._put(self._ready, (frameid, slot)):
+                    return
+            self._put(self._ready, None)
+        except Exception as e:
+            self._put(self._ready, e)
+
+    def _read_into(self, buffer: np.ndarray) -> bool:
+        """ decode the next frame, converting it into `buffer`."""
+        converted = self.grayscale or self.roi is not None
+        ok, frame = self._cap.read(self._frame if converted else buffer)
+        if not ok:
+            return False
+        if self.roi is not None:
+            frame = frame[self._crop]
+        if self.grayscale:
+            cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=buffer)
+        elif frame is not buffer:
+            np.copyto(buffer, frame)
+        return True
+
+    def _get(self, queue: Queue) -> Optional[object]:
+        """ a blocking get that gives up (returning None) if the source is closed."""
+        while not self._closing.is_set():
+            try:
+                return queue.get(timeout=_POLL_INTERVAL)
+            except Empty:
+                pass
+        return None
+
+    def _put(self, queue: Queue, item) -> bool:
+        """ a blocking put that gives up (returning False) if the source is closed."""
+        while not self._closing.is_set():
+            try:
+                queue.put(item, timeout=_POLL_INTERVAL)
+                return True
+            except Full:
+                pass
+        return False
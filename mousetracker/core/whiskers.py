@@ -1,66 +1,208 @@
 import subprocess
 from collections import namedtuple
 from logging import info
+from typing import Dict, List, Tuple
 
 import pandas as pd
 import shutil
 from mousetracker.core.base import *
-from mousetracker.core.util.signal_processing import lowpass
+from mousetracker.core import checkpoint, instrumentation, preview
+from mousetracker.core.cache import StageCache, tool_version
+from mousetracker.core.util import whisk_io
+from mousetracker.core.util.signal_processing import (DEFAULT_CHUNK_SIZE, lowpass, lowpass_ragged, pad_ragged,
+                                                      whisking_features)
 from mousetracker.core.yaml_config import Config
 
 timedata = namedtuple("timedata", "frameid,mean_degrees,num_whiskers,stderr")
+WhiskStage = namedtuple("WhiskStage", "name,argv,outputs,args")
 
 
-def estimate_whisking_from_measurements(video: VideoFileData, config, keep_files):
+def estimate_whisking_from_measurements(video: VideoFileData, config, keep_files, cache: StageCache = None,
+                                        native: bool = True, use_checkpoint: bool = True) -> pd.DataFrame:
     """
     Extract statistics from the Measurements file
     :param video: 
     :param config: 
     :param keep_files: 
-    :return: 
+    :param cache: the video's stage cache (opened if not given).
+    :param native: read the file in-process rather than with the python 2.7 whisk API.  See `whisk_io`.
+    :param use_checkpoint: save the extracted data to `video.whiskraw`, and reuse it if it is up to date.
+    :return: the per-frame whisker angles (see `timedata`).
     """
-    checkpoint = video.whiskraw
-    if not (path.isfile(checkpoint) and keep_files):
-        call = [config.system.python27_path, config.system.load_measurements_path, '--input', video.whiskname, '-o',
-                checkpoint]
-        info(f'extracting whisker movement from {video.labelname}')
-        data = subprocess.run(call, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        if data.returncode == 0:
-            data = pd.read_csv(checkpoint)
-        else:
-            raise IOError(f"failed to extract from {video.labelname}: {repr(data.stderr)}")
-    else:
-        info(f"found existing whisker data for {video.labelname}")
-        data = pd.read_csv(checkpoint)
+    cache = cache or StageCache.for_video(video, enabled=keep_files)
+    data, key = _extract_timedata(video, config, cache, 'measurements', native, use_checkpoint)
+    return data
 
-def estimate_whisking_from_raw_whiskers(video: VideoFileData, config, keep_files):
+
+def estimate_whisking_from_raw_whiskers(video: VideoFileData, config, keep_files, cache: StageCache = None,
+                                        native: bool = True, use_checkpoint: bool = True):
     """
     Extract the bulk pad displacement per frame from a whiskers file.
     :param video:
     :param config:
     :param keep_files:
+    :param cache: the video's stage cache (opened if not given).
+    :param native: read the file in-process rather than with the python 2.7 whisk API.  See `whisk_io`.
+    :param use_checkpoint: save the extracted data to `video.whiskraw`, and reuse it if it is up to date.
     :return:
     """
-    checkpoint = video.whiskraw
-    if not (path.isfile(checkpoint) and keep_files):
-        call = [config.system.python27_path, config.system.load_whiskers_path, '--input', video.whiskname, '-o', checkpoint]
-        info(f'extracting whisker movement from {video.labelname}')
-        data = subprocess.run(call, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        if data.returncode == 0:
-            data = pd.read_csv(checkpoint)
-        else:
-            raise IOError(f"failed to extract from {video.labelname}: {repr(data.stderr)}")
-    else:
-        info(f"found existing whisker data for {video.labelname}")
-        data = pd.read_csv(checkpoint)
+    cache = cache or StageCache.for_video(video, enabled=keep_files)
+    data, key = _extract_timedata(video, config, cache, 'whiskers', native, use_checkpoint)
+    _summarize(video, config, cache, data, key)
+
+
+def estimate_whisking_from_video(video: VideoFileData, config, keep_files, cache: StageCache = None,
+                                 use_checkpoint: bool = True):
+    """
+    Estimate whisking straight from the video, without the whisk toolchain (see `preview.estimate_whisking`), within
+    the whisker pad given by `config.whisker_pad`.  The estimate is summarized exactly as traced whiskers are, so the
+    summary file has the same layout either way.
+    :param video:
+    :param config:
+    :param keep_files:
+    :param cache: the video's stage cache (opened if not given).
+    :param use_checkpoint: save the estimate to `video.whiskraw`, and reuse it if it is up to date.
+    :return:
+    """
+    cache = cache or StageCache.for_video(video, enabled=keep_files)
+    data, key = _extract_timedata(video, config, cache, 'preview', True, use_checkpoint)
+    _summarize(video, config, cache, data, key)
 
+
+def _summarize(video: VideoFileData, config, cache: StageCache, data: pd.DataFrame, key: str) -> None:
+    """
+    Filter extracted whisker data, and join it with the eye data into `video.summaryfile`.
+    :param video:
+    :param config:
+    :param cache:
+    :param data: the extracted data (see `timedata`).
+    :param key: the extraction's cache key.
+    """
+    fmt = config.storage.checkpoint_format
+    outputs = [checkpoint.checkpoint_path(video.whiskcheck, fmt), checkpoint.checkpoint_path(video.summaryfile, fmt)]
+    key = cache.key('summary', [key, cache.fingerprint(checkpoint.locate(video.eyecheck, fmt) or '')],
+                    {'framerate': config.camera.framerate, 'format': fmt, 'columns': list(video.eye.columns)})
+    if cache.lookup('summary', key, outputs):
+        info(f"found existing summary for {video.labelname}")
+        return
     side = filter_raw(data, config, video.labelname)
     # rename columns to match side of face.
     side.columns = (side.columns[0], *[video.side.name+'_'+x for x in side.columns[1:]])
-    side.to_csv(video.whiskcheck)
+    checkpoint.save(side, video.whiskcheck, fmt)
     side = side.set_index('frameid')
     joined = side.join(video.eye)
-    joined.to_csv(video.summaryfile)
+    checkpoint.save(joined, video.summaryfile, fmt)
+    cache.record('summary', key, outputs)
+
+
+def _extract_timedata(video: VideoFileData, config, cache: StageCache, source: str, native: bool,
+                      use_checkpoint: bool) -> Tuple[pd.DataFrame, str]:
+    """
+    Compute per-frame whisker angles (see `timedata`) from the whisk output files, or estimate them from the video.
+    :param video:
+    :param config:
+    :param cache:
+    :param source: 'whiskers' or 'measurements', the file to extract from; or 'preview', to estimate from the video.
+    :param native: read the file in-process rather than with the python 2.7 whisk API.  Ignored for 'preview'.
+    :param use_checkpoint: save the extracted data to `video.whiskraw`, and reuse it if it is up to date.
+    :return: the extracted data, and the extraction's cache key.
+    """
+    fmt = config.storage.checkpoint_format
+    args = {'source': source, 'native': native, 'format': fmt}
+    if source == 'preview':
+        tool = 'preview'
+        filename = video.name
+        roi = getattr(config.whisker_pad, video.side.name)
+        args.update(native=True, roi=roi)
+    elif native:
+        tool = 'native'
+        filename = video.whiskname if source == 'whiskers' else video.measname
+    else:
+        loader = config.system.load_whiskers_path if source == 'whiskers' else config.system.load_measurements_path
+        tool = tool_version(config.system.python27_path) + tool_version(loader)
+        filename = video.whiskname if source == 'whiskers' else video.measname
+    target = checkpoint.checkpoint_path(video.whiskraw, fmt)
+    key = cache.key('extract', [cache.fingerprint(filename)], args, tool)
+    if use_checkpoint and cache.lookup('extract', key, [target]):
+        info(f"found existing whisker data for {video.labelname}")
+        return checkpoint.load(video.whiskraw, fmt=fmt), key
+    info(f'extracting whisker movement from {video.labelname}')
+    with instrumentation.timer('whisk.extract'):
+        if source == 'preview':
+            data = preview.estimate_whisking(filename, roi)
+        elif native:
+            reader = whisk_io.whiskers_timedata if source == 'whiskers' else whisk_io.measurements_timedata
+            data = reader(filename)
+        else:
+            # the python 2.7 loaders always write CSV.
+            call = [config.system.python27_path, loader, '--input', filename, '-o', video.whiskraw]
+            result = subprocess.run(call, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            if result.returncode != 0:
+                raise IOError(f"failed to extract from {video.labelname}: {repr(result.stderr)}")
+            data = pd.read_csv(video.whiskraw)
+    if use_checkpoint:
+        checkpoint.save(data, video.whiskraw, fmt)
+        cache.record('extract', key, [target])
+    return data, key
+
+
+def whisk_stages(video: VideoFileData, config) -> List[WhiskStage]:
+    """
+    The whisk toolchain commands that trace, measure and classify the whiskers in a video.  Each stage writes its own
+    file and reads its predecessor's, so re-running one stage (e.g. after a parameter change) starts from its
+    predecessor's output rather than from a file a later stage has already rewritten.
+    :param video:
+    :param config:
+    :return: the stages, in the order they must run.
+    """
+    side = video.side.name
+    return [WhiskStage(name='trace', argv=[shutil.which('trace'), video.name, video.whiskname],
+                       outputs=[video.whiskname], args={}),
+            WhiskStage(name='measure',
+                       argv=[shutil.which('measure'), '--face', side, video.whiskname, video.measured],
+                       outputs=[video.measured], args={'face': side}),
+            WhiskStage(name='classify',
+                       argv=[shutil.which('classify'), video.measured, video.classified, side,
+                             '--px2mm', str(config.camera.px2mm), '-n', str(config.animal.num_whiskers)],
+                       outputs=[video.classified],
+                       args={'face': side, 'px2mm': config.camera.px2mm, 'num_whiskers': config.animal.num_whiskers}),
+            WhiskStage(name='reclassify',
+                       argv=[shutil.which('reclassify.exe'), video.classified, video.measname, '-n', '-1'],
+                       outputs=[video.measname], args={'n': -1})]
+
+
+def whisk_stage_key(cache: StageCache, video: VideoFileData, stages: List[WhiskStage], i: int) -> str:
+    """
+    The cache key for running `stages[i]`.  The first stage depends on the video itself, and each later stage on the
+    signature of the stage before it, so re-running a stage also re-runs everything after it.
+    :param cache:
+    :param video:
+    :param stages: the stages from `whisk_stages`.
+    :param i: the position of the stage to key.
+    :return: the key.
+    """
+    inputs = [cache.fingerprint(video.name)] if i == 0 else [cache.signature(stages[i - 1].name)]
+    return cache.key(stages[i].name, inputs, stages[i].args, tool_version(stages[i].argv[0]))
+
+
+def run_whisk_stage(cache: StageCache, stage: WhiskStage, key: str, label: str) -> subprocess.CompletedProcess:
+    """
+    Run one whisk toolchain stage, unless the cache says its outputs are already up to date.
+    :param cache:
+    :param stage:
+    :param key: the stage's cache key, from `whisk_stage_key`.
+    :param label: the name of the video, for logging.
+    :return: the completed process.  Cache hits return a fake successful run.
+    """
+    if cache.lookup(stage.name, key, stage.outputs):
+        info(f'found up-to-date {stage.name} output for {label}')
+        return subprocess.CompletedProcess(args=stage.argv, returncode=0)  # fake a completed run.
+    info(f'running {stage.name} for {label}')
+    with instrumentation.timer(f'whisk.{stage.name}'):
+        result = subprocess.run(stage.argv, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if result.returncode == 0:
+        cache.record(stage.name, key, stage.outputs)
+    return result
 
 
 def extract_whisk_data(video: VideoFileData, config, keep_files):
@@ -68,71 +210,26 @@ def extract_whisk_data(video: VideoFileData, config, keep_files):
     Run the whisk code toolchain on a video file.  generate a whiskers and measurements file.
     :param video:
     :param config:
-    :param keep_files:
+    :param keep_files: if False, re-run every stage even if its outputs are up to date.
     :return:
     """
-    trace_path = shutil.which('trace')
-    trace_args = [video.name, video.whiskname]
-    measure_path = shutil.which('measure')
-    measure_args = ['--face', video.side.name, video.whiskname, video.measname]
-    classify_path = shutil.which('classify')
-    classify_args = [video.measname, video.measname, video.side.name, '--px2mm', str(config.camera.px2mm),
-                     '-n', str(config.animal.num_whiskers)]
-    reclassify_path = shutil.which('reclassify.exe')
-    reclassify_args = [video.measname, video.measname, '-n', '-1']
-    if not (keep_files and path.exists(video.whiskname)):
-        info(f'tracing whiskers for {video.labelname}')
-        istraced = subprocess.run([trace_path, *trace_args], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    else:
-        info(f'found existing whiskers file for {video.labelname}')
-        istraced = subprocess.CompletedProcess(args=[], returncode=0)  # fake a completed run.
-    if istraced.returncode == 0:
-        info(f"trace OK for {video.labelname}")
-        if not (keep_files and path.exists(video.measname)):
-            info(f'measuring whiskers for {video.labelname}')
-            ismeasured = subprocess.run([measure_path, *measure_args], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        else:
-            info(f'found existing measurements file for {video.labelname}')
-            ismeasured = subprocess.CompletedProcess(args=[], returncode=0)  # fake a completed run.
-
-        if ismeasured.returncode == 0:
-            info(f"measure OK for {video.labelname}")
-            if not (keep_files and path.exists(video.measname)):
-                info(f'classifying whiskers for {video.labelname}')
-                isclassified = subprocess.run([classify_path, *classify_args], stdout=subprocess.PIPE,
-                                              stderr=subprocess.PIPE)
-            else:
-                info(f'found existing measurements file for {video.labelname}')
-                isclassified = subprocess.CompletedProcess(args=[], returncode=0)  # fake a completed run.
-
-            if isclassified.returncode == 0:
-                info(f"classification OK for {video.labelname}")
-                if not (keep_files and path.exists(video.measname)):
-                    info(f'reclassifying whiskers for {video.labelname}')
-                    isreclassified = subprocess.run([reclassify_path, *reclassify_args], stdout=subprocess.PIPE,
-                                                    stderr=subprocess.PIPE)
-                else:
-                    info(f'found existing measurements file for {video.labelname}')
-                    isreclassified = subprocess.CompletedProcess(args=[], returncode=0)  # fake a completed run.
-
-                if isreclassified.returncode == 0:
-                    info(f"reclassification OK for {video.labelname}")
-                    info(f"whiskers complete for {video.labelname}")
-                    if not path.isfile(video.whiskname) or not path.isfile(video.measname):
-                        raise IOError(f"whisker or measurement file was not saved for {video.name}")
-                    if not (path.isfile(video.summaryfile) and keep_files):
-                        estimate_whisking_from_raw_whiskers(video, config, keep_files)
-                        # return video
-                else:
-                    raise IOError(f"reclassifier failed on {video.labelname}")
-            else:
-                raise IOError(f"classifier failed on {video.labelname}")
-        else:
-            raise IOError(f"measurement failed on {video.labelname}")
-    else:
-        raise IOError(f"trace failed on {video.labelname}")
+    cache = StageCache.for_video(video, enabled=keep_files)
+    stages = whisk_stages(video, config)
+    with instrumentation.recording(instrumentation.recorder(video.labelname)):
+        for i, stage in enumerate(stages):
+            result = run_whisk_stage(cache, stage, whisk_stage_key(cache, video, stages, i), video.labelname)
+            if result.returncode != 0:
+                raise IOError(f"{stage.name} failed on {video.labelname}: {repr(result.stderr)}")
+            info(f"{stage.name} OK for {video.labelname}")
+        info(f"whiskers complete for {video.labelname}")
+        if not path.isfile(video.whiskname) or not path.isfile(video.measname):
+            raise IOError(f"whisker or measurement file was not saved for {video.name}")
+        estimate_whisking_from_raw_whiskers(video, config, keep_files, cache=cache)
+    cache.report(video.labelname)
+    instrumentation.save_report(video)
 
 
+@instrumentation.timed('whiskers.filter_raw')
 def filter_raw(whiskdat: pd.DataFrame, params: Config, name: str) -> pd.DataFrame:
     """
     Apply a low-pass filter to whisker displacement measurements
@@ -142,7 +239,31 @@ def filter_raw(whiskdat: pd.DataFrame, params: Config, name: str) -> pd.DataFram
     :return: 
     """
     fs = params.camera.framerate
-    whiskdat = whiskdat.assign(mean_degrees_filtered=lowpass(data=whiskdat['mean_degrees'], fs=fs))
+    filtered = lowpass(data=whiskdat['mean_degrees'].to_numpy(), fs=fs, chunk_size=DEFAULT_CHUNK_SIZE)
+    whiskdat = whiskdat.assign(mean_degrees_filtered=filtered)
     whiskdat = whiskdat.assign(time=whiskdat['frameid'] / fs)
     whiskdat.name = name
     return whiskdat
+
+
+def filter_raw_batch(traces: Dict[Tuple[str, str], pd.DataFrame],
+                     params: Config) -> Tuple[Dict[Tuple[str, str], pd.DataFrame], pd.DataFrame]:
+    """
+    Apply `filter_raw` to many whisker traces at once, and summarize whisking in each.
+    :param traces: raw whisker data (see `timedata`), keyed by (video, side).
+    :param params:
+    :return: the filtered data, keyed as the input and equal to what `filter_raw` gives; and a data frame with one row
+    per trace and columns video, side, nframes, set_point, amplitude and dominant_frequency (see `whisking_features`).
+    """
+    fs = params.camera.framerate
+    keys = list(traces)
+    padded, lengths = pad_ragged([traces[k]['mean_degrees'].to_numpy() for k in keys])
+    filtered = lowpass_ragged(padded, lengths, fs, chunk_size=DEFAULT_CHUNK_SIZE)
+    out = {}
+    for key, row, length in zip(keys, filtered, lengths):
+        whiskdat = traces[key].assign(mean_degrees_filtered=row[:length], time=traces[key]['frameid'] / fs)
+        whiskdat.name = key[0]
+        out[key] = whiskdat
+    features = pd.DataFrame({'video': [k[0] for k in keys], 'side': [k[1] for k in keys], 'nframes': lengths,
+                             **whisking_features(filtered, lengths, fs)})
+    return out, features
@@ -3,7 +3,7 @@ from os import path
 
 import attr
 import yaml
-from attr.validators import instance_of
+from attr.validators import instance_of, in_, optional
 from attrs_utils import ensure_cls, ensure_enum, is_path_of_file
 from mousetracker.core.base import modulePath
 
@@ -52,6 +52,25 @@ class Storage(object):
     root_label = attr.ib(validator=instance_of(str))
     output_root = attr.ib(validator=instance_of(str))
     name_format = attr.ib(validator=instance_of(str))
+    # parquet, feather, npy or csv; None picks the best format available (see checkpoint.default_format).
+    checkpoint_format = attr.ib(default=None, validator=optional(in_(('parquet', 'feather', 'npy', 'csv'))))
+    # the space, in GB, that intermediate whisk outputs may take up in the videos' directories after a batch; the least
+    # recently used are deleted beyond it (see cache.evict).  None keeps them all.
+    intermediate_limit_gb = attr.ib(default=None, validator=optional(instance_of((int, float))))
+
+
+def _rectangle(value):
+    return None if value is None else tuple(int(x) for x in value)
+
+
+@attr.s(frozen=True)
+class WhiskerPad(object):
+    """
+    Where the whisker pad is in each side's video, as a rectangle [x, y, width, height], for the fast whisking preview.
+    A side left unset uses the whole frame.
+    """
+    left = attr.ib(default=None, convert=_rectangle)
+    right = attr.ib(default=None, convert=_rectangle)
 
 
 @attr.s(frozen=True)
@@ -63,6 +82,7 @@ class Config:
     animal = attr.ib(convert=ensure_cls(Animal))
     system = attr.ib(convert=ensure_cls(System))
     storage = attr.ib(convert=ensure_cls(Storage))
+    whisker_pad = attr.ib(default=attr.Factory(WhiskerPad), convert=ensure_cls(WhiskerPad))
 
 
 def load(customconfig: str) -> Config:
@@ -0,0 +1,100 @@
+import re
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from mousetracker.benchmarks import eye_area_trace, whisker_angle_trace
+from mousetracker.core import analysis, checkpoint
+from mousetracker.core.base import RecordingSessionData, SideOfFace, VideoFileData
+
+FS = 240
+
+
+def _summary(side: str, nframes: int, frequency: float = 8.0) -> pd.DataFrame:
+    """a side's summary: whisking at `frequency`, and blinks every 2 s in both eye area columns."""
+    frameid = np.arange(nframes)
+    area = eye_area_trace(nframes)
+    return pd.DataFrame({f'{side}_time': frameid / FS,
+                         f'{side}_mean_degrees_filtered': whisker_angle_trace(nframes, whisk_frequency=frequency),
+                         f'{side}_fitted_area': area, f'{side}_contour_area': area * 0.98},
+                        index=pd.Index(frameid, name='frameid'))
+
+
+@pytest.fixture
+def results(tmp_path):
+    """a bout with a summary file per side: left whisks at 8 Hz and right at 11 Hz."""
+    videos = []
+    for side, frequency in ((SideOfFace.right, 11.0), (SideOfFace.left, 8.0)):
+        video = VideoFileData(name=str(tmp_path / f'bout-{side.name}.avi'), side=side, eye=None, nframes=FS * 20)
+        checkpoint.save(_summary(side.name, video.nframes, frequency), video.summaryfile)
+        videos.append(video)
+    return RecordingSessionData(videos=videos)
+
+
+def test_whisking_statistics_finds_each_sides_whisking_frequency(results):
+    stats = analysis.whisking_statistics(results, FS)
+    assert list(stats['side']) == ['left', 'right']
+    np.testing.assert_allclose(stats['peak_frequency'], [8.0, 11.0], atol=FS / (FS * 20))
+    assert (stats['mean_band_power'] > 0).all()
+
+
+def test_make_summary_plots_includes_band_power(results):
+    analysis.make_summary_plots(results, FS)
+    with open(results.summaryfigure, 'rb') as f:
+        pdf = f.read()
+    # whisking, eye area, whisking band power and blink pages.
+    assert len(re.findall(rb'/Type\s*/Page\b(?!s)', pdf)) == 4
+
+
+@pytest.mark.parametrize('n,max_points', [(10007, 100), (5000, 2560), (101, 4), (2561, 2560)])
+def test_minmax_decimate_keeps_each_buckets_extrema_and_the_endpoints(n, max_points):
+    rng = np.random.default_rng(n)
+    x, y = np.arange(n) / FS, rng.normal(size=n)
+    dx, dy = analysis.minmax_decimate(x, y, max_points)
+    assert len(dx) <= max_points
+    assert np.all(np.diff(dx) > 0)
+    assert (dx[0], dx[-1]) == (x[0], x[-1])
+    np.testing.assert_array_equal(dy, y[np.searchsorted(x, dx)])
+    nbins = (max_points - 2) // 2
+    size = -(-n // nbins)
+    for start in range(0, n, size):
+        bucket = y[start:start + size]
+        kept = dy[(dx >= x[start]) & (dx <= x[min(start + size, n) - 1])]
+        assert bucket.min() in kept and bucket.max() in kept
+
+
+def test_minmax_decimate_leaves_short_lines_alone():
+    x, y = np.arange(10), np.arange(10.0)
+    dx, dy = analysis.minmax_decimate(x, y, 10)
+    np.testing.assert_array_equal(dx, x)
+    np.testing.assert_array_equal(dy, y)
+
+
+def test_minmax_decimate_skips_nan_but_keeps_gaps():
+    y = np.arange(1000.0)
+    y[300:305] = np.nan
+    dx, dy = analysis.minmax_decimate(np.arange(1000), y, 50)
+    assert len(dx) <= 50
+    assert not np.isnan(dy).any()
+    # a whole bucket of NaN leaves a break in the line.
+    y[100:200] = np.nan
+    dx, dy = analysis.minmax_decimate(np.arange(1000), y, 50)
+    assert np.isnan(dy).any()
+    assert not np.isnan(dy[(dx < 100) | (dx >= 200)]).any()
+
+
+@pytest.mark.parametrize('fitted', ['nan', 'missing'])
+def test_prepare_side_falls_back_to_the_contour_area(tmp_path, fitted):
+    summary = _summary('left', FS * 20)
+    if fitted == 'nan':
+        summary['left_fitted_area'] = np.nan
+    else:
+        summary = summary.drop(columns='left_fitted_area')
+    name = str(tmp_path / 'bout-left-summary')
+    checkpoint.save(summary, name)
+    side = analysis._prepare_side(name, 'left', FS, max_points=500, blink_ms=1000)
+    # a blink every 2 s, in 20 s.
+    assert side['nblinks'] == 10
+    assert np.isfinite(side['area'][1]).all()
+    np.testing.assert_allclose(side['area'][1].max(), summary['left_contour_area'].max())
@@ -0,0 +1,77 @@
+import os
+import time
+from types import SimpleNamespace
+
+from mousetracker.core.base import SideOfFace, VideoFileData
+from mousetracker.core.cache import StageCache, evict
+from mousetracker.core.whiskers import whisk_stage_key, whisk_stages
+
+
+def _video(directory, name='bout-left.avi'):
+    video = VideoFileData(name=str(directory / name), side=SideOfFace.left, eye=None, nframes=0)
+    with open(video.name, 'wb') as f:
+        f.write(b'video')
+    return video
+
+
+def _config(px2mm=0.04):
+    return SimpleNamespace(camera=SimpleNamespace(px2mm=px2mm), animal=SimpleNamespace(num_whiskers=5))
+
+
+def _run(cache, stages, video):
+    """ 'run' every stage that misses, writing its outputs; returns the names of the stages run."""
+    ran = []
+    for i, stage in enumerate(stages):
+        key = whisk_stage_key(cache, video, stages, i)
+        if cache.lookup(stage.name, key, stage.outputs):
+            continue
+        for output in stage.outputs:
+            with open(output, 'w') as f:
+                f.write(f'{stage.name} {time.time()}')
+        cache.record(stage.name, key, stage.outputs)
+        ran.append(stage.name)
+    return ran
+
+
+def test_whisk_stages_write_separate_files(tmp_path):
+    stages = whisk_stages(_video(tmp_path), _config())
+    outputs = [o for s in stages for o in s.outputs]
+    assert len(set(outputs)) == len(outputs)
+    # each stage reads the file the stage before it wrote.
+    for before, after in zip(stages, stages[1:]):
+        assert before.outputs[0] in after.argv
+
+
+def test_changing_a_later_stage_reruns_it_and_what_follows(tmp_path):
+    video = _video(tmp_path)
+    cache = StageCache.for_video(video)
+    assert _run(cache, whisk_stages(video, _config()), video) == ['trace', 'measure', 'classify', 'reclassify']
+    assert _run(cache, whisk_stages(video, _config()), video) == []
+    with open(video.measured) as f:
+        measured = f.read()
+    assert _run(cache, whisk_stages(video, _config(px2mm=0.05)), video) == ['classify', 'reclassify']
+    # classify started over from measure's output, which is untouched.
+    with open(video.measured) as f:
+        assert f.read() == measured
+    assert _run(cache, whisk_stages(video, _config(px2mm=0.05)), video) == []
+
+
+def test_evict_shares_one_limit_across_directories(tmp_path):
+    videos = []
+    for name in ('a', 'b'):
+        (tmp_path / name).mkdir()
+        videos.append(_video(tmp_path / name))
+    for video in videos:
+        cache = StageCache.for_video(video)
+        _run(cache, whisk_stages(video, _config()), video)
+    intermediate = [o for v in videos for s in whisk_stages(v, _config()) for o in s.outputs]
+    sizes = sum(os.path.getsize(f) for f in intermediate)
+    freed = evict([str(tmp_path / 'a'), str(tmp_path / 'b'), str(tmp_path)], sizes // 2)
+    remaining = [f for f in intermediate if os.path.isfile(f)]
+    assert 0 < freed and sum(os.path.getsize(f) for f in remaining) <= sizes // 2
+    # stages from the first evicted one onwards re-run; those before it are still cached.
+    video = videos[0]
+    stages = whisk_stages(video, _config())
+    evicted = [i for i, s in enumerate(stages) if not os.path.isfile(s.outputs[0])]
+    expected = [s.name for s in stages[evicted[0]:]] if evicted else []
+    assert _run(StageCache.for_video(video), stages, video) == expected
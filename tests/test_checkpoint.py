@@ -0,0 +1,103 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from mousetracker.core import checkpoint
+
+
+def _have_pyarrow():
+    try:
+        import pyarrow
+        return True
+    except ImportError:
+        return False
+
+
+FORMATS = [pytest.param(f, marks=pytest.mark.skipif(f in checkpoint.ARROW_FORMATS and not _have_pyarrow(),
+                                                     reason='needs pyarrow'))
+           for f in checkpoint.FORMATS]
+
+
+def _data(n=50):
+    rng = np.random.RandomState(0)
+    return pd.DataFrame({'frameid': np.arange(n), 'left_fitted_area': rng.rand(n) * 1000,
+                         'left_interpolated': rng.rand(n) > 0.5})
+
+
+def _touch_later(filename, seconds=10):
+    stat = os.stat(filename)
+    os.utime(filename, ns=(stat.st_atime_ns, stat.st_mtime_ns + seconds * 10 ** 9))
+
+
+@pytest.mark.parametrize('fmt', FORMATS)
+def test_round_trip(tmp_path, fmt):
+    name = str(tmp_path / 'bout-left-summary.csv')
+    data = _data()
+    written = checkpoint.save(data, name, fmt)
+    assert written == checkpoint.checkpoint_path(name, fmt) and os.path.isfile(written)
+    pd.testing.assert_frame_equal(checkpoint.load(name, fmt=fmt), data)
+    pd.testing.assert_frame_equal(checkpoint.load(name, columns=['left_fitted_area'], fmt=fmt),
+                                  data[['left_fitted_area']])
+
+
+def test_round_trip_keeps_a_named_index(tmp_path):
+    name = str(tmp_path / 'bout-left-summary.csv')
+    data = _data().set_index('frameid')
+    checkpoint.save(data, name, 'npy')
+    pd.testing.assert_frame_equal(checkpoint.load(name, fmt='npy'), data.reset_index())
+
+
+def test_legacy_csv_is_migrated(tmp_path):
+    name = str(tmp_path / 'bout-left-summary.csv')
+    data = _data()
+    data.to_csv(name)  # with the unnamed index column, as the pipeline used to write them.
+    loaded = checkpoint.load(name, fmt='npy')
+    pd.testing.assert_frame_equal(loaded, data)
+    assert os.path.isfile(checkpoint.checkpoint_path(name, 'npy'))
+    pd.testing.assert_frame_equal(checkpoint.load(name, fmt='npy'), data)
+
+
+def test_pinned_csv_is_not_migrated(tmp_path):
+    name = str(tmp_path / 'bout-left-summary.csv')
+    checkpoint.save(_data(), name, 'csv')
+    pd.testing.assert_frame_equal(checkpoint.load(name, fmt='csv'), _data())
+    assert not any(os.path.isfile(checkpoint.checkpoint_path(name, f)) for f in checkpoint.FORMATS if f != 'csv')
+
+
+def test_the_pinned_format_is_read_even_if_another_is_newer(tmp_path):
+    name = str(tmp_path / 'bout-left-summary.csv')
+    old, new = _data(), _data() * 2
+    checkpoint.save(old, name, 'csv')
+    _touch_later(checkpoint.save(new, name, 'npy'))
+    pd.testing.assert_frame_equal(checkpoint.load(name, fmt='csv'), old)
+    assert checkpoint.locate(name, 'csv') == checkpoint.checkpoint_path(name, 'csv')
+
+
+def test_without_a_pinned_format_the_newest_file_is_read(tmp_path):
+    name = str(tmp_path / 'bout-left-summary.csv')
+    old, new = _data(), _data() * 2
+    checkpoint.save(old, name, 'npy')
+    _touch_later(checkpoint.save(new, name, 'csv'))
+    assert checkpoint.locate(name) == checkpoint.checkpoint_path(name, 'csv')
+    # a pinned format with no file of its own also falls back to the newest.
+    assert checkpoint.locate(name, 'feather') == checkpoint.checkpoint_path(name, 'csv')
+    # and, being CSV, is migrated over the older file.
+    pd.testing.assert_frame_equal(checkpoint.load(name), new)
+    pd.testing.assert_frame_equal(checkpoint.load(name, fmt=checkpoint.default_format()), new)
+
+
+def test_missing_checkpoint(tmp_path):
+    name = str(tmp_path / 'nothing.csv')
+    assert not checkpoint.exists(name) and checkpoint.locate(name) is None
+    with pytest.raises(FileNotFoundError):
+        checkpoint.load(name)
+
+
+@pytest.mark.skipif(_have_pyarrow(), reason='pyarrow is installed')
+@pytest.mark.parametrize('fmt', checkpoint.ARROW_FORMATS)
+def test_arrow_formats_need_pyarrow(tmp_path, fmt):
+    assert checkpoint.default_format() == 'npy'
+    with pytest.raises(ImportError):
+        checkpoint.save(_data(), str(tmp_path / 'bout-left-summary.csv'), fmt)
@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+from mousetracker.core.util.detect_peaks import _suppress_close_peaks, detect_peaks
+
+
+def _suppress_close_peaks_reference(x, ind, mpd, kpsh):
+    """The original O(k**2) minimum peak distance suppression from detect_peaks 1.0.4."""
+    ind = ind[np.argsort(x[ind])][::-1]  # sort ind by peak height
+    idel = np.zeros(ind.size, dtype=bool)
+    for i in range(ind.size):
+        if not idel[i]:
+            # keep peaks with the same height if kpsh is True
+            idel = idel | (ind >= ind[i] - mpd) & (ind <= ind[i] + mpd) \
+                          & (x[ind[i]] > x[ind] if kpsh else True)
+            idel[i] = 0  # Keep current peak
+    # remove the small peaks and sort back the indexes by their occurrence
+    return np.sort(ind[~idel])
+
+
+def _candidates(x):
+    """every local maximum, as detect_peaks finds them before applying mpd."""
+    return detect_peaks(x, mpd=1)
+
+
+@pytest.mark.parametrize('seed', range(20))
+@pytest.mark.parametrize('mpd', [2, 5, 17, 60])
+@pytest.mark.parametrize('kpsh', [False, True])
+@pytest.mark.parametrize('levels', [None, 4])
+def test_suppression_matches_reference(seed, mpd, kpsh, levels):
+    rng = np.random.RandomState(seed)
+    x = rng.randn(rng.randint(50, 2000))
+    if levels is not None:
+        # few distinct heights, so that many peaks tie.
+        x = np.round(x * levels / 2)
+    ind = _candidates(x)
+    expected = _suppress_close_peaks_reference(x, ind, mpd, kpsh)
+    np.testing.assert_array_equal(_suppress_close_peaks(x, ind, mpd, kpsh), expected)
+
+
+@pytest.mark.parametrize('kpsh', [False, True])
+def test_detect_peaks_with_nans_matches_reference(kpsh):
+    rng = np.random.RandomState(0)
+    x = rng.randn(3000)
+    x[rng.choice(x.size, 50, replace=False)] = np.nan
+    found = detect_peaks(x, mpd=10, kpsh=kpsh, valley=True)
+    negated = -x
+    negated[np.isnan(negated)] = np.inf
+    expected = _suppress_close_peaks_reference(negated, detect_peaks(x, mpd=1, valley=True), 10, kpsh)
+    np.testing.assert_array_equal(found, expected)
+
+
+def test_plateau_of_equal_peaks():
+    x = np.array([0, 1, 0, 1, 0, 1, 0, 1, 0], dtype=float)
+    np.testing.assert_array_equal(detect_peaks(x, mpd=2, kpsh=True), [1, 3, 5, 7])
+    np.testing.assert_array_equal(detect_peaks(x, mpd=2, kpsh=False),
+                                  _suppress_close_peaks_reference(x, np.array([1, 3, 5, 7]), 2, False))
@@ -0,0 +1,178 @@
+import math
+
+import attr
+import cv2
+import numpy as np
+import pandas as pd
+import pytest
+
+from mousetracker.benchmarks import SyntheticVideo, eye_area_trace
+from mousetracker.core.base import SideOfFace, VideoFileData
+from mousetracker.core.eyes import (EYE_FIELDS, AdaptiveEyeSampler, BlinkDetector, EyeSegmenter, EyeStats, EyeStatsTable,
+                                    MeasurementMode, _red_mask, compute_areas, find_blinks, make_windows, red_grey,
+                                    track_eyes, window)
+
+
+def _stream(detector, samples, chunk_sizes):
+    """feed samples to a detector in chunks of the given sizes (cycled), and collect every blink reported."""
+    found, start, i = [], 0, 0
+    while start < len(samples):
+        stop = start + chunk_sizes[i % len(chunk_sizes)]
+        found.append(detector.update(samples[start:stop]))
+        start, i = stop, i + 1
+    found.append(detector.finish())
+    return np.concatenate(found)
+
+
+@pytest.mark.parametrize('chunk_sizes', [[1], [7, 300, 13], [10000]])
+@pytest.mark.parametrize('seed', range(3))
+def test_blink_detector_matches_find_blinks_on_isolated_blinks(chunk_sizes, seed):
+    # blinks every 3 s at 240 Hz are more than 2 * min_dist apart, and dip far below the threshold.
+    samples = eye_area_trace(240 * 60, blink_interval=3.0, seed=seed)
+    expected = find_blinks(pd.Series(samples), min_dist=120, std_num=2.5)
+    assert len(expected) == 20
+    found = _stream(BlinkDetector(min_dist=120, std_num=2.5), samples, chunk_sizes)
+    np.testing.assert_array_equal(found, expected)
+
+
+def test_blink_detector_reports_within_min_dist_after_warmup():
+    samples = eye_area_trace(240 * 30, blink_interval=3.0)
+    blinks = find_blinks(pd.Series(samples), min_dist=120)
+    detector = BlinkDetector(min_dist=120, std_num=2)
+    for i, sample in enumerate(samples):
+        for blink in detector.update([sample]):
+            # blinks during the warmup wait for it to end.
+            assert i == max(blink + detector.min_dist, detector.warmup - 1)
+    assert detector.warmup < blinks[-1]
+
+
+@pytest.mark.parametrize('fs', [120, 240, 500])
+def test_make_windows_follows_the_sampling_rate(fs):
+    series = pd.Series(eye_area_trace(fs * 20, framerate=fs, blink_interval=3.0))
+    windows = make_windows(series, 400, fs)
+    blinks = find_blinks(series)
+    assert list(windows.columns) == [f'blink_{i}' for i in range(len(blinks))]
+    assert len(windows) == int(0.4 * fs) + int(0.4 * fs) % 2
+    assert windows.index[len(windows) // 2] == 0
+    for column, blink in zip(windows, blinks):
+        window_ = window(series, blink, 400, fs)
+        np.testing.assert_array_equal(windows[column].to_numpy(), window_.to_numpy())
+        inside = window_.index[(window_.index >= 0) & (window_.index < len(series))]
+        np.testing.assert_array_equal(window_[inside], series[inside])
+
+
+@pytest.mark.parametrize('size', [(320, 240), (640, 480)])
+def test_measurement_modes_agree_with_ellipse(size):
+    # frames 0..300 include a half-closed eye mid-blink (frame 255) as well as open ones.
+    video = SyntheticVideo(width=size[0], height=size[1], duration=1.5)
+    for i in range(0, video.nframes, 15):
+        frame = video.frame(i)
+        ellipse = compute_areas(frame)
+        assert ellipse.contour_area is not None
+        perimeter = math.pi * (ellipse.major_axis + ellipse.minor_axis) / 2
+        for mode in (MeasurementMode.contour, MeasurementMode.components):
+            measured = compute_areas(frame, mode)
+            # centroids are within a quarter pixel of the fitted ellipse's center.
+            assert math.hypot(measured.center_x - ellipse.center_x, measured.center_y - ellipse.center_y) < 0.25
+        # the largest contour is the same polygon, whether traced with every point or only the corners.
+        assert compute_areas(frame, MeasurementMode.contour).contour_area == ellipse.contour_area
+        # counting pixels includes the boundary pixels that the polygon cuts through: about half of the perimeter.
+        excess = compute_areas(frame, MeasurementMode.components).contour_area - ellipse.contour_area
+        assert 0.3 * perimeter < excess < 0.7 * perimeter
+
+
+def _frames():
+    """random and synthetic frames, odd-sized ones, and views that aren't contiguous."""
+    rng = np.random.default_rng(0)
+    synthetic = SyntheticVideo().frame(0)
+    yield 'random', rng.integers(0, 256, (240, 320, 3), dtype=np.uint8)
+    yield 'synthetic', synthetic
+    yield 'smoothed', cv2.GaussianBlur(synthetic, (0, 0), 2)
+    yield 'odd-sized', rng.integers(0, 256, (37, 53, 3), dtype=np.uint8)
+    yield 'single pixel', rng.integers(0, 256, (1, 1, 3), dtype=np.uint8)
+    yield 'cropped', synthetic[10:101, 7:250]
+    yield 'strided', synthetic[::2, ::3]
+    yield 'channels reversed', rng.integers(0, 256, (31, 47, 3), dtype=np.uint8)[..., ::-1]
+
+
+@pytest.mark.parametrize('name,frame', list(_frames()), ids=[name for name, _ in _frames()])
+def test_red_grey_matches_hsv(name, frame):
+    expected = _red_mask(cv2.cvtColor(frame, cv2.COLOR_BGR2HSV))
+    np.testing.assert_array_equal(red_grey(frame), expected)
+    out = np.full(frame.shape[:2], 7, dtype=np.uint8)
+    assert red_grey(frame, out=out) is out
+    np.testing.assert_array_equal(out, expected)
+
+
+def test_red_grey_rejects_a_non_contiguous_output():
+    frame = SyntheticVideo().frame(0)
+    out = np.empty((frame.shape[0], frame.shape[1] * 2), dtype=np.uint8)[:, ::2]
+    with pytest.raises(ValueError):
+        red_grey(frame, out=out)
+
+
+@pytest.fixture(scope='module')
+def synthetic_video(tmp_path_factory):
+    synthetic = SyntheticVideo(duration=0.5)
+    return synthetic, synthetic.write(str(tmp_path_factory.mktemp('eyes') / 'left.avi'))
+
+
+def _decoded(filename):
+    cap = cv2.VideoCapture(filename)
+    frames = []
+    ok, frame = cap.read()
+    while ok:
+        frames.append(frame)
+        ok, frame = cap.read()
+    cap.release()
+    return frames
+
+
+@pytest.mark.parametrize('chunk_size', [50, 2400])
+def test_track_eyes_is_the_same_for_any_number_of_workers(synthetic_video, chunk_size):
+    synthetic, filename = synthetic_video
+    tracked = []
+    for workers in (1, 4):
+        video = VideoFileData(name=filename, side=SideOfFace.left, eye=None, nframes=synthetic.nframes)
+        tracked.append(track_eyes(video, workers=workers, chunk_size=chunk_size, index=False).eye)
+    pd.testing.assert_frame_equal(tracked[0], tracked[1])
+    # every frame appears once, in order, measured as if the video had been read in one piece.
+    np.testing.assert_array_equal(tracked[0]['frameid'], np.arange(synthetic.nframes))
+    expected = EyeSegmenter(width=synthetic.width, height=synthetic.height).process_batch(_decoded(filename))
+    np.testing.assert_array_equal(tracked[0].drop(columns='frameid').to_numpy(), expected.values)
+
+
+def test_eye_stats_table_round_trips_eye_stats():
+    video = SyntheticVideo()
+    frames = [video.frame(i) for i in (0, 100, 255)] + [np.zeros((video.height, video.width, 3), dtype=np.uint8)]
+    stats = [EyeSegmenter(width=video.width, height=video.height).process(frame) for frame in frames]
+    assert stats[-1] == EyeStats()
+    table = EyeSegmenter(width=video.width, height=video.height).process_batch(frames)
+    expected = pd.DataFrame([attr.astuple(s) for s in stats], columns=['left_' + f for f in EYE_FIELDS], dtype=float)
+    pd.testing.assert_frame_equal(table.to_dataframe('left_'), expected)
+    assert [table[i] for i in range(len(table))] == stats
+    copy = EyeStatsTable.allocate(len(stats))
+    for i, s in enumerate(stats):
+        copy[i] = s
+    np.testing.assert_array_equal(copy.values, table.values)
+
+
+def test_adaptive_sampler_interpolates_steady_frames_and_keeps_every_blink():
+    video = SyntheticVideo(duration=5.5)
+    full = EyeSegmenter(width=video.width, height=video.height).process_batch(list(video.frames()))
+    table, interpolated = AdaptiveEyeSampler(stride=4).run(enumerate(video.frames()), video.nframes)
+    # most frames of a steady eye are skipped...
+    assert interpolated.sum() > video.nframes / 2
+    # ...but none while the eye is closing or opening.
+    blinking = np.array([video.openness(i) < 1 for i in range(video.nframes)])
+    assert blinking.sum() > 0 and not (interpolated & blinking).any()
+    # skipped frames are filled in linearly between their measured neighbours.
+    rows, measured = np.flatnonzero(interpolated), np.flatnonzero(~interpolated)
+    np.testing.assert_allclose(table.values[rows], full.values[rows], rtol=0.01)
+    np.testing.assert_array_equal(table.values[measured], full.values[measured])
+    area = table.column('contour_area')
+    np.testing.assert_allclose(area[rows], np.interp(rows, measured, area[measured]))
+    expected = find_blinks(pd.Series(full.column('contour_area')))
+    assert len(expected) == len(video.blink_frames()) == 3
+    np.testing.assert_array_equal(find_blinks(pd.Series(area)), expected)
+    assert np.all(np.abs(expected - video.blink_frames()) <= 1)
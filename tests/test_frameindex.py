@@ -0,0 +1,59 @@
+import cv2
+import numpy as np
+import pytest
+
+from mousetracker.benchmarks import SyntheticVideo
+from mousetracker.core import frameindex
+from mousetracker.core.frameindex import FrameIndex
+
+
+class CountingCapture(object):
+    """a capture that counts the frames it decodes."""
+
+    def __init__(self, filename):
+        self._cap = cv2.VideoCapture(filename, cv2.CAP_FFMPEG)
+        self.grabbed = 0
+
+    def grab(self):
+        self.grabbed += 1
+        return self._cap.grab()
+
+    def __getattr__(self, name):
+        return getattr(self._cap, name)
+
+
+@pytest.fixture(scope='module')
+def video(tmp_path_factory):
+    synthetic = SyntheticVideo(duration=0.5)
+    return synthetic.write(str(tmp_path_factory.mktemp('frameindex') / 'video.avi'))
+
+
+@pytest.fixture(scope='module')
+def frames(video):
+    cap = cv2.VideoCapture(video, cv2.CAP_FFMPEG)
+    decoded = []
+    ok, frame = cap.read()
+    while ok:
+        decoded.append(frame)
+        ok, frame = cap.read()
+    cap.release()
+    return decoded
+
+
+@pytest.mark.parametrize('has_keyframes', [True, False])
+def test_seek_lands_on_the_frame(video, frames, has_keyframes):
+    index = frameindex.build(video)
+    assert index.nframes == len(frames)
+    if not has_keyframes:
+        index = FrameIndex(timestamps=index.timestamps, keyframes=np.zeros(index.nframes, dtype=bool))
+    assert index.has_keyframes == has_keyframes
+    for frameid in (0, 1, 37, 100, len(frames) - 1, 5):
+        cap = CountingCapture(video)
+        index.seek(cap, frameid, position=0)
+        ok, frame = cap.read()
+        assert ok
+        np.testing.assert_array_equal(frame, frames[frameid])
+        if not has_keyframes:
+            # the decoder seeks by itself, rather than decoding forward from the start.
+            assert cap.grabbed == 0
+        cap.release()
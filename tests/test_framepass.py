@@ -0,0 +1,73 @@
+import cv2
+import numpy as np
+import pandas as pd
+import pytest
+
+from mousetracker.benchmarks import SyntheticVideo
+from mousetracker.core.base import SideOfFace, VideoFileData
+from mousetracker.core.framepass import Brightness, EyeAnalyzer, MotionEnergy, analyze_video, run_frame_pass
+
+
+@pytest.fixture(scope='module')
+def video(tmp_path_factory):
+    synthetic = SyntheticVideo(duration=0.25)
+    filename = synthetic.write(str(tmp_path_factory.mktemp('framepass') / 'left.avi'))
+    return VideoFileData(name=filename, side=SideOfFace.left, eye=None, nframes=synthetic.nframes)
+
+
+def _analyzers():
+    return [EyeAnalyzer(), MotionEnergy(roi=(160, 100, 150, 120)), Brightness()]
+
+
+def test_parallel_frame_pass_matches_inline(video):
+    inline = run_frame_pass(video, _analyzers(), parallel=False)
+    parallel = run_frame_pass(video, _analyzers(), parallel=True, capacity=4)
+    assert len(inline) == video.nframes
+    assert inline['left_motion_energy'].notna().sum() == video.nframes - 1
+    assert inline['left_fitted_area'].notna().all()
+    pd.testing.assert_frame_equal(parallel, inline)
+
+
+def test_analyze_video_adds_columns_to_existing_eye_data(video):
+    eye = pd.DataFrame({'left_fitted_area': np.arange(video.nframes, dtype=float)},
+                       index=pd.Index(np.arange(video.nframes), name='frameid'))
+    video.eye = eye
+    for _ in range(2):
+        analyze_video(video, parallel=False, eye=False)
+        assert list(video.eye.columns) == ['left_fitted_area', 'left_motion_energy', 'left_brightness',
+                                           'left_contrast', 'left_clipped']
+    pd.testing.assert_series_equal(video.eye['left_fitted_area'], eye['left_fitted_area'])
+    assert video.eye['left_brightness'].notna().all()
+
+
+def test_brightness_of_an_inverted_frame_is_that_of_the_original():
+    frame = SyntheticVideo().frame(0)
+    frame[:10] = 255
+    frame[-5:] = 0
+    inverted = cv2.cvtColor(cv2.bitwise_not(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)), cv2.COLOR_GRAY2BGR)
+    measured = {}
+    for name, analyzer, f in [('original', Brightness(), frame), ('inverted', Brightness(inverted=True), inverted),
+                              ('uncorrected', Brightness(), inverted)]:
+        out = np.full((1, len(analyzer.columns)), np.nan)
+        analyzer.start(frame.shape[1], frame.shape[0], out)
+        analyzer.process(0, f)
+        measured[name] = out[0]
+    np.testing.assert_allclose(measured['inverted'], measured['original'])
+    assert 0 < measured['original'][2] < 1
+    assert measured['uncorrected'][0] == pytest.approx(255 - measured['original'][0])
+
+
+def test_frame_pass_on_an_inverted_side_video(video, tmp_path):
+    # written the way analyze_bout writes the side videos for whisk.
+    synthetic = SyntheticVideo(duration=0.25)
+    filename = str(tmp_path / 'left.avi')
+    writer = cv2.VideoWriter(filename, cv2.VideoWriter_fourcc(*'MJPG'), synthetic.framerate,
+                             (synthetic.width, synthetic.height), isColor=False)
+    for frame in synthetic.frames():
+        writer.write(cv2.bitwise_not(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)))
+    writer.release()
+    side = VideoFileData(name=filename, side=SideOfFace.left, eye=None, nframes=synthetic.nframes)
+    original = run_frame_pass(video, [Brightness()], parallel=False)
+    inverted = run_frame_pass(side, [Brightness(inverted=True)], parallel=False)
+    np.testing.assert_allclose(inverted['left_brightness'], original['left_brightness'], atol=1)
+    np.testing.assert_allclose(inverted['left_contrast'], original['left_contrast'], atol=1)
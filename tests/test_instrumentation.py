@@ -0,0 +1,86 @@
+import json
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+from mousetracker.core import instrumentation
+from mousetracker.core.base import SideOfFace, VideoFileData
+
+
+@pytest.fixture
+def enabled():
+    was = instrumentation.is_enabled()
+    instrumentation.enable()
+    yield
+    instrumentation.enable(was)
+
+
+@pytest.fixture
+def video(tmp_path):
+    return VideoFileData(name=str(tmp_path / 'video.avi'), side=SideOfFace.left, eye=None, nframes=1)
+
+
+@instrumentation.timed('test.nap')
+def nap(seconds):
+    time.sleep(seconds)
+    return seconds
+
+
+def test_timings_and_counts_are_saved_to_the_timing_file(enabled, video):
+    with instrumentation.recording(instrumentation.recorder(video.labelname)):
+        assert nap(0.01) == 0.01
+        nap(0.03)
+        with instrumentation.timer('test.block'):
+            pass
+        instrumentation.count('test.frames', 5)
+        instrumentation.count('test.frames')
+    instrumentation.save_report(video)
+    with open(video.timingfile) as f:
+        report = json.load(f)
+    assert report['label'] == 'video'
+    assert set(report['timers']) == {'test.nap', 'test.block'}
+    naps = report['timers']['test.nap']
+    assert naps['calls'] == 2
+    assert naps['min_s'] >= 0.01 and naps['max_s'] >= 0.03
+    assert naps['total_s'] == pytest.approx(naps['min_s'] + naps['max_s'])
+    assert naps['mean_s'] == pytest.approx(naps['total_s'] / 2)
+    assert report['counters'] == {'test.frames': 6}
+    # the report starts afresh once saved.
+    assert instrumentation.recorder(video.labelname).to_dict()['timers'] == {}
+
+
+def test_worker_recorders_merge(enabled):
+    total, worker = instrumentation.Recorder(label='total'), instrumentation.Recorder(label='worker')
+    total.add_time('test.step', 1.0)
+    worker.add_time('test.step', 3.0)
+    worker.count('test.frames', 2)
+    total.merge(worker)
+    assert total.to_dict()['timers']['test.step'] == {'calls': 2, 'total_s': 4.0, 'mean_s': 2.0, 'min_s': 1.0,
+                                                      'max_s': 3.0}
+    assert total.to_dict()['counters'] == {'test.frames': 2}
+
+
+def test_nothing_is_recorded_or_written_while_disabled(video):
+    was = instrumentation.is_enabled()
+    instrumentation.enable(False)
+    try:
+        with instrumentation.recording(instrumentation.recorder(video.labelname)) as target:
+            nap(0)
+            instrumentation.count('test.frames')
+        assert target.to_dict()['timers'] == {} and target.to_dict()['counters'] == {}
+        instrumentation.save_report(video)
+        assert not os.path.exists(video.timingfile)
+    finally:
+        instrumentation.enable(was)
+
+
+@pytest.mark.parametrize('value,expected', [('1', 'True'), ('', 'False')])
+def test_the_environment_switches_timing_on(value, expected):
+    env = dict(os.environ, MOUSETRACKER_TIMING=value, PYTHONPATH=os.pathsep.join(p for p in sys.path if p))
+    result = subprocess.run([sys.executable, '-c', 'from mousetracker.core import instrumentation; '
+                                                   'print(instrumentation.is_enabled())'],
+                            stdout=subprocess.PIPE, env=env, check=True)
+    assert result.stdout.decode().strip() == expected
@@ -0,0 +1,26 @@
+import numpy as np
+
+from mousetracker.benchmarks import SyntheticVideo
+from mousetracker.core.preview import _fill_still, estimate_whisking
+
+
+def test_fill_still_unwraps_across_the_orientation_boundary():
+    truth = np.linspace(60, 130, 50)
+    wrapped = (truth + 90) % 180 - 90
+    moving = np.ones(len(truth), dtype=bool)
+    moving[[10, 11, 30]] = False
+    filled = _fill_still(wrapped, moving)
+    np.testing.assert_allclose(filled[moving], truth[moving], atol=1e-9)
+    np.testing.assert_allclose(filled[[10, 11, 30]], truth[[9, 9, 29]], atol=1e-9)
+
+
+def test_estimate_whisking_tracks_the_whisker_angle(tmp_path):
+    video = SyntheticVideo(width=640, height=480, duration=0.5)
+    filename = video.write(str(tmp_path / 'whisking.avi'))
+    estimate = estimate_whisking(filename, roi=(330, 200, 300, 250))
+    assert len(estimate) == video.nframes
+    # the synthetic whiskers fan out around 4 degrees below the nominal angle; the first frame has no motion to measure.
+    truth = np.array([video.whisker_angle(i) for i in range(video.nframes)]) - 4
+    measured = estimate['mean_degrees'].to_numpy()
+    assert np.corrcoef(measured[1:], truth[1:])[0, 1] > 0.98
+    assert np.abs(measured[1:] - truth[1:]).mean() < 3
@@ -0,0 +1,114 @@
+import sys
+from os import path
+
+import attr
+import pytest
+import yaml
+
+from mousetracker.core import scheduler
+from mousetracker.core.base import SideOfFace, VideoFileData, modulePath
+from mousetracker.core.whiskers import WhiskStage
+from mousetracker.core.yaml_config import Config
+
+# a stand-in for a whisk binary: runs for a moment, logs when, then writes its output or fails.
+STAGE = """
+import sys, time
+output, size, log, fail = sys.argv[1:]
+start = time.time()
+time.sleep(0.2)
+if fail == '1':
+    sys.exit(1)
+with open(output, 'wb') as f:
+    f.write(b'x' * int(size))
+with open(log, 'a') as f:
+    f.write(f'{start} {time.time()}\\n')
+"""
+STAGE_SIZE = 1000
+
+
+@pytest.fixture
+def config():
+    with open(path.join(modulePath, 'resources', 'defaults.yaml')) as f:
+        return Config(**yaml.safe_load(f))
+
+
+@pytest.fixture
+def fake_toolchain(monkeypatch, tmp_path):
+    """replace the whisk binaries and the extraction step; `failing` names (video, stage) pairs that fail."""
+    failing = set()
+    extracted = []
+
+    def stages(video, config):
+        outputs = [('trace', video.whiskname), ('measure', video.measured), ('classify', video.classified),
+                   ('reclassify', video.measname)]
+        return [WhiskStage(name=name, outputs=[output], args={},
+                           argv=[sys.executable, '-c', STAGE, output, str(STAGE_SIZE), str(tmp_path / f'{name}.log'),
+                                 '1' if (video.labelname, name) in failing else '0'])
+                for name, output in outputs]
+
+    monkeypatch.setattr(scheduler, 'whisk_stages', stages)
+    monkeypatch.setattr(scheduler, 'estimate_whisking_from_raw_whiskers',
+                        lambda video, *args: extracted.append(video.labelname))
+    return failing, extracted
+
+
+def _videos(directory, n):
+    videos = []
+    for i in range(n):
+        name = directory / f'video{i}.avi'
+        name.write_bytes(b'not really a video')
+        videos.append(VideoFileData(name=str(name), side=SideOfFace.left, eye=None, nframes=1))
+    return videos
+
+
+def _most_at_once(log):
+    """the most intervals in a log of 'start end' lines that overlap at any moment."""
+    with open(log) as f:
+        intervals = [tuple(map(float, line.split())) for line in f]
+    events = sorted([(start, 1) for start, _ in intervals] + [(end, -1) for _, end in intervals])
+    running = most = 0
+    for _, change in events:
+        running += change
+        most = max(most, running)
+    return most
+
+
+def test_stage_limits_bound_concurrency(tmp_path, config, fake_toolchain):
+    videos = _videos(tmp_path, 4)
+    report = scheduler.run_batch(videos, config, workers=4, stage_limits={'trace': 1, 'measure': 2})
+    assert (report['status'] == 'ok').all()
+    assert _most_at_once(tmp_path / 'trace.log') == 1
+    assert _most_at_once(tmp_path / 'measure.log') <= 2
+    assert sorted(fake_toolchain[1]) == sorted(v.labelname for v in videos)
+
+
+def test_a_failure_stops_only_its_video(tmp_path, config, fake_toolchain):
+    videos = _videos(tmp_path, 3)
+    fake_toolchain[0].add(('video1', 'classify'))
+    report = scheduler.run_batch(videos, config, workers=3).set_index('video')
+    assert report.loc['video1', 'status'] == 'failed'
+    assert report.loc['video1', 'stage'] == 'classify'
+    assert not path.exists(videos[1].measname)
+    assert (report.drop('video1')['status'] == 'ok').all()
+    assert sorted(fake_toolchain[1]) == ['video0', 'video2']
+
+
+def test_up_to_date_stages_are_not_rerun(tmp_path, config, fake_toolchain):
+    videos = _videos(tmp_path, 2)
+    scheduler.run_batch(videos, config)
+    report = scheduler.run_batch(videos, config)
+    assert (report['status'] == 'ok').all()
+    assert (report['cache_hits'] == 4).all()
+    with open(tmp_path / 'trace.log') as f:
+        assert len(f.readlines()) == 2
+
+
+def test_intermediate_files_are_evicted_to_the_limit(tmp_path, config, fake_toolchain):
+    videos = _videos(tmp_path, 2)
+    config = attr.evolve(config, storage=attr.evolve(config.storage, intermediate_limit_gb=3.5 * STAGE_SIZE / 2 ** 30))
+    report = scheduler.run_batch(videos, config)
+    assert (report['status'] == 'ok').all()
+    remaining = [f for f in tmp_path.iterdir() if f.suffix in ('.whiskers', '.measurements')]
+    assert len(remaining) == 3
+    # each video's final measurements are the most recently used, so they are kept.
+    assert all(path.exists(v.measname) for v in videos)
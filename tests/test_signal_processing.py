@@ -0,0 +1,138 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+import pytest
+from scipy import signal
+from scipy.signal import butter, filtfilt, welch
+
+from mousetracker.benchmarks import whisker_angle_trace
+from mousetracker.core import whiskers
+from mousetracker.core.util import spectral
+from mousetracker.core.util.signal_processing import (lowpass, lowpass_chunked, lowpass_ragged, pad_ragged,
+                                                      settling_length, whisking_features)
+
+FS = 240
+
+
+def _trace(n, seed=0):
+    """ a random walk plus whisking-band oscillation: broadband, with a drifting baseline."""
+    rng = np.random.RandomState(seed)
+    t = np.arange(n) / FS
+    return np.cumsum(rng.randn(n)) + 20 * np.sin(2 * np.pi * 8 * t) + rng.randn(n)
+
+
+@pytest.mark.parametrize('chunk_size', [50, 1000, 4097, 30000, 99999, 200000])
+@pytest.mark.parametrize('cutoff,order', [(25, 5), (10, 3)])
+def test_lowpass_chunked_matches_lowpass(chunk_size, cutoff, order):
+    data = _trace(100000)
+    expected = lowpass(data, FS, cutoff, order)
+    chunked = lowpass_chunked(data, FS, cutoff, order, chunk_size=chunk_size)
+    # away from the ends of the signal, within the documented 1e-9 of its peak amplitude.
+    edge = settling_length(order, cutoff, FS)
+    bound = 1e-9 * np.abs(data).max()
+    assert np.abs(chunked - expected)[edge:-edge].max() <= bound
+    # chunk boundaries are the only difference, so the ends agree as well.
+    assert np.abs(chunked - expected).max() <= bound
+
+
+def test_lowpass_uses_the_chunked_path_for_long_signals():
+    data = _trace(5000)
+    out = np.empty_like(data)
+    assert lowpass(data, FS, chunk_size=1000, out=out) is out
+    np.testing.assert_allclose(out, lowpass(data, FS), rtol=0, atol=1e-9 * np.abs(data).max())
+
+
+def test_lowpass_matches_the_transfer_function_filter_away_from_the_edges():
+    # lowpass used to be filtfilt(b, a).  sosfiltfilt pads and sets initial conditions per second-order section, so
+    # results may differ near the ends of the signal; away from them, only by rounding.
+    data = _trace(20000)
+    b, a = butter(5, 25 / (FS / 2), 'low')
+    edge = settling_length(5, 25, FS)
+    np.testing.assert_allclose(lowpass(data, FS)[edge:-edge], filtfilt(b, a, data)[edge:-edge],
+                               rtol=0, atol=1e-9 * np.abs(data).max())
+
+
+def _ragged(seed=0, count=12):
+    rng = np.random.RandomState(seed)
+    lengths = [19, 20, 1023, 1024, 1025] + list(rng.randint(30, 6000, count))
+    return [_trace(n, seed=i) for i, n in enumerate(lengths)]
+
+
+@pytest.mark.parametrize('chunk_size', [None, 2048])
+def test_lowpass_ragged_matches_lowpass_per_row(chunk_size):
+    traces = _ragged()
+    padded, lengths = pad_ragged(traces)
+    filtered = lowpass_ragged(padded, lengths, FS, chunk_size=chunk_size)
+    for trace, row in zip(traces, filtered):
+        np.testing.assert_allclose(row[:len(trace)], lowpass(trace, FS, chunk_size=chunk_size), rtol=0, atol=1e-12)
+        assert np.isnan(row[len(trace):]).all()
+
+
+def test_lowpass_ragged_rejects_traces_too_short_to_filter():
+    padded, lengths = pad_ragged([_trace(100), _trace(10)])
+    with pytest.raises(ValueError):
+        lowpass_ragged(padded, lengths, FS)
+
+
+def test_whisking_features_match_welch():
+    traces = _ragged(seed=1) + [np.array([1.0])]
+    padded, lengths = pad_ragged(traces)
+    features = whisking_features(padded, lengths, FS)
+    for i, trace in enumerate(traces):
+        assert features['set_point'][i] == pytest.approx(trace.mean())
+        if len(trace) < 2:
+            assert np.isnan(features['dominant_frequency'][i])
+            continue
+        f, pxx = welch(trace, FS, nperseg=min(1024, len(trace)))
+        inband = (f >= 1) & (f <= 30)
+        assert features['dominant_frequency'][i] == f[inband][np.argmax(pxx[inband])]
+
+
+def test_filter_raw_batch_matches_filter_raw(monkeypatch):
+    # a small chunk size, so that some traces take the chunked path.
+    monkeypatch.setattr(whiskers, 'DEFAULT_CHUNK_SIZE', 3000)
+    params = SimpleNamespace(camera=SimpleNamespace(framerate=FS))
+    traces = {(f'video{i}', 'left'): pd.DataFrame({'frameid': np.arange(len(t)), 'mean_degrees': t})
+              for i, t in enumerate(_ragged(seed=2))}
+    batch, features = whiskers.filter_raw_batch(traces, params)
+    assert list(features['nframes']) == [len(t) for t in traces.values()]
+    for key, trace in traces.items():
+        expected = whiskers.filter_raw(trace, params, key[0])
+        pd.testing.assert_frame_equal(batch[key], expected, check_exact=False, rtol=0, atol=1e-12)
+
+
+@pytest.mark.parametrize('nperseg,noverlap', [(256, None), (240, 60)])
+def test_spectrogram_matches_scipy(nperseg, noverlap):
+    y = whisker_angle_trace(FS * 20)
+    freqs, times, psd = spectral.spectrogram(y, FS, nperseg=nperseg, noverlap=noverlap)
+    # scipy overlaps windows by an eighth by default, rather than a half.
+    noverlap = nperseg // 2 if noverlap is None else noverlap
+    f, t, expected = signal.spectrogram(y, FS, window='hann', nperseg=nperseg, noverlap=noverlap,
+                                        detrend='constant', scaling='density', mode='psd')
+    band = (f >= spectral.WHISKING_BAND[0]) & (f <= spectral.WHISKING_BAND[1])
+    np.testing.assert_allclose(freqs, f[band])
+    np.testing.assert_allclose(times, t)
+    np.testing.assert_allclose(psd, expected[band], rtol=1e-5, atol=1e-6 * expected.max())
+
+
+def test_band_power_matches_welch():
+    y = whisker_angle_trace(FS * 10 + 100, seed=3)
+    power = spectral.band_power([y, y[:FS * 4]], FS)
+    assert [len(p) for p in power] == [10, 4]
+    for second, value in enumerate(power[0]):
+        f, pxx = welch(y[second * FS:(second + 1) * FS], FS, window='hann', nperseg=FS, detrend='constant')
+        band = (f >= spectral.WHISKING_BAND[0]) & (f <= spectral.WHISKING_BAND[1])
+        np.testing.assert_allclose(value, pxx[band].sum() * (f[1] - f[0]), rtol=1e-9)
+    np.testing.assert_allclose(power[1], power[0][:4])
+
+
+@pytest.mark.parametrize('frequency', [6.0, 8.0, 12.5])
+def test_whisking_summary_peaks_at_the_whisking_frequency(frequency):
+    y = whisker_angle_trace(FS * 30, whisk_frequency=frequency)
+    summary = spectral.whisking_summary(y, FS)
+    resolution = FS / len(y)
+    assert abs(summary['peak_frequency'] - frequency) <= resolution
+    # the trace is a 20 degree sine, plus noise.
+    assert summary['peak_amplitude'] == pytest.approx(20, rel=0.05)
+    assert summary['max_band_power'] >= summary['mean_band_power'] > 0
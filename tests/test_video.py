@@ -0,0 +1,69 @@
+import threading
+
+import cv2
+import numpy as np
+import pytest
+
+from mousetracker.benchmarks import SyntheticVideo
+from mousetracker.core.video import FrameSource
+
+
+@pytest.fixture(scope='module')
+def video(tmp_path_factory):
+    synthetic = SyntheticVideo(duration=0.25)
+    return synthetic.write(str(tmp_path_factory.mktemp('video') / 'video.avi'))
+
+
+@pytest.fixture(scope='module')
+def frames(video):
+    cap = cv2.VideoCapture(video)
+    decoded = []
+    ok, frame = cap.read()
+    while ok:
+        decoded.append(frame)
+        ok, frame = cap.read()
+    cap.release()
+    return decoded
+
+
+def _read(source):
+    with source:
+        return [(frameid, frame.copy()) for frameid, frame in source]
+
+
+@pytest.mark.parametrize('start,stride', [(0, 1), (0, 3), (5, 1), (7, 4)])
+def test_frames_and_stride(video, frames, start, stride):
+    read = _read(FrameSource(video, start=start, stride=stride, capacity=2))
+    assert [frameid for frameid, _ in read] == list(range(start, len(frames), stride))
+    for frameid, frame in read:
+        np.testing.assert_array_equal(frame, frames[frameid])
+
+
+@pytest.mark.parametrize('roi', [(10, 20, 100, 50), (300, 200, 100, 100), (-20, -10, 50, 40)])
+def test_roi_is_cropped_to_the_frame(video, frames, roi):
+    x, y, w, h = roi
+    height, width = frames[0].shape[:2]
+    crop = (slice(max(y, 0), min(y + h, height)), slice(max(x, 0), min(x + w, width)))
+    source = FrameSource(video, stop=10, roi=roi, grayscale=True)
+    read = _read(source)
+    assert len(read) == 10
+    assert (source.height, source.width) == read[0][1].shape
+    for frameid, frame in read:
+        np.testing.assert_array_equal(frame, cv2.cvtColor(frames[frameid][crop], cv2.COLOR_BGR2GRAY))
+
+
+def test_roi_outside_the_frame_is_an_error(video):
+    with pytest.raises(ValueError):
+        FrameSource(video, roi=(1000, 1000, 10, 10)).open()
+
+
+def test_stopping_early_does_not_deadlock(video):
+    def consume():
+        # with a small ring, the decoder is blocked waiting for a free buffer when the consumer stops.
+        for frameid, _ in FrameSource(video, capacity=1):
+            if frameid == 3:
+                break
+    thread = threading.Thread(target=consume, daemon=True)
+    thread.start()
+    thread.join(timeout=10)
+    assert not thread.is_alive()
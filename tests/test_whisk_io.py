@@ -0,0 +1,100 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from mousetracker.core.util import whisk_io
+
+
+def _segments(nframes=50, seed=0):
+    """random traced segments: (fid, wid, x, y) with a few whiskers per frame, some with no or one point."""
+    rng = np.random.default_rng(seed)
+    segments = []
+    for fid in range(nframes):
+        for wid in range(rng.integers(0, 6)):
+            npoints = int(rng.choice([0, 1, 2, 5, 40]))
+            # whole numbers of pixels, so that the float32 file holds them exactly.
+            x = rng.integers(0, 640, npoints).astype(np.float32)
+            y = rng.integers(0, 480, npoints).astype(np.float32)
+            segments.append((fid, wid, x, y))
+    return segments
+
+
+def _write_whiskers(filename, segments):
+    with open(filename, 'wb') as f:
+        f.write(whisk_io.WHISKERS_HEADER)
+        for fid, wid, x, y in segments:
+            f.write(np.array([wid, fid, len(x)], dtype='<i4').tobytes())
+            thick, scores = np.ones(len(x), dtype='<f4'), np.full(len(x), 0.5, dtype='<f4')
+            f.write(b''.join(a.astype('<f4').tobytes() for a in (x, y, thick, scores)))
+
+
+def _write_measurements(filename, rows):
+    nfeatures = len(whisk_io.MEASUREMENT_FEATURES)
+    with open(filename, 'wb') as f:
+        f.write(whisk_io.MEASUREMENTS_HEADER)
+        f.write(np.array([len(rows)], dtype='<i4').tobytes())
+        for i, (fid, wid, angle) in enumerate(rows):
+            f.write(np.array([i, fid, wid, 0, 10, 20, 0, 0, 0, nfeatures], dtype='<i4').tobytes())
+            f.write(b'x\0\0\0')
+            data = np.arange(nfeatures, dtype='<f8')
+            data[whisk_io.MEASUREMENT_FEATURES.index('angle')] = angle
+            f.write(data.tobytes() + np.zeros(nfeatures, dtype='<f8').tobytes())
+
+
+def _timedata(fid, degrees):
+    """per-frame statistics as the python 2.7 loaders write them: frameid, mean_degrees, num_whiskers, stderr."""
+    grouped = pd.DataFrame({'frameid': fid, 'degrees': degrees}).groupby('frameid')['degrees']
+    return pd.DataFrame({'mean_degrees': grouped.mean(), 'num_whiskers': grouped.count(),
+                         'stderr': grouped.sem()}).reset_index()
+
+
+def test_read_whiskers_round_trips(tmp_path):
+    segments = _segments()
+    filename = str(tmp_path / 'video.whiskers')
+    _write_whiskers(filename, segments)
+    read = whisk_io.read_whiskers(filename)
+    assert len(read) == len(segments)
+    np.testing.assert_array_equal(read['fid'], [s[0] for s in segments])
+    np.testing.assert_array_equal(read['wid'], [s[1] for s in segments])
+    np.testing.assert_array_equal(read['npoints'], [len(s[2]) for s in segments])
+    for record, (_, _, x, y) in zip(read, segments):
+        if len(x):
+            assert (record['x0'], record['y0'], record['x1'], record['y1']) == (x[0], y[0], x[-1], y[-1])
+        else:
+            assert np.isnan(record['x0'])
+
+
+def test_whiskers_timedata_matches_the_loader_output(tmp_path):
+    segments = _segments()
+    filename = str(tmp_path / 'video.whiskers')
+    _write_whiskers(filename, segments)
+    traced = [(fid, x, y) for fid, _, x, y in segments if len(x) > 1]
+    degrees = [np.degrees(np.arctan(-(float(y[-1]) - y[0]) / ((float(x[-1]) - x[0]) or np.finfo(float).tiny)))
+               for _, x, y in traced]
+    expected = _timedata([fid for fid, _, _ in traced], degrees)
+    pd.testing.assert_frame_equal(whisk_io.whiskers_timedata(filename), expected, check_dtype=False)
+
+
+def test_measurements_timedata_matches_the_loader_output(tmp_path):
+    rng = np.random.default_rng(1)
+    rows = [(fid, int(wid), float(rng.uniform(-60, 60))) for fid in range(40) for wid in range(-1, rng.integers(0, 5))]
+    filename = str(tmp_path / 'video.measurements')
+    _write_measurements(filename, rows)
+    whiskers = [(fid, angle) for fid, wid, angle in rows if wid >= 0]
+    expected = _timedata([fid for fid, _ in whiskers], [angle for _, angle in whiskers])
+    pd.testing.assert_frame_equal(whisk_io.measurements_timedata(filename), expected, check_dtype=False)
+
+
+@pytest.mark.parametrize('cut', [1, 4, 20])
+def test_truncated_whiskers_file_is_an_error(tmp_path, cut):
+    filename = tmp_path / 'video.whiskers'
+    _write_whiskers(str(filename), _segments(5))
+    filename.write_bytes(filename.read_bytes()[:-cut])
+    with pytest.raises(IOError):
+        whisk_io.read_whiskers(str(filename))
+
+
+def test_empty_whiskers_file(tmp_path):
+    filename = str(tmp_path / 'video.whiskers')
+    _write_whiskers(filename, [])
+    assert len(whisk_io.read_whiskers(filename)) == 0